@@ -0,0 +1,322 @@
+import io
+import time
+import signal
+import asyncio
+import logging
+import argparse
+
+import aiomqtt
+import asyncpg
+
+from mqtt_subscriber import (DB_PARAMS, MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, GATEWAY_TOPIC,
+                             BATCH_SIZE, FLUSH_INTERVAL, POOL_SIZE, CONNECT_TIMEOUT,
+                             STATEMENT_TIMEOUT, METRICS_PORT, DEDUPLICATE, UPDATE_WATERMARKS,
+                             READING_COLUMNS, STAGING_TABLE_QUERY, STAGING_INSERT_QUERY,
+                             STAGING_APPEND_QUERY, REGISTER_METERS_QUERY, LOAD_METERS_QUERY,
+                             UPDATE_WATERMARKS_QUERY, MeterRegistry, DuplicateFilter,
+                             PayloadDecodeError,
+                             parse_readings, rows_to_copy_text, MESSAGES_RECEIVED,
+                             MESSAGES_DECODED, MESSAGES_FAILED, ROWS_WRITTEN, ROWS_FAILED,
+                             DUPLICATES_FILTERED, DUPLICATES_CONFLICTED, BATCH_ROWS,
+                             FLUSH_SECONDS, COMMIT_SECONDS, QUEUE_DEPTH, POOL_OPEN_CONNECTIONS,
+                             METERS_REGISTERED, METERS_CACHED, BATCH_LOG, MESSAGE_ERROR_LOG)
+from metrics import start_metrics_server
+from watermarks import WATERMARKS_TABLE_QUERY
+
+# Batches allowed to wait for a free writer before the receive loop pauses;
+# together with the writers this bounds how much is in flight at once
+MAX_PENDING_BATCHES = 8
+MQTT_RECONNECT_DELAY = 2.0  # Seconds before reconnecting to the broker
+
+def asyncpg_params():
+    """DB_PARAMS translated to asyncpg keyword names"""
+    return {
+        'database': DB_PARAMS['dbname'],
+        'user': DB_PARAMS['user'],
+        'password': DB_PARAMS['password'],
+        'host': DB_PARAMS['host'],
+        'port': int(DB_PARAMS['port']),
+    }
+
+# Errors meaning the connection itself is gone; the batch is retried on a fresh one
+CONNECTION_ERRORS = (asyncpg.InterfaceError, asyncpg.ConnectionDoesNotExistError,
+                     asyncpg.PostgresConnectionError, ConnectionError)
+
+# asyncpg takes $n placeholders rather than psycopg2's %s
+LOOKUP_METERS_QUERY = "SELECT meter_id, meter_key FROM meters WHERE meter_id = ANY($1::text[])"
+
+async def create_pool(size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                      statement_timeout=STATEMENT_TIMEOUT):
+    """asyncpg pool whose connections each carry the staging table"""
+    async def init(conn):
+        await conn.execute(STAGING_TABLE_QUERY)
+
+    return await asyncpg.create_pool(min_size=size, max_size=size, timeout=connect_timeout,
+                                     server_settings={'statement_timeout': str(statement_timeout)},
+                                     init=init, **asyncpg_params())
+
+class AsyncIngestor:
+    """Decode, batch and write readings with several batches in flight.
+
+    ``submit`` decodes on the event loop and appends to the open batch.
+    Full (or timed-out) batches go onto a bounded queue drained by one
+    writer task per pool connection, so commits overlap with each other
+    and with decoding of the next batch.
+    """
+
+    def __init__(self, pool, writers=POOL_SIZE, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING_BATCHES,
+                 deduplicate=DEDUPLICATE, duplicate_filter=None, meter_registry=None,
+                 watermarks=False):
+        self.pool = pool
+        self.watermarks = watermarks
+        self.meter_registry = meter_registry if meter_registry is not None else MeterRegistry()
+        self.writers = writers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.deduplicate = deduplicate
+        self.duplicate_filter = duplicate_filter
+
+        self._batch = []
+        self._batch_started = None
+        self._batches = asyncio.Queue(max_pending)
+        self._tasks = []
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.duplicates_dropped = 0
+        self.batches_written = 0
+
+    async def load_meters(self):
+        """Warm the meter registry cache from the meters table"""
+        async with self.pool.acquire() as conn:
+            self.meter_registry.update(tuple(record) for record in await conn.fetch(LOAD_METERS_QUERY))
+        logging.info(f"Loaded {len(self.meter_registry)} registered meters")
+
+    async def check_watermarks(self):
+        """Only update ingest_watermarks if the table exists"""
+        if not self.watermarks:
+            return
+        async with self.pool.acquire() as conn:
+            self.watermarks = await conn.fetchval(WATERMARKS_TABLE_QUERY)
+        if not self.watermarks:
+            logging.warning("Not updating ingest_watermarks (run ingest_watermarks_setup.sql)")
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._write_loop(), name=f"writer-{i}")
+                       for i in range(self.writers)]
+        self._timer = asyncio.create_task(self._flush_on_timer(), name="flush-timer")
+
+    async def submit(self, topic, payload):
+        """Decode one message and add its reading(s) to the open batch"""
+        try:
+            readings = parse_readings(topic, payload)
+        except PayloadDecodeError as e:
+            MESSAGES_FAILED.inc()
+            MESSAGE_ERROR_LOG.error(f"Payload decode error: {e}")
+            return
+        except Exception as e:
+            MESSAGES_FAILED.inc()
+            MESSAGE_ERROR_LOG.error(f"Error processing message: {e}")
+            return
+        MESSAGES_DECODED.inc()
+        for row, _ in readings:
+            if self.duplicate_filter is not None and self.duplicate_filter.seen(row[0], row[1]):
+                self.duplicates_dropped += 1
+                DUPLICATES_FILTERED.inc()
+                continue
+            if not self._batch:
+                self._batch_started = time.monotonic()
+            self._batch.append(row)
+            if len(self._batch) >= self.batch_size:
+                await self._seal_batch()
+
+    async def _seal_batch(self):
+        """Hand the open batch to the writers, waiting if too many are pending"""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        self._batch_started = None
+        await self._batches.put(batch)
+
+    async def _flush_on_timer(self):
+        while True:
+            started = self._batch_started
+            if started is None:
+                await asyncio.sleep(self.flush_interval)
+                continue
+            wait = started + self.flush_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            await self._seal_batch()
+
+    async def _write_loop(self):
+        while True:
+            rows = await self._batches.get()
+            if rows is None:
+                return
+            await self._write(rows)
+
+    async def _write(self, rows):
+        BATCH_ROWS.observe(len(rows))
+        started = time.perf_counter()
+        copy_data = rows_to_copy_text(rows).encode('utf-8')
+        new_meters = self.meter_registry.unknown(row[0] for row in rows)
+        try:
+            # One retry on a fresh connection covers connections that died while idle
+            for attempt in (1, 2):
+                try:
+                    inserted, registered = await self._write_batch(copy_data, new_meters)
+                    break
+                except CONNECTION_ERRORS as e:
+                    if attempt == 2:
+                        raise
+                    logging.warning(f"Database connection lost, retrying batch: {e}")
+        except Exception as e:
+            self.rows_failed += len(rows)
+            ROWS_FAILED.inc(len(rows))
+            logging.error(f"Error writing batch of {len(rows)} readings: {e}")
+            if self.duplicate_filter is not None:
+                # Let the redeliveries of the lost readings through
+                self.duplicate_filter.forget(rows)
+            return
+        finally:
+            FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+        if new_meters:
+            self.meter_registry.update(tuple(record) for record in registered)
+            METERS_REGISTERED.inc(len(new_meters))
+        self.rows_written += inserted
+        self.batches_written += 1
+        self.duplicates_dropped += len(rows) - inserted
+        ROWS_WRITTEN.inc(inserted)
+        if inserted < len(rows):
+            DUPLICATES_CONFLICTED.inc(len(rows) - inserted)
+        BATCH_LOG.info(f"Stored batch of {len(rows)} readings")
+
+    async def _write_batch(self, copy_data, new_meters):
+        """COPY one batch in a transaction; return (rows inserted, new meter keys)"""
+        registered = []
+        async with self.pool.acquire() as conn:
+            try:
+                async with conn.transaction():
+                    await conn.copy_to_table('energy_readings_staging',
+                                             source=io.BytesIO(copy_data),
+                                             columns=READING_COLUMNS, format='text')
+                    if new_meters:
+                        await conn.execute(REGISTER_METERS_QUERY)
+                    status = await conn.execute(STAGING_INSERT_QUERY if self.deduplicate
+                                                else STAGING_APPEND_QUERY)
+                    inserted = int(status.split()[-1])
+                    if self.watermarks:
+                        await conn.execute(UPDATE_WATERMARKS_QUERY)
+                    if new_meters:
+                        registered = await conn.fetch(LOOKUP_METERS_QUERY, list(new_meters))
+                    commit_started = time.perf_counter()
+                COMMIT_SECONDS.observe(time.perf_counter() - commit_started)
+            except CONNECTION_ERRORS:
+                # Close it so the pool opens a fresh connection in its place
+                conn.terminate()
+                raise
+        return inserted, registered
+
+    def pending_batches(self):
+        return self._batches.qsize()
+
+    async def close(self):
+        """Write the open batch, wait for every writer to finish, then stop"""
+        self._timer.cancel()
+        await self._seal_batch()
+        for _ in self._tasks:
+            await self._batches.put(None)
+        await asyncio.gather(*self._tasks)
+        logging.info(f"Async ingestor closed: {self.rows_written} readings in "
+                     f"{self.batches_written} batches, {self.duplicates_dropped} duplicates, "
+                     f"{self.rows_failed} failed")
+
+async def receive(ingestor, broker, port, topics):
+    """Feed MQTT messages to the ingestor, reconnecting to the broker as needed"""
+    while True:
+        try:
+            async with aiomqtt.Client(broker, port, keepalive=60) as client:
+                logging.info(f"Connected to MQTT broker at {broker}:{port}, "
+                             f"subscribing to {', '.join(topics)}")
+                await client.subscribe([(topic, 0) for topic in topics])
+                async for message in client.messages:
+                    MESSAGES_RECEIVED.inc()
+                    await ingestor.submit(str(message.topic), message.payload)
+        except aiomqtt.MqttError as e:
+            logging.error(f"MQTT connection error: {e}; reconnecting in {MQTT_RECONNECT_DELAY}s")
+            await asyncio.sleep(MQTT_RECONNECT_DELAY)
+
+async def run(args):
+    pool = await create_pool(args.pool_size, args.connect_timeout, args.statement_timeout)
+    ingestor = AsyncIngestor(pool, writers=args.pool_size, batch_size=args.batch_size,
+                             flush_interval=args.flush_interval, max_pending=args.max_pending,
+                             deduplicate=args.deduplicate,
+                             duplicate_filter=DuplicateFilter() if args.deduplicate else None,
+                             watermarks=args.watermarks)
+    await ingestor.load_meters()
+    await ingestor.check_watermarks()
+    ingestor.start()
+
+    if args.metrics_port:
+        QUEUE_DEPTH.set_function(ingestor.pending_batches)
+        METERS_CACHED.set_function(lambda: len(ingestor.meter_registry))
+        POOL_OPEN_CONNECTIONS.set_function(pool.get_size)
+        start_metrics_server(args.metrics_port)
+
+    topics = [args.topic] + ([args.gateway_topic] if args.gateway_topic else [])
+    receiver = asyncio.create_task(receive(ingestor, args.broker, args.port, topics))
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, receiver.cancel)
+
+    try:
+        await receiver
+    except asyncio.CancelledError:
+        logging.info("Shutting down async subscriber")
+    finally:
+        await ingestor.close()
+        await pool.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="asyncio subscriber storing MQTT meter readings "
+                                                 "in TimescaleDB with pipelined writes")
+    parser.add_argument('--broker', default=MQTT_BROKER,
+                        help=f"MQTT broker host (default: {MQTT_BROKER})")
+    parser.add_argument('--port', type=int, default=MQTT_PORT,
+                        help=f"MQTT broker port (default: {MQTT_PORT})")
+    parser.add_argument('--topic', default=MQTT_TOPIC,
+                        help=f"topic filter to subscribe to (default: {MQTT_TOPIC})")
+    parser.add_argument('--gateway-topic', default=GATEWAY_TOPIC,
+                        help=f"topic filter for batched gateway messages; empty disables "
+                             f"(default: {GATEWAY_TOPIC})")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f"readings per COPY batch (default: {BATCH_SIZE})")
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL,
+                        help=f"maximum seconds a reading is buffered (default: {FLUSH_INTERVAL})")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE,
+                        help=f"database connections, one writer task each (default: {POOL_SIZE})")
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING_BATCHES,
+                        help=f"sealed batches waiting for a writer before receiving pauses "
+                             f"(default: {MAX_PENDING_BATCHES})")
+    parser.add_argument('--connect-timeout', type=int, default=CONNECT_TIMEOUT,
+                        help=f"seconds to wait when connecting (default: {CONNECT_TIMEOUT})")
+    parser.add_argument('--statement-timeout', type=int, default=STATEMENT_TIMEOUT,
+                        help=f"server-side statement timeout in ms (default: {STATEMENT_TIMEOUT})")
+    parser.add_argument('--no-dedup', dest='deduplicate', action='store_false',
+                        help="insert without the ON CONFLICT duplicate checks")
+    parser.add_argument('--no-watermarks', dest='watermarks', action='store_false',
+                        default=UPDATE_WATERMARKS,
+                        help="do not update ingest_watermarks on each batch")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="serve Prometheus metrics on this port, 0 disables (default: 0)")
+    return parser.parse_args(argv)
+
+def main():
+    asyncio.run(run(parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import json
+import timeit
+import logging
+import argparse
+from datetime import datetime
+
+import payload_codec
+from payload_codec import PAYLOAD_FORMATS, encode_reading, decode_reading
+from data_generator import SmartMeter
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Number of encode/decode calls timed per format
+ITERATIONS = 200000
+
+def available_formats():
+    """Formats whose optional dependencies are installed"""
+    formats = ['json', 'binary']
+    if payload_codec.msgpack is not None:
+        formats.append('msgpack')
+    return formats
+
+def benchmark_format(payload_format, reading, iterations):
+    """Return (payload bytes, encode ns/reading, decode ns/reading)"""
+    payload = encode_reading(reading, payload_format)
+    encode_time = timeit.timeit(lambda: encode_reading(reading, payload_format), number=iterations)
+    decode_time = timeit.timeit(lambda: decode_reading(payload), number=iterations)
+    return len(payload), encode_time / iterations * 1e9, decode_time / iterations * 1e9
+
+def benchmark_legacy_json(reading, iterations):
+    """The original path: json.dumps on publish, .decode + json.loads on receive"""
+    payload = json.dumps(reading).encode('utf-8')
+    encode_time = timeit.timeit(lambda: json.dumps(reading).encode('utf-8'), number=iterations)
+    decode_time = timeit.timeit(lambda: json.loads(payload.decode('utf-8')), number=iterations)
+    return len(payload), encode_time / iterations * 1e9, decode_time / iterations * 1e9
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare payload codec cost per reading")
+    parser.add_argument('--iterations', type=int, default=ITERATIONS,
+                        help=f"calls timed per format (default: {ITERATIONS})")
+    args = parser.parse_args()
+
+    reading = SmartMeter("1234567890").generate_reading(datetime.now())
+    json_backend = "orjson" if payload_codec.orjson is not None else "json"
+
+    results = [("json (stdlib, legacy path)",) + benchmark_legacy_json(reading, args.iterations)]
+    for payload_format in available_formats():
+        label = f"json ({json_backend})" if payload_format == 'json' else payload_format
+        results.append((label,) + benchmark_format(payload_format, reading, args.iterations))
+    missing = sorted(set(PAYLOAD_FORMATS) - set(available_formats()))
+    if missing:
+        logging.info(f"Skipping formats without installed dependencies: {', '.join(missing)}")
+
+    print(f"{'Format':<28} {'Bytes':>6} {'Encode ns':>10} {'Decode ns':>10}")
+    for label, size, encode_ns, decode_ns in results:
+        print(f"{label:<28} {size:>6} {encode_ns:>10.0f} {decode_ns:>10.0f}")
+
+if __name__ == "__main__":
+    main()
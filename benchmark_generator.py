@@ -0,0 +1,73 @@
+import time
+import logging
+import argparse
+from datetime import datetime, timedelta
+
+from data_generator import SmartMeter, generate_meter_ids
+from fleet_generator import Fleet, READING_INTERVAL
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Fleet sizes compared
+METER_COUNTS = (500, 10000, 100000)
+
+# Time steps generated per run (288 five-minute steps = 1 day)
+STEPS = 288
+
+def time_scalar(meters, start, steps):
+    """The current path: one SmartMeter.generate_reading call per meter per step"""
+    started = time.perf_counter()
+    timestamp = start
+    for _ in range(steps):
+        for meter in meters:
+            meter.generate_reading(timestamp)
+        timestamp += timedelta(seconds=READING_INTERVAL)
+    return time.perf_counter() - started
+
+def time_fleet_steps(fleet, start, steps):
+    """One vectorized Fleet.generate_step call per step"""
+    started = time.perf_counter()
+    timestamp = start
+    for _ in range(steps):
+        fleet.generate_step(timestamp)
+        timestamp += timedelta(seconds=READING_INTERVAL)
+    return time.perf_counter() - started
+
+def time_fleet_range(fleet, start, steps):
+    """A single Fleet.generate_range call covering every step"""
+    started = time.perf_counter()
+    fleet.generate_range(start, start + timedelta(seconds=READING_INTERVAL * steps))
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare scalar and vectorized reading generation")
+    parser.add_argument('--meters', type=int, nargs='+', default=list(METER_COUNTS),
+                        help=f"fleet sizes to time (default: {' '.join(map(str, METER_COUNTS))})")
+    parser.add_argument('--steps', type=int, default=STEPS,
+                        help=f"time steps generated per run (default: {STEPS})")
+    parser.add_argument('--scalar-limit', type=int, default=2000000,
+                        help="skip the scalar path above this many readings (default: 2000000)")
+    args = parser.parse_args()
+
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    results = []
+    for count in args.meters:
+        meters = [SmartMeter(meter_id) for meter_id in generate_meter_ids(count)]
+        fleet = Fleet.from_meters(meters)
+        readings = count * args.steps
+
+        if readings <= args.scalar_limit:
+            results.append(('scalar', count, readings / time_scalar(meters, start, args.steps)))
+        else:
+            logging.info(f"Skipping scalar path for {count} meters ({readings} readings)")
+        results.append(('fleet step', count, readings / time_fleet_steps(fleet, start, args.steps)))
+        results.append(('fleet range', count, readings / time_fleet_range(fleet, start, args.steps)))
+
+    print(f"{'Path':<12} {'Meters':>8} {'Readings/s':>14}")
+    for path, count, rate in results:
+        print(f"{path:<12} {count:>8} {rate:>14,.0f}")
+
+if __name__ == "__main__":
+    main()
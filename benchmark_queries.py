@@ -0,0 +1,448 @@
+import re
+import json
+import time
+import random
+import logging
+import argparse
+import subprocess
+from datetime import datetime
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import psycopg2
+
+from mqtt_subscriber import DB_PARAMS
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Example, against a local database with data loaded and benchmark_results_setup.sql applied:
+#   python benchmark_queries.py
+#   python benchmark_queries.py --suites five_minute --repetitions 50 --meters 200
+#   python benchmark_queries.py --cold-command "sudo systemctl restart postgresql"
+
+# Benchmark suites, as (name, SQL file). Only the EXPLAIN ANALYZE statements
+# of each file are run; setup statements (ALTER TABLE, compress_chunk, ...) are
+# skipped, so the compression suite measures whatever state the tables are in.
+SUITES = (
+    ('baseline', 'baseline_queries.sql'),
+    ('chunk_comparison', 'chunk_comparison_queries.sql'),
+    ('five_minute', 'five_minute_benchmarks.sql'),
+    ('compression', 'compression_setup.sql'),
+)
+
+# Per-meter queries pick "some meter" with this subquery; the runner replaces it
+# with a meter drawn at random for every execution
+METER_SUBQUERY = "(SELECT meter_key FROM energy_readings LIMIT 1)"
+
+REPETITIONS = 20  # Warm executions per query
+WARMUP = 1  # Warm-up executions per query, not recorded
+COLD_RUNS = 3  # Executions per query on a fresh connection
+SAMPLE_METERS = 50  # Meters drawn for per-meter queries
+STATEMENT_TIMEOUT = 60000  # Milliseconds per execution
+PERCENTILES = (50, 95, 99)
+
+RESULTS_FILE = 'performance_results.md'
+# performance_results.md is regenerated between these markers; the rest is kept
+MARKDOWN_BEGIN = '<!-- benchmark_queries.py: begin -->'
+MARKDOWN_END = '<!-- benchmark_queries.py: end -->'
+
+# A query regresses when its warm p50 exceeds the median of its previous
+# BASELINE_RUNS runs by REGRESSION_RATIO and by at least REGRESSION_FLOOR_MS
+BASELINE_RUNS = 5
+REGRESSION_RATIO = 1.2
+REGRESSION_FLOOR_MS = 1.0
+HISTORY_RUNS = 30  # Runs loaded for history and regression checks
+
+HYPERTABLES = ('energy_readings', 'energy_readings_3h', 'energy_readings_week')
+
+# Chunk interval of each hypertable, for the comparison table
+CHUNK_LABELS = (
+    ('energy_readings_3h', '3-hour chunks'),
+    ('energy_readings', '1-day chunks'),
+    ('energy_readings_week', '1-week chunks'),
+)
+
+RESULTS_TABLE_QUERY = "SELECT to_regclass('benchmark_results') IS NOT NULL"
+METERS_QUERY = "SELECT meter_key FROM meters ORDER BY random() LIMIT %s"
+SIZES_QUERY = """
+SELECT h.hypertable_name,
+       hypertable_size(format('%%I.%%I', h.hypertable_schema, h.hypertable_name)::regclass),
+       COUNT(c.chunk_name),
+       COUNT(c.chunk_name) FILTER (WHERE c.is_compressed)
+FROM timescaledb_information.hypertables h
+LEFT JOIN timescaledb_information.chunks c
+       ON c.hypertable_schema = h.hypertable_schema AND c.hypertable_name = h.hypertable_name
+WHERE h.hypertable_name = ANY(%s)
+GROUP BY h.hypertable_schema, h.hypertable_name
+ORDER BY h.hypertable_name
+"""
+INSERT_RUN_QUERY = """
+INSERT INTO benchmark_runs (git_commit, repetitions, cold_runs, meters, notes)
+VALUES (%s, %s, %s, %s, %s)
+RETURNING run_id, started_at
+"""
+INSERT_RESULT_QUERY = """
+INSERT INTO benchmark_results (run_id, suite, query, target, mode, description, samples,
+                               p50_ms, p95_ms, p99_ms, mean_ms, planning_ms,
+                               shared_hit, shared_read)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+INSERT_SIZE_QUERY = """
+INSERT INTO benchmark_sizes (run_id, hypertable, total_bytes, chunks, compressed_chunks)
+VALUES (%s, %s, %s, %s, %s)
+"""
+HISTORY_QUERY = """
+SELECT r.run_id, r.started_at, r.git_commit, b.suite, b.query, b.target, b.mode,
+       b.description, b.samples, b.p50_ms, b.p95_ms, b.p99_ms, b.planning_ms,
+       b.shared_hit, b.shared_read
+FROM benchmark_results b
+JOIN benchmark_runs r ON r.run_id = b.run_id
+WHERE r.run_id IN (SELECT run_id FROM benchmark_runs ORDER BY run_id DESC LIMIT %s)
+ORDER BY r.run_id, b.suite, b.query, b.target, b.mode
+"""
+SIZES_HISTORY_QUERY = """
+SELECT r.run_id, r.started_at, s.hypertable, s.total_bytes, s.chunks, s.compressed_chunks
+FROM benchmark_sizes s
+JOIN benchmark_runs r ON r.run_id = s.run_id
+WHERE r.run_id IN (SELECT run_id FROM benchmark_runs ORDER BY run_id DESC LIMIT %s)
+ORDER BY r.run_id, s.hypertable
+"""
+
+BenchmarkQuery = namedtuple('BenchmarkQuery', 'suite label target description sql per_meter')
+Sample = namedtuple('Sample', 'execution_ms planning_ms shared_hit shared_read')
+Summary = namedtuple('Summary', 'samples p50 p95 p99 mean planning shared_hit shared_read')
+
+REGRESSION_COLUMNS = ['suite', 'query', 'target', 'description', 'baseline_ms', 'p50_ms', 'change']
+
+def load_suite(suite, path):
+    """EXPLAIN ANALYZE statements of a SQL file as BenchmarkQuery tuples, without the EXPLAIN"""
+    with open(path) as f:
+        text = f.read()
+    queries = {}
+    for statement in text.split(';'):
+        comments, body = [], []
+        for line in statement.strip().splitlines():
+            if body:
+                body.append(line)
+            elif line.strip().startswith('--'):
+                comments.append(line.strip().lstrip('-').strip())
+            elif line.strip():
+                body.append(line)
+        sql = '\n'.join(body).strip()
+        if not sql.upper().startswith('EXPLAIN ANALYZE'):
+            continue
+        sql = sql[len('EXPLAIN ANALYZE'):].strip()
+        comment = comments[-1] if comments else ''
+        heading = re.match(r'Query (\d+)[^:]*(?::\s*(.*))?', comment)
+        number = heading.group(1) if heading else str(len(queries) + 1)
+        description = heading.group(2) if heading and heading.group(2) else comment
+        target = re.search(r'\bFROM\s+(\w+)', sql).group(1)
+        # Suites repeat a query to compare before and after a change; measure it once
+        key = (f"Q{number}", target)
+        if key not in queries:
+            per_meter = METER_SUBQUERY in sql
+            if per_meter:
+                sql = sql.replace('%', '%%').replace(METER_SUBQUERY, '%(meter_key)s')
+            queries[key] = BenchmarkQuery(suite, key[0], target, description, sql, per_meter)
+    return list(queries.values())
+
+def connect(timeout, wait=30.0):
+    """Open a benchmark connection, waiting for the server (after a cold-cache restart)"""
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return psycopg2.connect(**DB_PARAMS, options=f"-c statement_timeout={timeout}")
+        except psycopg2.OperationalError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(1.0)
+
+def explain(conn, query, meter_key=None):
+    """Run one EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) execution of a query"""
+    params = {'meter_key': meter_key} if query.per_meter else None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query.sql}", params)
+            result = cursor.fetchone()[0]
+    finally:
+        conn.rollback()
+    plan = (json.loads(result) if isinstance(result, str) else result)[0]
+    # The top plan node's buffer counts include every node below it
+    return Sample(plan['Execution Time'], plan.get('Planning Time', 0.0),
+                  plan['Plan'].get('Shared Hit Blocks', 0), plan['Plan'].get('Shared Read Blocks', 0))
+
+def summarize(samples):
+    times = np.array([sample.execution_ms for sample in samples])
+    p50, p95, p99 = np.percentile(times, PERCENTILES)
+    return Summary(len(samples), p50, p95, p99, times.mean(),
+                   float(np.median([sample.planning_ms for sample in samples])),
+                   int(np.median([sample.shared_hit for sample in samples])),
+                   int(np.median([sample.shared_read for sample in samples])))
+
+def run_query(query, conn, meters, args):
+    """Cold then warm executions of one query; returns {mode: Summary}"""
+    draw = lambda: random.choice(meters) if query.per_meter else None
+    cold = []
+    for _ in range(args.cold_runs):
+        if args.cold_command:
+            subprocess.run(args.cold_command, shell=True, check=True)
+        # A new backend starts without cached plans or catalog entries; only
+        # --cold-command can also empty shared buffers and the OS page cache
+        cold_conn = connect(args.timeout)
+        try:
+            cold.append(explain(cold_conn, query, draw()))
+        finally:
+            cold_conn.close()
+    for _ in range(args.warmup):
+        explain(conn, query, draw())
+    warm = [explain(conn, query, draw()) for _ in range(args.repetitions)]
+    summaries = {'warm': summarize(warm)}
+    if cold:
+        summaries['cold'] = summarize(cold)
+    return summaries
+
+def sample_meters(conn, count):
+    with conn.cursor() as cursor:
+        cursor.execute(METERS_QUERY, (count,))
+        meters = [row[0] for row in cursor.fetchall()]
+    conn.rollback()
+    return meters
+
+def table_sizes(conn):
+    """(hypertable, total bytes, chunks, compressed chunks) per benchmarked hypertable"""
+    with conn.cursor() as cursor:
+        cursor.execute(SIZES_QUERY, (list(HYPERTABLES),))
+        sizes = cursor.fetchall()
+    conn.rollback()
+    return sizes
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def store_run(conn, results, sizes, args):
+    """Insert a run and its results; returns (run_id, started_at)"""
+    with conn.cursor() as cursor:
+        cursor.execute(INSERT_RUN_QUERY, (git_commit(), args.repetitions, args.cold_runs,
+                                          args.meters, args.notes))
+        run_id, started_at = cursor.fetchone()
+        for (query, mode), summary in results.items():
+            cursor.execute(INSERT_RESULT_QUERY, (
+                run_id, query.suite, query.label, query.target, mode, query.description,
+                summary.samples, summary.p50, summary.p95, summary.p99, summary.mean,
+                summary.planning, summary.shared_hit, summary.shared_read))
+        for size in sizes:
+            cursor.execute(INSERT_SIZE_QUERY, (run_id,) + tuple(size))
+    conn.commit()
+    return run_id, started_at
+
+def load_history(conn, runs=HISTORY_RUNS):
+    with conn.cursor() as cursor:
+        cursor.execute(HISTORY_QUERY, (runs,))
+        columns = [column[0] for column in cursor.description]
+        history = pd.DataFrame(cursor.fetchall(), columns=columns)
+    conn.rollback()
+    return history
+
+def find_regressions(history, ratio=REGRESSION_RATIO, floor_ms=REGRESSION_FLOOR_MS,
+                     baseline_runs=BASELINE_RUNS):
+    """Queries of the latest run whose warm p50 regressed against their recent runs"""
+    rows = []
+    if history.empty:
+        return pd.DataFrame(rows, columns=REGRESSION_COLUMNS)
+    latest_run = history['run_id'].max()
+    warm = history[history['mode'] == 'warm'].sort_values('run_id')
+    for (suite, query, target), group in warm.groupby(['suite', 'query', 'target']):
+        latest = group.iloc[-1]
+        if latest['run_id'] != latest_run or len(group) < 2:
+            continue
+        baseline = group['p50_ms'].iloc[-baseline_runs - 1:-1].median()
+        if latest['p50_ms'] >= baseline * ratio and latest['p50_ms'] - baseline >= floor_ms:
+            rows.append((suite, query, target, latest['description'], baseline,
+                         latest['p50_ms'], latest['p50_ms'] / baseline - 1))
+    return pd.DataFrame(rows, columns=REGRESSION_COLUMNS)
+
+def _format_bytes(size):
+    for unit in ('bytes', 'kB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.0f} {unit}" if unit == 'bytes' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def render_markdown(results, sizes, regressions, run_id, started_at, args):
+    """Benchmark sections of performance_results.md"""
+    by_key = {(query.suite, query.label, query.target, mode): summary
+              for (query, mode), summary in results.items()}
+    queries = {}
+    for query, _ in results:
+        queries.setdefault(query.suite, {})[(query.label, query.target)] = query
+
+    run = f"run {run_id}" if run_id is not None else "unsaved run"
+    lines = [f"_Generated by `benchmark_queries.py` ({run}, {started_at:%Y-%m-%d %H:%M}): "
+             f"{args.repetitions} warm executions after {args.warmup} warm-up, "
+             f"{args.cold_runs} cold, per-meter queries over {args.meters} random meters. "
+             f"Server-side execution time; buffers are median shared blocks hit / read._", ""]
+
+    def timing_table(title, suite):
+        if suite not in queries:
+            return
+        lines.extend([f"## {title}", "",
+                      "| Query | Description | Table | p50 | p95 | p99 | Cold p50 | Buffers hit / read |",
+                      "|-------|-------------|-------|-----|-----|-----|----------|--------------------|"])
+        for (label, target), query in sorted(queries[suite].items()):
+            warm = by_key[(suite, label, target, 'warm')]
+            cold = by_key.get((suite, label, target, 'cold'))
+            cold_p50 = f"{cold.p50:.3f} ms" if cold else "-"
+            lines.append(f"| {label[1:]} | {query.description} | {target} | {warm.p50:.3f} ms | "
+                         f"{warm.p95:.3f} ms | {warm.p99:.3f} ms | {cold_p50} | "
+                         f"{warm.shared_hit} / {warm.shared_read} |")
+        lines.append("")
+
+    timing_table("Baseline Queries with 1-day chunks", 'baseline')
+
+    # Chunk comparison: the 1-day column comes from the baseline suite
+    chunk_rows = {}
+    for suite in ('chunk_comparison', 'baseline'):
+        for (label, target), query in queries.get(suite, {}).items():
+            chunk_rows.setdefault(label, [query.description, {}])[1][target] = \
+                by_key[(suite, label, target, 'warm')]
+    if 'chunk_comparison' in queries:
+        lines.extend(["## Chunk Interval Comparison Results", "",
+                      "Warm p50 / p95.", "",
+                      "| Query | Description | " + " | ".join(name for _, name in CHUNK_LABELS) + " |",
+                      "|-------|-------------|" + "|".join("-" * (len(name) + 2) for _, name in CHUNK_LABELS) + "|"])
+        for label, (description, by_target) in sorted(chunk_rows.items()):
+            cells = [f"{by_target[table].p50:.3f} / {by_target[table].p95:.3f} ms"
+                     if table in by_target else "-" for table, _ in CHUNK_LABELS]
+            lines.append(f"| {label[1:]} | {description} | " + " | ".join(cells) + " |")
+        lines.append("")
+
+    timing_table("5-Minute Interval Queries (random meter per execution)", 'five_minute')
+    timing_table("Queries from the Compression Suite", 'compression')
+
+    if sizes:
+        lines.extend(["## Storage and Compression", "",
+                      "| Hypertable | Size | Chunks | Compressed chunks |",
+                      "|------------|------|--------|-------------------|"])
+        for hypertable, total_bytes, chunks, compressed in sizes:
+            lines.append(f"| {hypertable} | {_format_bytes(total_bytes)} | {chunks} | {compressed} |")
+        lines.append("")
+
+    lines.extend(["## Regressions", ""])
+    if regressions is None:
+        lines.append("Not checked (run not stored).")
+    elif regressions.empty:
+        lines.append(f"None: no warm p50 is {REGRESSION_RATIO - 1:.0%} or more above its median "
+                     f"over the previous {BASELINE_RUNS} runs.")
+    else:
+        lines.extend(["| Suite | Query | Table | Baseline p50 | p50 | Change |",
+                      "|-------|-------|-------|--------------|-----|--------|"])
+        for row in regressions.itertuples():
+            lines.append(f"| {row.suite} | {row.query[1:]} | {row.target} | {row.baseline_ms:.3f} ms | "
+                         f"{row.p50_ms:.3f} ms | +{row.change:.0%} |")
+    return '\n'.join(lines)
+
+def update_results_file(path, generated):
+    """Replace the generated block of the results file, appending one if there is none"""
+    try:
+        with open(path) as f:
+            text = f.read()
+    except FileNotFoundError:
+        text = "# Performance Results\n"
+    block = f"{MARKDOWN_BEGIN}\n{generated}\n{MARKDOWN_END}"
+    if MARKDOWN_BEGIN in text and MARKDOWN_END in text:
+        head, rest = text.split(MARKDOWN_BEGIN, 1)
+        text = head + block + rest.split(MARKDOWN_END, 1)[1]
+    else:
+        text = text.rstrip('\n') + "\n\n" + block + "\n"
+    with open(path, 'w') as f:
+        f.write(text)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the SQL query suites with repeated EXPLAIN (ANALYZE, BUFFERS) runs, "
+                    "store the results and regenerate the results markdown.")
+    suite_names = [name for name, _ in SUITES]
+    parser.add_argument('--suites', nargs='+', choices=suite_names, default=suite_names,
+                        help="suites to run (default: all)")
+    parser.add_argument('--repetitions', type=int, default=REPETITIONS,
+                        help=f"warm executions per query (default: {REPETITIONS})")
+    parser.add_argument('--warmup', type=int, default=WARMUP,
+                        help=f"unrecorded warm-up executions per query (default: {WARMUP})")
+    parser.add_argument('--cold-runs', type=int, default=COLD_RUNS,
+                        help=f"executions per query on a fresh connection (default: {COLD_RUNS})")
+    parser.add_argument('--cold-command',
+                        help="shell command run before each cold execution, e.g. one that restarts "
+                             "PostgreSQL and drops the OS page cache")
+    parser.add_argument('--meters', type=int, default=SAMPLE_METERS,
+                        help=f"random meters for per-meter queries (default: {SAMPLE_METERS})")
+    parser.add_argument('--seed', type=int,
+                        help="random seed for the meter draws (default: unseeded)")
+    parser.add_argument('--timeout', type=int, default=STATEMENT_TIMEOUT,
+                        help=f"statement timeout per execution in ms (default: {STATEMENT_TIMEOUT})")
+    parser.add_argument('--output', default=RESULTS_FILE,
+                        help=f"results markdown to regenerate (default: {RESULTS_FILE})")
+    parser.add_argument('--no-store', dest='store', action='store_false',
+                        help="don't save the run to benchmark_runs/benchmark_results")
+    parser.add_argument('--notes', help="free-text note saved with the run")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    conn = connect(args.timeout)
+    try:
+        meters = sample_meters(conn, args.meters)
+        results = {}
+        for suite, path in SUITES:
+            if suite not in args.suites:
+                continue
+            for query in load_suite(suite, path):
+                if query.per_meter and not meters:
+                    logging.warning(f"{suite} {query.label}: no meters registered, skipped")
+                    continue
+                try:
+                    summaries = run_query(query, conn, meters, args)
+                except psycopg2.Error as e:
+                    logging.warning(f"{suite} {query.label} on {query.target} failed, skipped: "
+                                    f"{str(e).strip()}")
+                    continue
+                for mode, summary in summaries.items():
+                    results[(query, mode)] = summary
+                warm = summaries['warm']
+                logging.info(f"{suite} {query.label} {query.target}: p50 {warm.p50:.3f} ms, "
+                             f"p95 {warm.p95:.3f} ms, p99 {warm.p99:.3f} ms")
+
+        sizes = table_sizes(conn)
+        run_id, started_at, regressions = None, datetime.now(), None
+        if args.store:
+            with conn.cursor() as cursor:
+                cursor.execute(RESULTS_TABLE_QUERY)
+                stored = cursor.fetchone()[0]
+            conn.rollback()
+            if stored:
+                run_id, started_at = store_run(conn, results, sizes, args)
+                regressions = find_regressions(load_history(conn))
+                logging.info(f"Stored benchmark run {run_id}")
+            else:
+                logging.warning("benchmark_results not found; run benchmark_results_setup.sql "
+                                "to keep history")
+    finally:
+        conn.close()
+
+    update_results_file(args.output, render_markdown(results, sizes, regressions, run_id,
+                                                     started_at, args))
+    logging.info(f"Wrote {args.output}")
+    if regressions is not None:
+        for row in regressions.itertuples():
+            logging.warning(f"Regression: {row.suite} {row.query} on {row.target}: "
+                            f"{row.baseline_ms:.3f} -> {row.p50_ms:.3f} ms (+{row.change:.0%})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+-- Results of benchmark_queries.py, one row per run and one per measured query,
+-- so the Performance Metrics page can show history and regressions across runs.
+
+CREATE TABLE IF NOT EXISTS benchmark_runs (
+    run_id SERIAL PRIMARY KEY,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    git_commit TEXT,
+    repetitions INTEGER NOT NULL,  -- Warm executions per query, after warm-up
+    cold_runs INTEGER NOT NULL,  -- Executions per query on a fresh connection
+    meters INTEGER NOT NULL,  -- Meters sampled for per-meter queries
+    notes TEXT
+);
+
+-- Times are server-side EXPLAIN ANALYZE times in milliseconds; buffers are
+-- medians per execution, in 8 kB blocks
+CREATE TABLE IF NOT EXISTS benchmark_results (
+    run_id INTEGER NOT NULL REFERENCES benchmark_runs ON DELETE CASCADE,
+    suite TEXT NOT NULL,
+    query TEXT NOT NULL,
+    target TEXT NOT NULL,
+    mode TEXT NOT NULL CHECK (mode IN ('warm', 'cold')),
+    description TEXT,
+    samples INTEGER NOT NULL,
+    p50_ms DOUBLE PRECISION NOT NULL,
+    p95_ms DOUBLE PRECISION NOT NULL,
+    p99_ms DOUBLE PRECISION NOT NULL,
+    mean_ms DOUBLE PRECISION NOT NULL,
+    planning_ms DOUBLE PRECISION NOT NULL,
+    shared_hit BIGINT NOT NULL,
+    shared_read BIGINT NOT NULL,
+    PRIMARY KEY (run_id, suite, query, target, mode)
+);
+
+-- Hypertable sizes and compression state at the time of each run
+CREATE TABLE IF NOT EXISTS benchmark_sizes (
+    run_id INTEGER NOT NULL REFERENCES benchmark_runs ON DELETE CASCADE,
+    hypertable TEXT NOT NULL,
+    total_bytes BIGINT NOT NULL,
+    chunks INTEGER NOT NULL,
+    compressed_chunks INTEGER NOT NULL,
+    PRIMARY KEY (run_id, hypertable)
+);
@@ -0,0 +1,168 @@
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+import psycopg2
+
+import mqtt_subscriber
+import async_subscriber
+from mqtt_subscriber import (DB_PARAMS, ConnectionPool, WorkQueue, BatchWriter, DuplicateFilter,
+                             MeterRegistry)
+from payload_codec import encode_reading, PAYLOAD_FORMATS
+from data_generator import SmartMeter, READING_INTERVAL
+
+# Benchmark parameters
+RATES = (1000, 10000, 100000)  # Offered messages per second
+DURATION = 10.0  # Seconds of traffic offered per run
+NUM_METERS = 1000
+TICK = 0.01  # Seconds between producer bursts
+WRITER_THREADS = 4
+
+# Benchmark readings use meter IDs starting with "0" (real IDs never do) and
+# timestamps in 2000, so they can be told apart and removed afterwards
+BENCH_METER_PREFIX = "0"
+BENCH_START = datetime(2000, 1, 1)
+CLEANUP_QUERIES = (
+    """DELETE FROM energy_readings
+       WHERE meter_key IN (SELECT meter_key FROM meters WHERE meter_id LIKE '0%')
+         AND timestamp < '2001-01-01'""",
+    """DELETE FROM meters m
+       WHERE m.meter_id LIKE '0%'
+         AND NOT EXISTS (SELECT 1 FROM energy_readings r WHERE r.meter_key = m.meter_key)""",
+)
+
+def build_messages(count, payload_format):
+    """Pre-encode ``count`` unique (topic, payload) pairs so encoding is not timed"""
+    meters = [SmartMeter(f"{BENCH_METER_PREFIX}{i:09d}") for i in range(NUM_METERS)]
+    messages = []
+    timestamp = BENCH_START
+    while len(messages) < count:
+        for meter in meters:
+            reading = meter.generate_reading(timestamp)
+            messages.append((f"energy/meters/{meter.meter_id}",
+                             encode_reading(reading, payload_format)))
+            if len(messages) == count:
+                break
+        timestamp += timedelta(seconds=READING_INTERVAL)
+    return messages
+
+def bursts(messages, rate):
+    """Split messages into per-tick bursts for the target rate"""
+    per_tick = max(int(rate * TICK), 1)
+    return [messages[i:i + per_tick] for i in range(0, len(messages), per_tick)]
+
+def run_threaded(messages, rate, args):
+    """Offer messages to the queued threaded subscriber; return seconds until all were written"""
+    pool = ConnectionPool(size=args.writers, setup=mqtt_subscriber.create_staging_table)
+    work_queue = WorkQueue(mqtt_subscriber.QUEUE_SIZE, 'block')
+    duplicate_filter = DuplicateFilter()
+    stop_event = threading.Event()
+    meter_registry = MeterRegistry()
+    with pool.connection() as conn:
+        meter_registry.load(conn)
+    writers = [BatchWriter(pool, batch_size=args.batch_size, duplicate_filter=duplicate_filter,
+                           meter_registry=meter_registry)
+               for _ in range(args.writers)]
+    threads = [threading.Thread(target=mqtt_subscriber.writer_loop,
+                                args=(work_queue, writer, stop_event))
+               for writer in writers]
+    for thread in threads:
+        thread.start()
+
+    peak_backlog = 0
+    started = time.perf_counter()
+    next_tick = started
+    for burst in bursts(messages, rate):
+        for item in burst:
+            work_queue.put(item)
+        peak_backlog = max(peak_backlog, work_queue.depth())
+        next_tick += TICK
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    offered = time.perf_counter() - started
+
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    work_queue.close()
+    pool.closeall()
+    written = sum(writer.rows_written + writer.duplicates_dropped for writer in writers)
+    return offered, elapsed, written, peak_backlog
+
+async def _run_async(messages, rate, args):
+    pool = await async_subscriber.create_pool(size=args.writers)
+    ingestor = async_subscriber.AsyncIngestor(pool, writers=args.writers,
+                                              batch_size=args.batch_size,
+                                              duplicate_filter=DuplicateFilter())
+    await ingestor.load_meters()
+    ingestor.start()
+
+    peak_backlog = 0
+    started = time.perf_counter()
+    next_tick = started
+    for burst in bursts(messages, rate):
+        for topic, payload in burst:
+            await ingestor.submit(topic, payload)
+        peak_backlog = max(peak_backlog, ingestor.pending_batches() * args.batch_size)
+        next_tick += TICK
+        await asyncio.sleep(max(next_tick - time.perf_counter(), 0))
+    offered = time.perf_counter() - started
+
+    await ingestor.close()
+    elapsed = time.perf_counter() - started
+    await pool.close()
+    return offered, elapsed, ingestor.rows_written + ingestor.duplicates_dropped, peak_backlog
+
+def run_async(messages, rate, args):
+    return asyncio.run(_run_async(messages, rate, args))
+
+def cleanup():
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        with conn.cursor() as cursor:
+            for query in CLEANUP_QUERIES:
+                cursor.execute(query)
+        conn.commit()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the threaded and asyncio subscribers at fixed offered rates. "
+                    "Messages are fed in-process (no broker) into a real database.")
+    parser.add_argument('--rates', type=int, nargs='+', default=list(RATES),
+                        help=f"offered messages per second (default: {' '.join(map(str, RATES))})")
+    parser.add_argument('--duration', type=float, default=DURATION,
+                        help=f"seconds of traffic per run (default: {DURATION})")
+    parser.add_argument('--writers', type=int, default=WRITER_THREADS,
+                        help=f"writer threads / async writer tasks (default: {WRITER_THREADS})")
+    parser.add_argument('--batch-size', type=int, default=mqtt_subscriber.BATCH_SIZE,
+                        help=f"readings per batch (default: {mqtt_subscriber.BATCH_SIZE})")
+    parser.add_argument('--format', choices=PAYLOAD_FORMATS, default='json',
+                        help="payload encoding of the generated messages (default: json)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    for rate in args.rates:
+        messages = build_messages(int(rate * args.duration), args.format)
+        for name, runner in (('threaded', run_threaded), ('asyncio', run_async)):
+            cleanup()
+            offered, elapsed, written, peak_backlog = runner(messages, rate, args)
+            results.append((name, rate, len(messages) / offered, written / elapsed,
+                            elapsed - offered, peak_backlog))
+    cleanup()
+
+    print(f"{'Subscriber':<10} {'Target/s':>9} {'Offered/s':>10} {'Written/s':>10} "
+          f"{'Drain s':>8} {'Peak backlog':>13}")
+    for name, rate, offered_rate, written_rate, drain, peak_backlog in results:
+        print(f"{name:<10} {rate:>9} {offered_rate:>10.0f} {written_rate:>10.0f} "
+              f"{drain:>8.2f} {peak_backlog:>13}")
+
+if __name__ == "__main__":
+    main()
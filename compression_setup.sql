@@ -15,11 +15,11 @@ GROUP BY period ORDER BY avg_power DESC LIMIT 10;
 
 -- Query 3 for energy_readings
 EXPLAIN ANALYZE
-SELECT meter_id,
+SELECT meter_key,
        DATE_TRUNC('month', timestamp) as month,
        SUM(energy) as total_energy
 FROM energy_readings
-GROUP BY meter_id, month
+GROUP BY meter_key, month
 ORDER BY month, total_energy DESC;
 
 -- Apply compression
@@ -60,9 +60,9 @@ GROUP BY period ORDER BY avg_power DESC LIMIT 10;
 
 -- Query 3 for energy_readings
 EXPLAIN ANALYZE
-SELECT meter_id,
+SELECT meter_key,
        DATE_TRUNC('month', timestamp) as month,
        SUM(energy) as total_energy
 FROM energy_readings
-GROUP BY meter_id, month
+GROUP BY meter_key, month
 ORDER BY month, total_energy DESC;
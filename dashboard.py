@@ -1,10 +1,19 @@
 import streamlit as st
-import psycopg2
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import warnings
+
+from downsampling import downsample, CHART_POINTS, DOWNSAMPLING_METHODS
+from dashboard_db import (DashboardDB, RealTimeBuffer, EXACT_COUNT_TIMEOUT,
+                          daily_profile, weekly_trend, monthly_by_region, meter_detail,
+                          meter_history, fleet_page, top_consumers, FLEET_PAGE_SIZE,
+                          TOP_CONSUMERS)
+from benchmark_queries import (HISTORY_QUERY, SIZES_HISTORY_QUERY, RESULTS_TABLE_QUERY, HISTORY_RUNS,
+                               CHUNK_LABELS, find_regressions)
+from query_router import QueryRouter
+from watermarks import WatermarkCache
 warnings.filterwarnings("ignore", category=UserWarning)
 
 # Database connection parameters
@@ -16,223 +25,208 @@ DB_PARAMS = {
     'port': '5432'
 }
 
-# Connect to the database
+# Seconds between incremental refreshes of the real-time page
+REALTIME_REFRESH_SECONDS = 5
+
+# Connection pool shared by every session (see dashboard_db.py); connects lazily,
+# and replaces broken connections, so it is cached even while the database is down
 @st.cache_resource
-def get_connection():
+def get_db():
+    return DashboardDB(DB_PARAMS)
+
+# Routes range queries to the continuous aggregates, with a raw tail for recent readings
+@st.cache_resource
+def get_query_router():
+    return QueryRouter(get_db().pool)
+
+# Newest reading times from ingest_watermarks, cached briefly across reruns and sessions
+@st.cache_resource
+def get_watermarks():
+    return WatermarkCache(get_db().pool)
+
+# Row count from TimescaleDB's per-chunk statistics; cheap at any table size
+@st.cache_data(ttl=60)
+def load_approximate_row_count():
+    db = get_db()
     try:
-        return psycopg2.connect(**DB_PARAMS)
-    except Exception as e:
-        st.error(f"Database connection error: {e}")
+        return int(db.scalar("SELECT approximate_row_count('energy_readings')"))
+    except Exception:
         return None
 
-# Load data from database
-@st.cache_data(ttl=300)
-def load_real_time_data():
-    conn = get_connection()
-    if not conn:
-        return pd.DataFrame()
-    
-    # Modify to get data from the last 24 hours instead of just 1 hour
-    # This ensures we have some data even if no recent readings
-    query = """
-    SELECT meter_id, timestamp, power, voltage, current, frequency, energy
-    FROM energy_readings
-    WHERE timestamp >= NOW() - INTERVAL '24 hours'
-    ORDER BY timestamp DESC
-    LIMIT 1000
-    """
-    try:
-        df = pd.read_sql(query, conn)
-        if len(df) == 0:
-            st.warning("No data found in the last 24 hours. Please generate some data first.")
-        return df
-    except Exception as e:
-        st.error(f"Error loading real-time data: {e}")
-        return pd.DataFrame()
+def has_readings(db):
+    """Whether energy_readings holds any row; stops at the first one found"""
+    return db.scalar("SELECT EXISTS (SELECT 1 FROM energy_readings)")
+
+def count_readings_exactly(db):
+    """Full COUNT(*); scans every chunk, so only run on request"""
+    return db.scalar("SELECT COUNT(*) FROM energy_readings", timeout=EXACT_COUNT_TIMEOUT)
 
 @st.cache_data(ttl=3600)
 def load_daily_data():
-    conn = get_connection()
-    if not conn:
-        return pd.DataFrame(), pd.DataFrame()
-    
-    # Get any data from the most recent day with data
-    query = """
-    SELECT time_bucket('1 hour', timestamp) AS hour,
-           AVG(power) as avg_power
-    FROM energy_readings
-    WHERE timestamp >= (SELECT DATE_TRUNC('day', MAX(timestamp)) FROM energy_readings)
-    GROUP BY hour
-    ORDER BY hour
-    """
+    db = get_db()
     
     try:
-        today_data = pd.read_sql(query, conn)
-        
-        # Get data from the day before that
-        query = """
-        SELECT time_bucket('1 hour', timestamp) AS hour,
-               AVG(power) as avg_power
-        FROM energy_readings
-        WHERE timestamp >= (SELECT DATE_TRUNC('day', MAX(timestamp)) FROM energy_readings) - INTERVAL '1 day'
-          AND timestamp < (SELECT DATE_TRUNC('day', MAX(timestamp)) FROM energy_readings)
-        GROUP BY hour
-        ORDER BY hour
-        """
-        yesterday_data = pd.read_sql(query, conn)
-        
-        return today_data, yesterday_data
+        return daily_profile(db, get_query_router(), get_watermarks())
     except Exception as e:
         st.error(f"Error loading daily data: {e}")
         return pd.DataFrame(), pd.DataFrame()
 
 @st.cache_data(ttl=3600)
 def load_weekly_data():
-    conn = get_connection()
-    if not conn:
-        return pd.DataFrame()
-    
-    query = """
-    SELECT time_bucket('1 day', timestamp) AS day,
-           AVG(power) as avg_power,
-           SUM(energy) as total_energy
-    FROM energy_readings
-    WHERE timestamp >= (SELECT MAX(timestamp) FROM energy_readings) - INTERVAL '7 days'
-    GROUP BY day
-    ORDER BY day
-    """
+    db = get_db()
     
     try:
-        return pd.read_sql(query, conn)
+        return weekly_trend(db, get_query_router(), get_watermarks())
     except Exception as e:
         st.error(f"Error loading weekly data: {e}")
         return pd.DataFrame()
 
 @st.cache_data(ttl=3600)
 def load_monthly_data():
-    conn = get_connection()
-    if not conn:
-        return pd.DataFrame()
-    
-    query = """
-    SELECT LEFT(meter_id, 1) as region,
-           SUM(energy) as total_energy
-    FROM energy_readings
-    WHERE timestamp >= DATE_TRUNC('month', (SELECT MAX(timestamp) FROM energy_readings))
-    GROUP BY region
-    ORDER BY region
-    """
+    db = get_db()
     
     try:
-        return pd.read_sql(query, conn)
+        return monthly_by_region(db, get_query_router(), get_watermarks())
     except Exception as e:
         st.error(f"Error loading monthly data: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
-def load_performance_metrics():
-    conn = get_connection()
-    if not conn:
-        return None, None, pd.DataFrame()
+# Fleet ranking over the most recent day, served from the daily aggregate
+@st.cache_data(ttl=300)
+def load_top_consumers():
+    db = get_db()
     
     try:
-        # Get compression metrics
-        size_query = """
-        SELECT hypertable_name,
-               pg_size_pretty(hypertable_size(format('%I', hypertable_name)::regclass)) AS size
-        FROM timescaledb_information.hypertables
-        WHERE hypertable_name IN ('energy_readings', 'energy_readings_3h', 'energy_readings_week')
-        """
-        compression_data = pd.read_sql(size_query, conn)
-        
-        # Sample meter_id for performance testing
-        meter_id_query = "SELECT meter_id FROM energy_readings LIMIT 1"
-        cursor = conn.cursor()
-        cursor.execute(meter_id_query)
-        result = cursor.fetchone()
-        
-        if not result:
-            return None, None, compression_data
-            
-        sample_meter_id = result[0]
-        
-        # Test raw query
-        raw_query = f"""
-        EXPLAIN ANALYZE
-        SELECT meter_id, time_bucket('15 minutes', timestamp) AS bucket,
-               AVG(power) as avg_power
-        FROM energy_readings
-        WHERE timestamp >= NOW() - INTERVAL '7 days'
-        AND meter_id = '{sample_meter_id}'
-        GROUP BY meter_id, bucket
-        ORDER BY bucket
-        """
-        cursor.execute(raw_query)
-        raw_results = cursor.fetchall()
-        
-        # Try continuous aggregation query if the view exists
-        try:
-            agg_query = f"""
-            EXPLAIN ANALYZE
-            SELECT meter_id, bucket, avg_power
-            FROM energy_readings_15min
-            WHERE bucket >= NOW() - INTERVAL '7 days'
-            AND meter_id = '{sample_meter_id}'
-            ORDER BY bucket
-            """
-            cursor.execute(agg_query)
-            agg_results = cursor.fetchall()
-        except Exception:
-            agg_results = []
-            
-        # Extract execution times
-        raw_time = None
-        agg_time = None
-        
-        for row in raw_results:
-            if 'Execution Time' in row[0]:
-                raw_time = float(row[0].split('Execution Time:')[1].split('ms')[0].strip())
-        
-        for row in agg_results:
-            if 'Execution Time' in row[0]:
-                agg_time = float(row[0].split('Execution Time:')[1].split('ms')[0].strip())
-        
-        return raw_time, agg_time, compression_data
+        return top_consumers(db, get_query_router(), get_watermarks())
     except Exception as e:
-        st.error(f"Error loading performance metrics: {e}")
-        return None, None, pd.DataFrame()
+        st.error(f"Error loading top consumers: {e}")
+        return pd.DataFrame()
+
+@st.cache_data(ttl=300)
+def load_meter_count():
+    try:
+        return get_db().scalar("SELECT COUNT(*) FROM meters")
+    except Exception:
+        return None
+
+# One meter's raw readings over a chosen range, cached per meter and range
+@st.cache_data(ttl=300)
+def load_meter_history(meter_key, start, end):
+    return meter_history(get_db(), meter_key, start, end)
+
+# Stored runs of benchmark_queries.py; refreshed every few minutes
+@st.cache_data(ttl=300)
+def load_benchmark_history():
+    db = get_db()
+    
+    try:
+        if not db.scalar(RESULTS_TABLE_QUERY):
+            return None, None
+        return (db.frame(HISTORY_QUERY, (HISTORY_RUNS,)),
+                db.frame(SIZES_HISTORY_QUERY, (HISTORY_RUNS,)))
+    except Exception as e:
+        st.error(f"Error loading benchmark results: {e}")
+        return None, None
+
+def chart_series(data, x, y):
+    """Downsample a time series to the chart width before it is sent to the browser"""
+    method = st.session_state.get('downsampling', DOWNSAMPLING_METHODS[0])
+    plotted = downsample(data, x, y, CHART_POINTS, method)
+    if len(plotted) < len(data):
+        st.caption(f"Showing {len(plotted):,} of {len(data):,} points ({method} downsampling)")
+    return plotted
+
+# Fleet browser paging: the list holds the meter ID each visited page starts after
+def reset_fleet_pages():
+    st.session_state['fleet_cursors'] = ['']
+
+def next_fleet_page(after):
+    st.session_state['fleet_cursors'].append(after)
+
+def previous_fleet_page():
+    if len(st.session_state['fleet_cursors']) > 1:
+        st.session_state['fleet_cursors'].pop()
+
+def select_meter(meter_key, meter_id):
+    """Show a meter on the 5-minute detail page"""
+    st.session_state['selected_meter'] = (int(meter_key), meter_id)
+    st.session_state['page'] = "5-Minute Interval Analysis"
+
+def show_fleet_browser():
+    st.header("Fleet Browser")
+    
+    db = get_db()
+    meter_count = load_meter_count()
+    if meter_count is not None:
+        st.metric("Registered Meters", f"{meter_count:,}")
+    
+    # Prefix search and keyset pages over meter IDs (fleet_browser_setup.sql indexes both)
+    prefix = st.text_input("Meter ID starts with", key='fleet_prefix', on_change=reset_fleet_pages)
+    cursors = st.session_state.setdefault('fleet_cursors', [''])
+    try:
+        page = fleet_page(db, get_query_router(), get_watermarks(), prefix.strip(), cursors[-1])
+    except Exception as e:
+        st.error(f"Error loading meters: {e}")
+        return
+    
+    if len(page) == 0:
+        st.warning("No meters match this prefix." if prefix.strip() else "No meters registered.")
+    else:
+        st.caption(f"Page {len(cursors)}: meters {page['meter_id'].iloc[0]} to "
+                   f"{page['meter_id'].iloc[-1]}; power and energy for the most recent day with data")
+        st.dataframe(page.drop(columns='meter_key'))
+    
+    col1, col2 = st.columns(2)
+    col1.button("Previous page", on_click=previous_fleet_page, disabled=len(cursors) == 1)
+    col2.button("Next page", on_click=next_fleet_page,
+                args=(page['meter_id'].iloc[-1] if len(page) else '',),
+                disabled=len(page) < FLEET_PAGE_SIZE)
+    
+    # Top consumers, ranked over the whole fleet
+    st.subheader(f"Top {TOP_CONSUMERS} Consumers (most recent day)")
+    top = load_top_consumers()
+    if len(top) > 0:
+        fig = px.bar(top, x='meter_id', y='total_energy',
+                     labels={'meter_id': 'Meter', 'total_energy': 'Total Energy (kWh)'})
+        fig.update_xaxes(type='category')
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info("No consumption data for the most recent day.")
+    
+    # Either list can drive the detail page
+    candidates = {}
+    for frame in (page, top):
+        for meter_key, meter_id in zip(frame.get('meter_key', []), frame.get('meter_id', [])):
+            candidates.setdefault(meter_id, meter_key)
+    if candidates:
+        meter_id = st.selectbox("Meter", list(candidates))
+        st.button("Analyze 5-minute intervals", on_click=select_meter,
+                  args=(candidates[meter_id], meter_id))
 
 # Function to analyze 5-minute intervals
 def show_five_minute_detail():
     st.header("5-Minute Interval Data Analysis")
     
-    conn = get_connection()
-    if not conn:
-        return
+    db = get_db()
     
-    # Get a sample meter_id
+    # The meter picked in the Fleet Browser, else a sample meter
+    # (readings store the integer meter_key; meters maps it back)
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT meter_id FROM energy_readings LIMIT 1")
-        result = cursor.fetchone()
-        
-        if not result:
-            st.warning("No meter data found in the database.")
-            return
+        selected = st.session_state.get('selected_meter')
+        if selected is not None:
+            sample_meter_key, sample_meter_id = selected
+            st.caption(f"Meter {sample_meter_id}, selected in the Fleet Browser")
+        else:
+            result = db.prepared_rows('sample_meter')
             
-        sample_meter_id = result[0]
+            if not result:
+                st.warning("No meter data found in the database.")
+                return
+                
+            sample_meter_key, sample_meter_id = int(result[0][0]), result[0][1]
         
         # Get the most recent readings for this meter
-        query = f"""
-        SELECT timestamp, power, voltage, current, frequency, energy
-        FROM energy_readings
-        WHERE meter_id = '{sample_meter_id}'
-        AND timestamp >= (SELECT MAX(timestamp) FROM energy_readings) - INTERVAL '24 hours'
-        ORDER BY timestamp DESC
-        LIMIT 100
-        """
-        
-        detailed_data = pd.read_sql(query, conn)
+        detailed_data = meter_detail(db, get_watermarks(), sample_meter_key)
         
         if len(detailed_data) == 0:
             st.warning("No recent data available for interval analysis.")
@@ -262,7 +256,7 @@ def show_five_minute_detail():
                 st.warning(f"The average interval ({avg_interval:.2f} min) differs from the required 5-minute interval")
             
             # Plot the detailed 5-minute interval data
-            fig = px.line(detailed_data, x='timestamp', y='power',
+            fig = px.line(chart_series(detailed_data, 'timestamp', 'power'), x='timestamp', y='power',
                         labels={'timestamp': 'Time', 'power': 'Power (kW)'},
                         title=f'Power Readings for Meter {sample_meter_id}')
             
@@ -324,25 +318,185 @@ def show_five_minute_detail():
                 st.error("The data collection shows significant deviations from the required 5-minute interval.")
         else:
             st.warning("Not enough data points to analyze intervals. Need at least 2 readings.")
+        
+        show_meter_history(sample_meter_key, sample_meter_id)
     except Exception as e:
         st.error(f"Error analyzing interval data: {e}")
 
+def show_meter_history(meter_key, meter_id):
+    """Every reading of a meter over a chosen date range, downsampled for the chart"""
+    st.subheader("Meter History")
+    latest = get_watermarks().latest_for(meter_key)
+    if latest is None:
+        return
+    last_day = latest.date()
+    selected = st.date_input("Date range", (last_day - timedelta(days=6), last_day),
+                             max_value=last_day)
+    if len(selected) != 2:
+        st.info("Select the last day of the range.")
+        return
+    start = datetime.combine(selected[0], datetime.min.time())
+    end = datetime.combine(selected[1], datetime.min.time()) + timedelta(days=1)
+    
+    history = load_meter_history(meter_key, start, end)
+    if len(history) == 0:
+        st.info("No readings in the selected range.")
+        return
+    
+    fig = px.line(chart_series(history, 'timestamp', 'power'), x='timestamp', y='power',
+                  labels={'timestamp': 'Time', 'power': 'Power (kW)'},
+                  title=f'Power History for Meter {meter_id}')
+    st.plotly_chart(fig, use_container_width=True)
+
+def show_performance_metrics():
+    st.header("TimescaleDB Performance Metrics")
+    
+    history, sizes = load_benchmark_history()
+    if history is None:
+        st.info("No benchmark history. Run benchmark_results_setup.sql, then 'python benchmark_queries.py'.")
+        return
+    if history.empty:
+        st.info("No benchmark runs stored yet. Run 'python benchmark_queries.py' to record one.")
+        return
+    
+    latest_run = history['run_id'].max()
+    latest = history[history['run_id'] == latest_run]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Latest Run", int(latest_run))
+    col2.metric("Runs Stored", history['run_id'].nunique())
+    col3.metric("Commit", latest['git_commit'].iloc[0] or "unknown")
+    st.caption(f"Started {latest['started_at'].iloc[0]:%Y-%m-%d %H:%M}. Server-side EXPLAIN ANALYZE "
+               f"execution times; buffers are median shared blocks per execution.")
+    
+    # Regressions of the latest run against each query's recent runs
+    st.subheader("Regressions")
+    regressions = find_regressions(history)
+    if regressions.empty:
+        st.success("No query regressed against its recent runs.")
+    else:
+        st.error(f"{len(regressions)} queries regressed in run {int(latest_run)}.")
+        regressions['change'] = (regressions['change'] * 100).round(1)
+        st.dataframe(regressions.rename(columns={'change': 'change_%'}))
+    
+    # Latest run, warm p50/p95/p99 with the cold p50 alongside
+    st.subheader("Latest Run")
+    warm = latest[latest['mode'] == 'warm']
+    cold = latest[latest['mode'] == 'cold'][['suite', 'query', 'target', 'p50_ms']]
+    table = warm.merge(cold.rename(columns={'p50_ms': 'cold_p50_ms'}),
+                       on=['suite', 'query', 'target'], how='left')
+    st.dataframe(table[['suite', 'query', 'target', 'description', 'p50_ms', 'p95_ms', 'p99_ms',
+                        'cold_p50_ms', 'shared_hit', 'shared_read']].round(3))
+    
+    # History of one query across runs
+    st.subheader("History")
+    keys = warm[['suite', 'query', 'target']].drop_duplicates().itertuples(index=False)
+    labels = {f"{suite} {query} on {target}": (suite, query, target) for suite, query, target in keys}
+    selected = st.selectbox("Query", list(labels))
+    suite, query, target = labels[selected]
+    series = history[(history['suite'] == suite) & (history['query'] == query) &
+                     (history['target'] == target) & (history['mode'] == 'warm')]
+    fig = px.line(series.melt(id_vars='run_id', value_vars=['p50_ms', 'p95_ms', 'p99_ms'],
+                              var_name='percentile', value_name='ms'),
+                  x='run_id', y='ms', color='percentile',
+                  labels={'run_id': 'Benchmark Run', 'ms': 'Execution Time (ms)'},
+                  title=f"{series['description'].iloc[0]} ({target})")
+    fig.update_traces(mode='lines+markers')
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Storage by chunk strategy, as of each run
+    st.subheader("Storage Size by Chunk Strategy")
+    if sizes is not None and not sizes.empty:
+        sizes['hypertable'] = sizes['hypertable'].replace(dict(CHUNK_LABELS))
+        sizes['size_mb'] = sizes['total_bytes'] / (1024 * 1024)
+        latest_sizes = sizes[sizes['run_id'] == sizes['run_id'].max()]
+        fig = px.bar(latest_sizes, x='hypertable', y='size_mb',
+                     hover_data=['chunks', 'compressed_chunks'],
+                     labels={'hypertable': 'Chunk Strategy', 'size_mb': 'Storage Size (MB)'},
+                     title='Storage Size by Chunk Strategy')
+        st.plotly_chart(fig, use_container_width=True)
+        if sizes['run_id'].nunique() > 1:
+            fig2 = px.line(sizes, x='run_id', y='size_mb', color='hypertable',
+                           labels={'run_id': 'Benchmark Run', 'size_mb': 'Storage Size (MB)',
+                                   'hypertable': 'Chunk Strategy'},
+                           title='Storage Size Across Runs')
+            st.plotly_chart(fig2, use_container_width=True)
+    else:
+        st.info("Storage data not available.")
+
+def render_real_time_feed():
+    """Top up the session's buffer and redraw the real-time charts from it"""
+    db = get_db()
+    buffer = st.session_state.setdefault('real_time_buffer', RealTimeBuffer())
+    try:
+        added = buffer.refresh(db)
+    except Exception as e:
+        st.error(f"Error loading real-time data: {e}")
+        return
+    data = buffer.to_frame()
+    
+    if len(data) == 0:
+        st.warning("No data found in the last 24 hours. Please generate some data first.")
+        return
+        
+    # Summary metrics
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Total Meters", data['meter_id'].nunique())
+    col2.metric("Avg Power (kW)", f"{data['power'].mean():.2f}")
+    col3.metric("Avg Voltage (V)", f"{data['voltage'].mean():.1f}")
+    col4.metric("Total Energy (kWh)", f"{data['energy'].sum():.2f}")
+    
+    # Line chart of power over time
+    st.subheader("Power Consumption Over Time")
+    
+    # Group by 5 minute intervals to highlight the reporting interval
+    data['time_bucket'] = pd.to_datetime(data['timestamp']).dt.floor('5T')
+    agg_data = data.groupby('time_bucket').agg({'power': 'mean'}).reset_index()
+    
+    fig = px.line(chart_series(agg_data, 'time_bucket', 'power'), x='time_bucket', y='power',
+                  labels={'time_bucket': 'Time', 'power': 'Power (kW)'})
+    
+    # Add markers to highlight 5-minute intervals
+    fig.update_traces(mode='lines+markers')
+    
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Sample raw data, newest first
+    st.subheader("Sample Raw Data")
+    st.dataframe(data.iloc[::-1].head(10))
+    st.caption(f"{len(data)} readings buffered, {added} new this refresh, "
+               f"latest {buffer.last_seen}")
+
+def show_real_time_monitoring():
+    st.header("Real-time Meter Readings")
+    auto_refresh = st.sidebar.checkbox("Auto-refresh", value=True)
+    
+    # Fragments rerun on their own timer without rerunning the whole page
+    fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None)
+    if fragment is None:
+        render_real_time_feed()
+        st.button("Refresh")
+        return
+    run_every = REALTIME_REFRESH_SECONDS if auto_refresh else None
+    fragment(run_every=run_every)(render_real_time_feed)()
+    if not auto_refresh:
+        st.button("Refresh")
+
 def main():
     st.title("Smart Energy Grid Monitoring Dashboard")
     
     # Check database connection first
-    conn = get_connection()
-    if not conn:
-        st.error("Cannot connect to the database. Please make sure TimescaleDB is running.")
+    db = get_db()
+    try:
+        db.scalar("SELECT 1")
+    except Exception as e:
+        st.error(f"Cannot connect to the database ({e}). Please make sure TimescaleDB is running.")
         return
         
-    # Check if we have any data
+    # Check if we have any data (statistics lag fresh inserts, so confirm a zero estimate)
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM energy_readings")
-        row_count = cursor.fetchone()[0]
+        row_estimate = load_approximate_row_count()
         
-        if row_count == 0:
+        if not row_estimate and not has_readings(db):
             st.warning("No data found in the database. Please run the data generator first.")
             st.info("Run 'python data_generator.py' in your terminal to generate some data.")
             return
@@ -350,49 +504,34 @@ def main():
         st.error(f"Error checking database: {e}")
         return
     
+    # Stored readings: the estimate by default, an exact count only on request
+    if row_estimate:
+        st.sidebar.metric("Readings (approx.)", f"{row_estimate:,}")
+    if st.sidebar.button("Exact count"):
+        try:
+            st.sidebar.metric("Readings (exact)", f"{count_readings_exactly(db):,}")
+        except Exception as e:
+            st.sidebar.error(f"Error counting readings: {e}")
+    
+    # Long series are thinned to about one point per pixel; min/max keeps every peak
+    st.sidebar.selectbox("Chart downsampling", DOWNSAMPLING_METHODS, key='downsampling')
+    
     # Sidebar with navigation - Now includes the 5-Minute Interval Analysis
     page = st.sidebar.selectbox("Navigate", [
         "Real-time Monitoring", 
+        "Fleet Browser",
         "5-Minute Interval Analysis",  # Added to navigation
         "Daily Patterns", 
         "Weekly Trends", 
         "Monthly Usage", 
         "Performance Metrics"
-    ])
+    ], key='page')
     
     if page == "Real-time Monitoring":
-        st.header("Real-time Meter Readings")
-        data = load_real_time_data()
-        
-        if len(data) == 0:
-            st.warning("No data available. Please generate some data first.")
-            return
-            
-        # Summary metrics
-        col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Total Meters", data['meter_id'].nunique())
-        col2.metric("Avg Power (kW)", f"{data['power'].mean():.2f}")
-        col3.metric("Avg Voltage (V)", f"{data['voltage'].mean():.1f}")
-        col4.metric("Total Energy (kWh)", f"{data['energy'].sum():.2f}")
-        
-        # Line chart of power over time
-        st.subheader("Power Consumption Over Time")
-        
-        # Group by 5 minute intervals to highlight the reporting interval
-        data['time_bucket'] = pd.to_datetime(data['timestamp']).dt.floor('5T')
-        agg_data = data.groupby('time_bucket').agg({'power': 'mean'}).reset_index()
-        
-        fig = px.line(agg_data, x='time_bucket', y='power', 
-                      labels={'time_bucket': 'Time', 'power': 'Power (kW)'})
+        show_real_time_monitoring()
         
-        # Add markers to highlight 5-minute intervals
-        fig.update_traces(mode='lines+markers')
-        
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # Sample raw data
-        st.subheader("Sample Raw Data")
-        st.dataframe(data.head(10))
+    elif page == "Fleet Browser":
+        show_fleet_browser()
         
     elif page == "5-Minute Interval Analysis":
         # Call the function we defined to show 5-minute interval details
@@ -478,48 +617,7 @@ def main():
         st.plotly_chart(fig2, use_container_width=True)
         
     elif page == "Performance Metrics":
-        st.header("TimescaleDB Performance Metrics")
-        
-        raw_time, agg_time, compression_data = load_performance_metrics()
-        
-        # Query performance comparison
-        st.subheader("Query Execution Time: Raw Data vs. Aggregated View")
-        
-        # Create a comparison bar chart
-        if raw_time is not None and agg_time is not None:
-            perf_data = pd.DataFrame({
-                'Data Source': ['Raw Data', 'Continuous Aggregation'],
-                'Execution Time (ms)': [raw_time, agg_time]
-            })
-            
-            fig = px.bar(perf_data, x='Data Source', y='Execution Time (ms)',
-                        title='Query Performance Comparison')
-            
-            # Calculate performance improvement
-            improvement = ((raw_time - agg_time) / raw_time) * 100
-            st.metric("Performance Improvement", f"{improvement:.1f}%")
-            
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("Performance comparison data not available. This could be because continuous aggregation views haven't been set up yet, or there's not enough data.")
-            
-        # Compression stats
-        st.subheader("Storage Size by Chunk Strategy")
-        if not compression_data.empty:
-            # Rename the hypertable names for better display
-            compression_data['hypertable_name'] = compression_data['hypertable_name'].replace({
-                'energy_readings': '1-day chunks',
-                'energy_readings_3h': '3-hour chunks',
-                'energy_readings_week': '1-week chunks'
-            })
-            
-            fig = px.bar(compression_data, x='hypertable_name', y='size',
-                        labels={'hypertable_name': 'Chunk Strategy', 'size': 'Storage Size'},
-                        title='Storage Size by Chunk Strategy')
-            
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info("Compression data not available.")
+        show_performance_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,309 @@
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+
+import psycopg2
+import psycopg2.extensions
+import pandas as pd
+
+from mqtt_subscriber import ConnectionPool
+
+# Connections shared by every dashboard session; Streamlit runs each session's
+# script (and each fragment rerun) on its own thread
+POOL_SIZE = 10
+CONNECT_TIMEOUT = 5  # Seconds
+RECONNECT_ATTEMPTS = 2  # Connect attempts before a page shows an error instead of hanging
+
+# Statement timeouts in milliseconds: the default for every query, and overrides
+STATEMENT_TIMEOUT = 15000
+REALTIME_TIMEOUT = 2000  # Incremental real-time refreshes should be near-instant
+EXACT_COUNT_TIMEOUT = 300000  # The explicit full COUNT(*)
+
+# Real-time feed: readings kept per session, and how far back a session's first fill looks
+REALTIME_BUFFER_ROWS = 1000
+REALTIME_WINDOW = timedelta(hours=24)
+REALTIME_COLUMNS = ['meter_id', 'timestamp', 'power', 'voltage', 'current', 'frequency', 'energy']
+
+# Fleet browser: meters per page, and how many top consumers to rank
+FLEET_PAGE_SIZE = 50
+TOP_CONSUMERS = 10
+FLEET_COLUMNS = ['meter_key', 'meter_id', 'latest', 'avg_power', 'max_power', 'total_energy']
+
+# Hot parameterized queries, prepared once on every pooled connection:
+# name -> (parameter types, statement)
+PREPARED_STATEMENTS = {
+    # Real-time feed: the newest $2 readings at or after $1, newest first ...
+    'latest_readings': ('timestamp, integer', """
+        SELECT r.meter_key, m.meter_id, r.timestamp, r.power, r.voltage, r.current,
+               r.frequency, r.energy
+        FROM energy_readings r
+        JOIN meters m ON m.meter_key = r.meter_key
+        WHERE r.timestamp >= $1
+        ORDER BY r.timestamp DESC, r.meter_key DESC
+        LIMIT $2"""),
+    # ... then keyset pages of up to $3 readings after (timestamp $1, meter_key $2),
+    # oldest first; the plain timestamp bound lets chunk exclusion and the
+    # timestamp index narrow the scan
+    'readings_after': ('timestamp, integer, integer', """
+        SELECT r.meter_key, m.meter_id, r.timestamp, r.power, r.voltage, r.current,
+               r.frequency, r.energy
+        FROM energy_readings r
+        JOIN meters m ON m.meter_key = r.meter_key
+        WHERE r.timestamp >= $1 AND (r.timestamp, r.meter_key) > ($1, $2)
+        ORDER BY r.timestamp, r.meter_key
+        LIMIT $3"""),
+    'meter_recent_readings': ('integer, timestamp, integer', """
+        SELECT timestamp, power, voltage, current, frequency, energy
+        FROM energy_readings
+        WHERE meter_key = $1 AND timestamp >= $2
+        ORDER BY timestamp DESC
+        LIMIT $3"""),
+    # Every raw reading of a meter in a user-selected range; no LIMIT, so long
+    # ranges are downsampled before plotting
+    'meter_history': ('integer, timestamp, timestamp', """
+        SELECT timestamp, power
+        FROM energy_readings
+        WHERE meter_key = $1 AND timestamp >= $2 AND timestamp < $3
+        ORDER BY timestamp"""),
+    # Keyset page of meters whose ID starts with $1, after ID $2. The explicit C-collation
+    # range lets a generic plan use meters_meter_id_c_idx (fleet_browser_setup.sql)
+    'fleet_page': ('text, text, integer', """
+        SELECT meter_key, meter_id
+        FROM meters
+        WHERE meter_id COLLATE "C" > $2
+          AND meter_id COLLATE "C" >= $1
+          AND meter_id COLLATE "C" < $1 || chr(1114111)
+          AND starts_with(meter_id, $1)
+        ORDER BY meter_id COLLATE "C"
+        LIMIT $3"""),
+    'sample_meter': ('', """
+        SELECT m.meter_key, m.meter_id
+        FROM meters m
+        WHERE m.meter_key = (SELECT meter_key FROM energy_readings LIMIT 1)"""),
+}
+
+class QueryTimeout(Exception):
+    """A dashboard query ran past its statement timeout"""
+
+def prepare_statements(conn):
+    """Connection setup hook: PREPARE the hot queries for this session"""
+    with conn.cursor() as cursor:
+        for name, (types, statement) in PREPARED_STATEMENTS.items():
+            signature = f" ({types})" if types else ""
+            cursor.execute(f"PREPARE {name}{signature} AS {statement}")
+
+class DashboardDB:
+    """Pooled, thread-safe query layer for the dashboard.
+
+    Every query borrows a connection, runs in its own short read-only
+    transaction with a statement timeout, and is rolled back before the
+    connection goes back, so one failed query cannot poison the connection
+    for other sessions. Broken connections are replaced by the pool and the
+    query is retried once on a fresh one.
+    """
+
+    def __init__(self, db_params=None, size=POOL_SIZE, statement_timeout=STATEMENT_TIMEOUT):
+        self.pool = ConnectionPool(size=size, connect_timeout=CONNECT_TIMEOUT,
+                                   statement_timeout=statement_timeout,
+                                   reconnect_max_attempts=RECONNECT_ATTEMPTS,
+                                   setup=prepare_statements, db_params=db_params)
+
+    def _run(self, fetch, query, params=None, timeout=None):
+        for attempt in (1, 2):
+            try:
+                with self.pool.connection() as conn:
+                    try:
+                        with conn.cursor() as cursor:
+                            if timeout is not None:
+                                cursor.execute("SET LOCAL statement_timeout = %s", (int(timeout),))
+                            cursor.execute(query, params)
+                            result = fetch(cursor)
+                    except psycopg2.extensions.QueryCanceledError as e:
+                        # The connection is fine; the pool rolls it back and keeps it
+                        raise QueryTimeout(str(e).strip()) from e
+                    conn.rollback()
+                    return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == 2:
+                    raise
+                logging.warning(f"Dashboard database connection lost, retrying query: {e}")
+
+    def frame(self, query, params=None, timeout=None):
+        """Run a query and return its rows as a DataFrame"""
+        def fetch(cursor):
+            columns = [column[0] for column in cursor.description]
+            return pd.DataFrame(cursor.fetchall(), columns=columns)
+        return self._run(fetch, query, params, timeout)
+
+    def rows(self, query, params=None, timeout=None):
+        return self._run(lambda cursor: cursor.fetchall(), query, params, timeout)
+
+    def scalar(self, query, params=None, timeout=None):
+        """First column of the first row, or None when there are no rows"""
+        def fetch(cursor):
+            row = cursor.fetchone()
+            return row[0] if row is not None else None
+        return self._run(fetch, query, params, timeout)
+
+    @staticmethod
+    def _execute_statement(name, params):
+        placeholders = ', '.join(['%s'] * len(params))
+        return f"EXECUTE {name}({placeholders})" if params else f"EXECUTE {name}"
+
+    def prepared_frame(self, name, params=(), timeout=None):
+        return self.frame(self._execute_statement(name, params), params, timeout)
+
+    def prepared_rows(self, name, params=(), timeout=None):
+        return self.rows(self._execute_statement(name, params), params, timeout)
+
+    def stats(self):
+        return self.pool.stats()
+
+    def close(self):
+        self.pool.closeall()
+
+def fetch_latest_readings(db, since, limit=REALTIME_BUFFER_ROWS):
+    """The newest ``limit`` readings at or after ``since``, oldest first"""
+    return db.prepared_rows('latest_readings', (since, limit), REALTIME_TIMEOUT)[::-1]
+
+def fetch_readings_after(db, timestamp, meter_key, limit=REALTIME_BUFFER_ROWS):
+    """Up to ``limit`` readings after (``timestamp``, ``meter_key``), oldest first"""
+    return db.prepared_rows('readings_after', (timestamp, meter_key, limit), REALTIME_TIMEOUT)
+
+class RealTimeBuffer:
+    """Per-session ring buffer of the newest readings, topped up incrementally.
+
+    The first refresh loads the newest readings of the last REALTIME_WINDOW.
+    Later ones page forward from the last (timestamp, meter_key) held, so a
+    step with more readings than the buffer cannot stall the feed. A full
+    page means at least a buffer's worth of new readings, which would push
+    out everything held, so the buffer is reloaded from the newest instead.
+    """
+
+    def __init__(self, maxlen=REALTIME_BUFFER_ROWS):
+        self.rows = deque(maxlen=maxlen)
+        self.last_seen = None
+        self.last_key = None
+
+    def refresh(self, db):
+        """Append readings newer than the buffer; return how many were added"""
+        if self.last_seen is None:
+            rows = fetch_latest_readings(db, datetime.now() - REALTIME_WINDOW, self.rows.maxlen)
+        else:
+            rows = fetch_readings_after(db, self.last_seen, self.last_key, self.rows.maxlen)
+            if len(rows) == self.rows.maxlen:
+                rows = fetch_latest_readings(db, self.last_seen, self.rows.maxlen)
+        for row in rows:
+            self.rows.append(row[1:])
+        if rows:
+            self.last_key, self.last_seen = rows[-1][0], rows[-1][2]
+        return len(rows)
+
+    def to_frame(self):
+        return pd.DataFrame(list(self.rows), columns=REALTIME_COLUMNS)
+
+def read_routed(db, router, start, end=None, resolution=None, by_meter=False, meter_keys=None):
+    """Run a routed aggregate query and return it as a DataFrame"""
+    routed = router.route(start, end, resolution, by_meter, meter_keys)
+    return db.frame(routed.query, routed.params)
+
+def daily_profile(db, router, watermarks):
+    """Hourly averages for the most recent day with data, and the day before that"""
+    latest = watermarks.latest()
+    if latest is None:
+        return pd.DataFrame(), pd.DataFrame()
+    day_start = latest.replace(hour=0, minute=0, second=0, microsecond=0)
+    hour = timedelta(hours=1)
+    today_data = read_routed(db, router, day_start, resolution=hour)
+    yesterday_data = read_routed(db, router, day_start - timedelta(days=1), day_start, resolution=hour)
+    return (today_data.rename(columns={'period': 'hour'}),
+            yesterday_data.rename(columns={'period': 'hour'}))
+
+def weekly_trend(db, router, watermarks):
+    """Daily average power and total energy over the past week"""
+    latest = watermarks.latest()
+    if latest is None:
+        return pd.DataFrame()
+    # Whole days, so the daily aggregate can serve the range
+    week_start = (latest - timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
+    weekly_data = read_routed(db, router, week_start, resolution=timedelta(days=1))
+    return weekly_data.rename(columns={'period': 'day'})
+
+def monthly_by_region(db, router, watermarks):
+    """Energy per region (first digit of the meter ID) for the current month"""
+    latest = watermarks.latest()
+    if latest is None:
+        return pd.DataFrame()
+    # Aggregate per integer meter_key first, then resolve the region once per meter
+    month_start = latest.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    routed = router.route(month_start, by_meter=True)
+    query = f"""
+    SELECT LEFT(m.meter_id, 1) as region,
+           SUM(per_meter.total_energy) as total_energy
+    FROM ({routed.query}) per_meter
+    JOIN meters m ON m.meter_key = per_meter.meter_key
+    GROUP BY region
+    ORDER BY region
+    """
+    return db.frame(query, routed.params)
+
+def meter_detail(db, watermarks, meter_key, limit=100):
+    """A meter's most recent readings (up to ``limit``) from its last 24 hours of data"""
+    latest = watermarks.latest_for(meter_key)
+    if latest is None:
+        return pd.DataFrame()
+    return db.prepared_frame('meter_recent_readings',
+                             (meter_key, latest - timedelta(hours=24), limit))
+
+def meter_history(db, meter_key, start, end):
+    """Every reading of a meter from ``start`` up to ``end``, oldest first"""
+    rows = db.prepared_rows('meter_history', (meter_key, start, end))
+    return pd.DataFrame(rows, columns=['timestamp', 'power'])
+
+def _day_start(watermarks):
+    """Midnight of the most recent day with data, or None when there is no data"""
+    latest = watermarks.latest()
+    if latest is None:
+        return None
+    return latest.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def fleet_page(db, router, watermarks, prefix='', after='', limit=FLEET_PAGE_SIZE):
+    """One page of meters with IDs starting with ``prefix``, after meter ID ``after``.
+
+    Each meter comes with its latest reading time and its power and energy
+    for the most recent day with data. Only the meters on the page are
+    looked up, so the cost does not grow with the fleet. The day is not
+    materialized in the daily view yet, so the router serves it from the
+    hourly (or 15-minute) view plus the raw readings after its watermark.
+    """
+    rows = db.prepared_rows('fleet_page', (prefix, after, limit))
+    if not rows:
+        return pd.DataFrame(columns=FLEET_COLUMNS)
+    page = pd.DataFrame(rows, columns=['meter_key', 'meter_id'])
+    meter_keys = page['meter_key'].tolist()
+    page['latest'] = page['meter_key'].map(watermarks.latest_for_meters(meter_keys))
+    day_start = _day_start(watermarks)
+    if day_start is None:
+        return page.reindex(columns=FLEET_COLUMNS)
+    daily = read_routed(db, router, day_start, by_meter=True, meter_keys=meter_keys)
+    return page.merge(daily, on='meter_key', how='left')[FLEET_COLUMNS]
+
+def top_consumers(db, router, watermarks, limit=TOP_CONSUMERS):
+    """Meters with the most energy on the most recent day with data.
+
+    Ranks the whole fleet, so it relies on the router serving the day from
+    the hourly view and only the unmaterialized tail from raw readings.
+    """
+    day_start = _day_start(watermarks)
+    if day_start is None:
+        return pd.DataFrame()
+    routed = router.route(day_start, by_meter=True)
+    query = f"""
+    SELECT m.meter_key, m.meter_id, per_meter.avg_power, per_meter.max_power,
+           per_meter.total_energy
+    FROM ({routed.query}) per_meter
+    JOIN meters m ON m.meter_key = per_meter.meter_key
+    ORDER BY per_meter.total_energy DESC NULLS LAST
+    LIMIT %(limit)s
+    """
+    return db.frame(query, dict(routed.params, limit=limit))
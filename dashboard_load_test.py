@@ -0,0 +1,192 @@
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+from dashboard_db import (DashboardDB, RealTimeBuffer, QueryTimeout, POOL_SIZE,
+                          STATEMENT_TIMEOUT, daily_profile, weekly_trend, monthly_by_region,
+                          meter_detail, fleet_page, top_consumers)
+from query_router import QueryRouter
+from watermarks import WatermarkCache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Example, against a local database with data loaded:
+#   python dashboard_load_test.py --sessions 50 --duration 120
+#   python dashboard_load_test.py --sessions 50 --pool-size 1   # one shared connection, serialized
+# Fleet pages at scale, against a 100k-meter dataset with continuous aggregates refreshed:
+#   python dataset.py --meters 100000 --days 7 --truncate
+#   python dashboard_load_test.py --sessions 50 --duration 120
+
+SESSIONS = 50
+DURATION = 60.0  # Seconds of load after ramp-up
+RAMP_UP = 10.0  # Seconds over which sessions start
+THINK_TIME = 2.0  # Mean seconds a session waits between page loads
+
+# Page mix, as relative weights. Real-time sessions refresh every few seconds and
+# dominate; the range pages are what a user clicks through now and then.
+PAGE_WEIGHTS = {
+    'startup': 1,  # Connection check and row-count estimate, run on every rerun
+    'realtime': 10,
+    'fleet': 2,
+    'detail': 2,
+    'daily': 2,
+    'weekly': 2,
+    'monthly': 1,
+}
+
+PERCENTILES = (50, 95, 99)
+
+class Session:
+    """One simulated dashboard user with its own real-time buffer.
+
+    Range pages bypass the dashboard's st.cache_data, so every load reaches
+    the database: the worst case of all sessions missing the cache at once.
+    """
+
+    def __init__(self, db, router, watermarks):
+        self.db = db
+        self.router = router
+        self.watermarks = watermarks
+        self.buffer = RealTimeBuffer()
+
+    def startup(self):
+        self.db.scalar("SELECT 1")
+        self.db.scalar("SELECT approximate_row_count('energy_readings')")
+
+    def realtime(self):
+        self.buffer.refresh(self.db)
+
+    def fleet(self):
+        # The Fleet Browser page: the top consumers across the whole fleet, then
+        # a one- or two-digit prefix search and the next page of its results
+        top_consumers(self.db, self.router, self.watermarks)
+        prefix = str(random.randint(1, 99))[:random.randint(1, 2)]
+        page = fleet_page(self.db, self.router, self.watermarks, prefix)
+        if len(page):
+            fleet_page(self.db, self.router, self.watermarks, prefix, page['meter_id'].iloc[-1])
+
+    def detail(self):
+        result = self.db.prepared_rows('sample_meter')
+        if result:
+            meter_detail(self.db, self.watermarks, int(result[0][0]))
+
+    def daily(self):
+        daily_profile(self.db, self.router, self.watermarks)
+
+    def weekly(self):
+        weekly_trend(self.db, self.router, self.watermarks)
+
+    def monthly(self):
+        monthly_by_region(self.db, self.router, self.watermarks)
+
+class Results:
+    """Latencies and failures per page, collected from every session thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)  # page -> seconds
+        self.timeouts = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def record(self, page, latency=None, outcome=None):
+        with self._lock:
+            if outcome == 'timeout':
+                self.timeouts[page] += 1
+            elif outcome is not None:
+                self.errors[page] += 1
+            else:
+                self.latencies[page].append(latency)
+
+def run_session(session, results, stop_event, start_delay, think_time):
+    if stop_event.wait(start_delay):
+        return
+    pages, weights = list(PAGE_WEIGHTS), list(PAGE_WEIGHTS.values())
+    while not stop_event.is_set():
+        page = random.choices(pages, weights)[0]
+        started = time.perf_counter()
+        try:
+            getattr(session, page)()
+        except QueryTimeout:
+            results.record(page, outcome='timeout')
+        except Exception as e:
+            logging.warning(f"{page}: {e}")
+            results.record(page, outcome='error')
+        else:
+            results.record(page, time.perf_counter() - started)
+        stop_event.wait(random.expovariate(1 / think_time) if think_time > 0 else 0)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate concurrent dashboard sessions against the database and report "
+                    "per-page latency percentiles.")
+    parser.add_argument('--sessions', type=int, default=SESSIONS,
+                        help=f"concurrent simulated sessions (default: {SESSIONS})")
+    parser.add_argument('--duration', type=float, default=DURATION,
+                        help=f"seconds of load after ramp-up (default: {DURATION})")
+    parser.add_argument('--ramp-up', type=float, default=RAMP_UP,
+                        help=f"seconds over which sessions start (default: {RAMP_UP})")
+    parser.add_argument('--think-time', type=float, default=THINK_TIME,
+                        help=f"mean seconds between a session's page loads (default: {THINK_TIME})")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE,
+                        help=f"database connections shared by the sessions (default: {POOL_SIZE})")
+    parser.add_argument('--statement-timeout', type=int, default=STATEMENT_TIMEOUT,
+                        help=f"default statement timeout in ms (default: {STATEMENT_TIMEOUT})")
+    args = parser.parse_args()
+
+    db = DashboardDB(size=args.pool_size, statement_timeout=args.statement_timeout)
+    router = QueryRouter(db.pool)
+    watermarks = WatermarkCache(db.pool)
+    results = Results()
+    stop_event = threading.Event()
+
+    threads = []
+    for index in range(args.sessions):
+        start_delay = args.ramp_up * index / args.sessions
+        thread = threading.Thread(target=run_session,
+                                  args=(Session(db, router, watermarks), results, stop_event,
+                                        start_delay, args.think_time),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    logging.info(f"{args.sessions} sessions on {args.pool_size} connections, "
+                 f"{args.ramp_up:.0f}s ramp-up + {args.duration:.0f}s")
+    started = time.perf_counter()
+    try:
+        time.sleep(args.ramp_up + args.duration)
+    except KeyboardInterrupt:
+        pass
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stats = db.stats()
+    db.close()
+
+    print(f"{'Page':<9} {'Loads':>7} {'Timeouts':>9} {'Errors':>7} "
+          + ' '.join(f"{f'p{p} ms':>9}" for p in PERCENTILES) + f" {'max ms':>9}")
+    total = 0
+    for page in PAGE_WEIGHTS:
+        latency = np.array(results.latencies[page]) * 1000
+        total += len(latency)
+        if len(latency):
+            values = ' '.join(f"{value:>9.1f}" for value in np.percentile(latency, PERCENTILES))
+            maximum = f"{latency.max():>9.1f}"
+        else:
+            values = ' '.join(f"{'-':>9}" for _ in PERCENTILES)
+            maximum = f"{'-':>9}"
+        print(f"{page:<9} {len(latency):>7} {results.timeouts[page]:>9} "
+              f"{results.errors[page]:>7} {values} {maximum}")
+
+    print(f"\n{total / elapsed:.1f} page loads/s; pool: {stats['open_connections']} open, "
+          f"{stats['reconnects']} reconnects, {stats['connect_failures']} connect failures")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,13 @@
 import paho.mqtt.client as mqtt
-import json
 import time
 import random
 from datetime import datetime, timedelta
 import logging
 import math
 
+from payload_codec import encode_reading, encode_batch, add_trace
+from fleet_generator import Fleet, step_readings
+
 # Configure logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,6 +16,17 @@ logging.basicConfig(level=logging.INFO,
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC_PREFIX = "energy/meters/"
+GATEWAY_TOPIC_PREFIX = "energy/gateways/"
+
+# Meters per gateway message on energy/gateways/{gateway_id}; 0 publishes
+# one message per meter on energy/meters/{meter_id}
+GATEWAY_SIZE = 0
+
+# Payload encoding: "json", "binary" (packed floats + epoch) or "msgpack"
+PAYLOAD_FORMAT = "json"
+
+# Add publish time and per-meter sequence numbers for latency tracing (ingest_trace.py)
+TRACE_MESSAGES = False
 
 # Number of smart meters to simulate
 NUM_METERS = 500
@@ -83,14 +96,35 @@ class SmartMeter:
             "energy": round(energy, 4)
         }
 
-def generate_meter_ids(count):
-    """Generate unique 10-digit meter IDs"""
-    meter_ids = []
-    for i in range(count):
-        # Create a 10-digit number
-        meter_id = f"{random.randint(1000000000, 9999999999)}"
-        meter_ids.append(meter_id)
-    return meter_ids
+def generate_meter_ids(count, seed=None):
+    """Generate unique 10-digit meter IDs; the same seed gives the same IDs"""
+    # Sampling without replacement, so IDs never collide
+    rng = random.Random(seed)
+    return [str(number) for number in rng.sample(range(1000000000, 10000000000), count)]
+
+def gateway_messages(readings, gateway_size, payload_format=PAYLOAD_FORMAT):
+    """Group (meter_id, reading) pairs into gateway batches of gateway_size meters.
+
+    Yields (topic, payload, reading count). Groups are numbered in order,
+    so a fleet published in a fixed order keeps each meter on the same
+    gateway from one step to the next.
+    """
+    batch = []
+    gateway = 0
+    for meter_id, reading in readings:
+        reading['meter_id'] = meter_id
+        batch.append(reading)
+        if len(batch) == gateway_size:
+            yield f"{GATEWAY_TOPIC_PREFIX}gw-{gateway:04d}", encode_batch(batch, payload_format), len(batch)
+            batch = []
+            gateway += 1
+    if batch:
+        yield f"{GATEWAY_TOPIC_PREFIX}gw-{gateway:04d}", encode_batch(batch, payload_format), len(batch)
+
+def meter_messages(readings, payload_format=PAYLOAD_FORMAT):
+    """One (topic, payload, 1) message per (meter_id, reading) pair"""
+    for meter_id, reading in readings:
+        yield f"{MQTT_TOPIC_PREFIX}{meter_id}", encode_reading(reading, payload_format), 1
 
 def main():
     # Create MQTT client
@@ -103,7 +137,7 @@ def main():
         
         # Generate meter IDs
         meter_ids = generate_meter_ids(NUM_METERS)
-        smart_meters = {meter_id: SmartMeter(meter_id) for meter_id in meter_ids}
+        fleet = Fleet.random(meter_ids)
         
         # Ask user how long to generate data for
         try:
@@ -121,17 +155,22 @@ def main():
         # Main loop for data generation
         current_time = start_time
         readings_count = 0
+        steps_count = 0
         
         while current_time < end_time:
-            for meter_id, meter in smart_meters.items():
-                # Generate reading
-                reading = meter.generate_reading(current_time)
-                
+            # Generate this step's readings for the whole fleet at once
+            readings = step_readings(fleet, fleet.generate_step(current_time))
+            if TRACE_MESSAGES:
+                # Every meter publishes once per step, so the step count is its sequence
+                readings = ((meter_id, add_trace(reading, steps_count)) for meter_id, reading in readings)
+            if GATEWAY_SIZE:
+                messages = gateway_messages(readings, GATEWAY_SIZE, PAYLOAD_FORMAT)
+            else:
+                messages = meter_messages(readings, PAYLOAD_FORMAT)
+            for topic, payload, count in messages:
                 # Publish to MQTT
-                topic = f"{MQTT_TOPIC_PREFIX}{meter_id}"
-                payload = json.dumps(reading)
                 client.publish(topic, payload)
-                readings_count += 1
+                readings_count += count
                 
             # Log progress every 100 readings
             if readings_count % 100 == 0:
@@ -139,6 +178,7 @@ def main():
                 
             # Advance time by the reading interval
             current_time += timedelta(seconds=READING_INTERVAL)
+            steps_count += 1
             
             # Sleep a little to avoid overwhelming the broker in simulation mode
             # In a real scenario, we'd wait the full interval
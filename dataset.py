@@ -0,0 +1,277 @@
+import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg2
+
+from data_generator import generate_meter_ids
+from fleet_generator import Fleet, round_values, VALUE_COLUMNS, READING_INTERVAL
+from historical_data_generator import (DB_PARAMS, CHUNK_INTERVALS, BACKFILL_COLUMNS, NUM_METERS,
+                                       HISTORY_DAYS, BACKFILL_WORKERS, BACKFILL_STAGING_QUERY,
+                                       BACKFILL_INSERT_QUERY, register_meters, chunk_ranges,
+                                       tables_without_dedup_index)
+from watermarks import refresh_watermarks, watermarks_available
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Example: the same 500-meter, 14-day dataset in all three hypertables on every run
+#   python dataset.py --meters 500 --days 14 --seed 42 --tables energy_readings \
+#       energy_readings_3h energy_readings_week --truncate
+
+# Datasets are cached here, one directory of .npy columns per spec
+DATASET_DIR = "datasets"
+
+# Default spec; a fixed start keeps datasets identical from one day to the next
+DATASET_START = datetime(2024, 1, 1)  # A Monday
+DATASET_SEED = 42
+
+# Bump when generation changes so stale caches are regenerated, not reused
+GENERATOR_VERSION = 1
+
+# Days generated per random block; only one block of readings is held in memory
+# (columns are written straight to memory-mapped .npy files), and each block has
+# its own seed, so the result does not depend on how the span is split
+GENERATION_BLOCK_DAYS = 1
+
+TRUNCATE_QUERY = "TRUNCATE {table}"
+
+class DatasetSpec(namedtuple('DatasetSpec', 'meters start days interval seed')):
+    """Everything that determines a dataset: same spec, same readings"""
+
+    def to_dict(self):
+        return {'meters': self.meters, 'start': self.start.isoformat(), 'days': self.days,
+                'interval': self.interval, 'seed': self.seed, 'version': GENERATOR_VERSION}
+
+    def key(self):
+        """Short stable identifier used as the cache directory name"""
+        encoded = json.dumps(self.to_dict(), sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    @property
+    def end(self):
+        return self.start + timedelta(days=self.days)
+
+    @property
+    def steps(self):
+        return int(timedelta(days=self.days).total_seconds()) // self.interval
+
+def dataset_path(spec, directory=DATASET_DIR):
+    return os.path.join(directory, f"dataset-{spec.key()}")
+
+def generate_dataset(spec, path):
+    """Generate every reading of a spec as .npy columns in path: meter_id (N), timestamp (T), values (T, N)"""
+    meter_ids = generate_meter_ids(spec.meters, spec.seed)
+    fleet = Fleet.random(meter_ids, np.random.default_rng(spec.seed))
+    np.save(os.path.join(path, "meter_id.npy"), np.array(meter_ids))
+    np.save(os.path.join(path, "timestamp.npy"),
+            np.arange(np.datetime64(spec.start, 's'), np.datetime64(spec.end, 's'),
+                      np.timedelta64(spec.interval, 's'))[:spec.steps])
+    # Value columns are written through memory maps, a block at a time
+    columns = {column: np.lib.format.open_memmap(os.path.join(path, f"{column}.npy"), mode='w+',
+                                                 dtype=np.float64, shape=(spec.steps, spec.meters))
+               for column in VALUE_COLUMNS}
+
+    block = timedelta(days=GENERATION_BLOCK_DAYS)
+    for index, (block_start, block_end) in enumerate(chunk_ranges(spec.start, spec.end, block)):
+        fleet.rng = np.random.default_rng([spec.seed, index + 1])
+        values = round_values(fleet.generate_range(block_start, block_end, spec.interval))
+        first = int((block_start - spec.start).total_seconds()) // spec.interval
+        last = first + len(values['power'])
+        for column in VALUE_COLUMNS:
+            columns[column][first:last] = values[column]
+    for array in columns.values():
+        array.flush()
+
+def save_dataset(spec, directory=DATASET_DIR):
+    """Generate a spec's dataset into the cache as .npy columns plus its spec"""
+    path = dataset_path(spec, directory)
+    staging = path + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    generate_dataset(spec, staging)
+    with open(os.path.join(staging, "spec.json"), 'w') as f:
+        json.dump(spec.to_dict(), f, indent=2)
+    # Rename last, so a cache directory is never seen half-written
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(staging, path)
+    return path
+
+def load_dataset(spec, directory=DATASET_DIR, mmap_mode='r'):
+    """Columns of a cached dataset, memory-mapped; None if there is no cache for the spec"""
+    path = dataset_path(spec, directory)
+    try:
+        with open(os.path.join(path, "spec.json")) as f:
+            if json.load(f) != spec.to_dict():
+                return None
+        return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                for name in ('meter_id', 'timestamp') + VALUE_COLUMNS}
+    except (OSError, ValueError):
+        return None
+
+def get_dataset(spec, directory=DATASET_DIR):
+    """Load a spec's dataset from the cache, generating and caching it on a miss"""
+    columns = load_dataset(spec, directory)
+    if columns is not None:
+        logging.info(f"Using cached dataset {dataset_path(spec, directory)}")
+        return columns
+    started = time.perf_counter()
+    path = save_dataset(spec, directory)
+    logging.info(f"Generated {spec.steps * spec.meters} readings in "
+                 f"{time.perf_counter() - started:.1f}s, cached in {path}")
+    return load_dataset(spec, directory)
+
+def copy_text(columns, meter_keys, first, last):
+    """COPY text for time steps [first, last) of a dataset"""
+    steps = last - first
+    timestamps = np.repeat(np.datetime_as_string(columns['timestamp'][first:last], unit='s'),
+                           len(meter_keys))
+    values = [np.tile(meter_keys, steps).tolist(), timestamps.tolist()]
+    values += [np.asarray(columns[column][first:last]).ravel().tolist() for column in VALUE_COLUMNS]
+    lines = [f"{key}\t{timestamp}\t{power}\t{voltage}\t{current}\t{frequency}\t{energy}"
+             for key, timestamp, power, voltage, current, frequency, energy in zip(*values)]
+    return '\n'.join(lines) + '\n', len(lines)
+
+# Per-process state of a loader worker
+_worker = {}
+
+def _init_load_worker(spec, directory, meter_keys, staged):
+    _worker['columns'] = load_dataset(spec, directory)
+    _worker['meter_keys'] = np.asarray(meter_keys)
+    _worker['staged'] = staged
+    _worker['conn'] = psycopg2.connect(**DB_PARAMS)
+    if staged:
+        with _worker['conn'].cursor() as cursor:
+            cursor.execute(BACKFILL_STAGING_QUERY)
+        _worker['conn'].commit()
+
+def load_steps(table, first, last, steps_per_copy):
+    """COPY time steps [first, last) (one chunk) into a table as one transaction"""
+    conn = _worker['conn']
+    staged = _worker['staged']
+    copy_table = 'backfill_staging' if staged else table
+    copy_query = f"COPY {copy_table} ({', '.join(BACKFILL_COLUMNS)}) FROM STDIN"
+    rows = 0
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            for start in range(first, last, steps_per_copy):
+                text, count = copy_text(_worker['columns'], _worker['meter_keys'],
+                                        start, min(start + steps_per_copy, last))
+                cursor.copy_expert(copy_query, io.StringIO(text))
+                rows += count
+            if staged and rows:
+                cursor.execute(BACKFILL_INSERT_QUERY.format(table=table))
+                rows = cursor.rowcount
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    return table, rows, time.perf_counter() - started
+
+def bulk_load(spec, tables, directory=DATASET_DIR, workers=BACKFILL_WORKERS, truncate=False):
+    """COPY a cached dataset into hypertables, one chunk per task in time order"""
+    columns = load_dataset(spec, directory)
+    meter_ids = columns['meter_id'].tolist()
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        # Without truncate, chunks go through a staging table and ON CONFLICT DO NOTHING,
+        # so loading a spec again skips the readings already stored instead of failing
+        unindexed = [] if truncate else tables_without_dedup_index(conn, tables)
+        if unindexed:
+            logging.error(f"{', '.join(unindexed)} has no unique (meter_key, timestamp) index, so "
+                          f"readings already stored would be duplicated; use --truncate")
+            return
+        if truncate:
+            with conn.cursor() as cursor:
+                for table in tables:
+                    cursor.execute(TRUNCATE_QUERY.format(table=table))
+            conn.commit()
+            if 'energy_readings' in tables and watermarks_available(conn):
+                # Watermarks only move forward, so clear them along with the readings
+                with conn.cursor() as cursor:
+                    cursor.execute(TRUNCATE_QUERY.format(table='ingest_watermarks'))
+                conn.commit()
+        meter_keys = register_meters(conn, meter_ids)
+    finally:
+        conn.close()
+
+    tasks = []
+    for table in tables:
+        for chunk_start, chunk_end in chunk_ranges(spec.start, spec.end, CHUNK_INTERVALS[table]):
+            first = -(-int((chunk_start - spec.start).total_seconds()) // spec.interval)
+            last = min(-(-int((chunk_end - spec.start).total_seconds()) // spec.interval), spec.steps)
+            if first < last:
+                tasks.append((chunk_start, table, first, last))
+    tasks.sort(key=lambda task: task[0])
+    # Bound each COPY to about an hour of readings per 500 meters
+    steps_per_copy = max(1, 3600 * 500 // (spec.interval * spec.meters))
+
+    totals = {table: 0 for table in tables}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_load_worker,
+                             initargs=(spec, directory, meter_keys, not truncate)) as executor:
+        results = executor.map(load_steps, [task[1] for task in tasks], [task[2] for task in tasks],
+                               [task[3] for task in tasks], [steps_per_copy] * len(tasks))
+        for table, rows, seconds in results:
+            totals[table] += rows
+    elapsed = time.perf_counter() - started
+    total_rows = sum(totals.values())
+    for table, rows in totals.items():
+        logging.info(f"{table}: {rows} rows")
+    logging.info(f"Loaded {total_rows} rows in {elapsed:.1f}s ({total_rows / elapsed:,.0f} rows/s)")
+
+    # COPY bypasses the subscriber, so bring the watermarks up to date here
+    if 'energy_readings' in tables:
+        conn = psycopg2.connect(**DB_PARAMS)
+        try:
+            if not refresh_watermarks(conn, spec.start):
+                logging.info("No ingest_watermarks table; watermarks not updated")
+        finally:
+            conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate (or reuse) a seeded, cached dataset "
+                                                 "and bulk-load it into the hypertables")
+    parser.add_argument('--meters', type=int, default=NUM_METERS,
+                        help=f"number of meters (default: {NUM_METERS})")
+    parser.add_argument('--start', type=datetime.fromisoformat, default=DATASET_START,
+                        help=f"first reading time (default: {DATASET_START.isoformat()})")
+    parser.add_argument('--days', type=int, default=HISTORY_DAYS,
+                        help=f"days of readings (default: {HISTORY_DAYS})")
+    parser.add_argument('--interval', type=int, default=READING_INTERVAL,
+                        help=f"seconds between readings (default: {READING_INTERVAL})")
+    parser.add_argument('--seed', type=int, default=DATASET_SEED,
+                        help=f"dataset seed (default: {DATASET_SEED})")
+    parser.add_argument('--cache-dir', default=DATASET_DIR,
+                        help=f"dataset cache directory (default: {DATASET_DIR})")
+    parser.add_argument('--tables', nargs='+', choices=list(CHUNK_INTERVALS),
+                        default=['energy_readings'],
+                        help="hypertables to load (default: energy_readings)")
+    parser.add_argument('--truncate', action='store_true',
+                        help="empty the target tables first, so they hold exactly this dataset; "
+                             "otherwise readings already stored are skipped, which needs a unique "
+                             "(meter_key, timestamp) index on every target table")
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS,
+                        help=f"loader processes (default: {BACKFILL_WORKERS})")
+    parser.add_argument('--no-load', dest='load', action='store_false',
+                        help="only generate and cache the dataset")
+    args = parser.parse_args()
+
+    spec = DatasetSpec(args.meters, args.start, args.days, args.interval, args.seed)
+    get_dataset(spec, args.cache_dir)
+    if args.load:
+        bulk_load(spec, args.tables, args.cache_dir, args.workers, args.truncate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+-- Make energy_readings duplicate-safe: at most one row per meter per timestamp
+-- Run before meter_registry_setup.sql, which carries the unique index over to meter_key
+
+-- Compressed chunks cannot be deleted from or re-indexed in place; decompress them first
+SELECT decompress_chunk(chunk, if_compressed => true) FROM show_chunks('energy_readings') AS chunk;
+
+-- Count the duplicates that are about to be removed
+SELECT COUNT(*) - COUNT(DISTINCT (meter_id, timestamp)) AS duplicate_rows
+FROM energy_readings;
+
+-- Remove duplicates, keeping one row per (meter_id, timestamp)
+-- (rows with the same timestamp always live in the same chunk, so ctid is comparable)
+DELETE FROM energy_readings a
+USING energy_readings b
+WHERE a.meter_id = b.meter_id
+  AND a.timestamp = b.timestamp
+  AND a.ctid > b.ctid;
+
+-- Unique index used by the subscriber's INSERT ... ON CONFLICT DO NOTHING
+-- (on a hypertable a unique index must include the time column)
+CREATE UNIQUE INDEX IF NOT EXISTS energy_readings_meter_id_timestamp_key
+ON energy_readings (meter_id, timestamp);
+
+-- Recompress chunks older than the compression policy window
+SELECT compress_chunk(chunk, if_not_compressed => true)
+FROM show_chunks('energy_readings', older_than => INTERVAL '1 day') AS chunk;
+
+-- Rebuild the continuous aggregates so their SUM(energy) totals drop the duplicates
+CALL refresh_continuous_aggregate('energy_readings_15min', NULL, NULL);
+CALL refresh_continuous_aggregate('energy_readings_hourly', NULL, NULL);
+CALL refresh_continuous_aggregate('energy_readings_daily', NULL, NULL);
+CALL refresh_continuous_aggregate('energy_readings_15min_optimized', NULL, NULL);
+CALL refresh_continuous_aggregate('energy_readings_hourly_optimized', NULL, NULL);
+CALL refresh_continuous_aggregate('energy_readings_daily_optimized', NULL, NULL);
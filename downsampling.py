@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# Points sent to a chart: about one per horizontal pixel of a full-width chart
+CHART_POINTS = 1200
+
+DOWNSAMPLING_METHODS = ('minmax', 'lttb')
+
+def _as_float(values):
+    """Plot coordinates as float64; datetimes become nanoseconds since the epoch"""
+    values = np.asarray(values)
+    if values.dtype == object and len(values) and isinstance(values[0], datetime):
+        # tz-aware datetimes come out of pandas as an object array of Timestamps
+        values = pd.DatetimeIndex(pd.to_datetime(values, utc=True)).tz_localize(None).to_numpy()
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return values.astype(np.float64)
+
+def min_max_indices(x, y, buckets):
+    """Indices of the minimum and maximum of ``y`` in each of ``buckets`` equal-width x ranges.
+
+    ``x`` must be sorted. Buckets split the x range evenly, like pixel
+    columns, so gaps in the data stay gaps. Every bucket's extremes are
+    kept, so peaks survive exactly; at most ``2 * buckets`` points remain.
+    Missing (NaN) values are ignored when finding a bucket's extremes.
+    """
+    n = len(y)
+    if buckets < 1 or n <= 2 * buckets:
+        return np.arange(n)
+    x, y = _as_float(x), _as_float(y)
+    edges = np.linspace(x[0], x[-1], buckets + 1)
+    bucket_ids = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, buckets - 1)
+    # x is sorted, so each bucket is a contiguous run and reduceat needs no sort;
+    # fmin and fmax skip NaN, which would otherwise become the bucket's extreme
+    starts = np.flatnonzero(np.diff(bucket_ids, prepend=-1))
+    counts = np.diff(np.append(starts, n))
+    minima = _first_per_bucket(y == np.repeat(np.fmin.reduceat(y, starts), counts), bucket_ids)
+    maxima = _first_per_bucket(y == np.repeat(np.fmax.reduceat(y, starts), counts), bucket_ids)
+    return np.unique(np.concatenate((minima, maxima, [0, n - 1])))
+
+def _first_per_bucket(mask, bucket_ids):
+    """Index of the first True of ``mask`` in each bucket"""
+    positions = np.flatnonzero(mask)
+    return positions[np.diff(bucket_ids[positions], prepend=-1) != 0]
+
+def lttb_indices(x, y, threshold):
+    """Indices chosen by largest-triangle-three-buckets, keeping the global maximum.
+
+    LTTB keeps the visual shape of a series with ``threshold`` points but
+    may skip a narrow spike, so the overall peak is added back (at most
+    ``threshold + 1`` points remain). ``x`` must be sorted.
+    """
+    n = len(y)
+    if threshold < 3 or n <= threshold:
+        return np.arange(n)
+    x, y = _as_float(x), _as_float(y)
+    # First and last points are fixed; the rest split into threshold - 2 buckets
+    every = (n - 2) / (threshold - 2)
+    bounds = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    bounds[-1] = n - 1
+    bounds = np.append(bounds, n)  # The last bucket's neighbour is the final point alone
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = bounds[i], bounds[i + 1]
+        next_x = x[bounds[i + 1]:bounds[i + 2]].mean()
+        next_y = y[bounds[i + 1]:bounds[i + 2]].mean()
+        # Twice the triangle area between the previous pick, each candidate and the next average
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a])
+                      - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return np.unique(np.append(selected, np.argmax(y)))
+
+def downsample(frame, x, y, points=CHART_POINTS, method='minmax'):
+    """Rows of ``frame`` (sorted by ``x``) for plotting ``y`` with about ``points`` points.
+
+    Frames that already fit are returned unchanged.
+    """
+    if len(frame) <= points:
+        return frame
+    if method == 'minmax':
+        indices = min_max_indices(frame[x].to_numpy(), frame[y].to_numpy(), points // 2)
+    elif method == 'lttb':
+        indices = lttb_indices(frame[x].to_numpy(), frame[y].to_numpy(), points)
+    else:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    return frame.iloc[indices]
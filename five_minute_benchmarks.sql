@@ -2,11 +2,11 @@
 
 -- Query 1: Last hour of data (real-time monitoring)
 EXPLAIN ANALYZE
-SELECT meter_id, 
+SELECT meter_key, 
        timestamp, 
        power
 FROM energy_readings
-WHERE meter_id = (SELECT meter_id FROM energy_readings LIMIT 1)
+WHERE meter_key = (SELECT meter_key FROM energy_readings LIMIT 1)
   AND timestamp >= NOW() - INTERVAL '1 hour'
 ORDER BY timestamp DESC;
 
@@ -15,7 +15,7 @@ EXPLAIN ANALYZE
 SELECT bucket, 
        avg_power
 FROM energy_readings_15min_optimized
-WHERE meter_id = (SELECT meter_id FROM energy_readings LIMIT 1)
+WHERE meter_key = (SELECT meter_key FROM energy_readings LIMIT 1)
   AND bucket >= NOW() - INTERVAL '1 day'
 ORDER BY bucket DESC;
 
@@ -24,7 +24,7 @@ EXPLAIN ANALYZE
 SELECT bucket, 
        avg_power
 FROM energy_readings_hourly_optimized
-WHERE meter_id = (SELECT meter_id FROM energy_readings LIMIT 1)
+WHERE meter_key = (SELECT meter_key FROM energy_readings LIMIT 1)
   AND bucket >= DATE_TRUNC('day', NOW())
 ORDER BY bucket;
 
@@ -34,6 +34,6 @@ SELECT bucket,
        avg_power,
        total_energy
 FROM energy_readings_daily_optimized
-WHERE meter_id = (SELECT meter_id FROM energy_readings LIMIT 1)
+WHERE meter_key = (SELECT meter_key FROM energy_readings LIMIT 1)
   AND bucket >= NOW() - INTERVAL '7 days'
 ORDER BY bucket;
@@ -0,0 +1,21 @@
+-- Index for the dashboard's fleet browser: prefix search and keyset pagination
+-- over meter IDs (the fleet_page statement in dashboard_db.py). Run after
+-- meter_registry_setup.sql.
+--
+-- The UNIQUE index on meters.meter_id uses the database collation, which cannot
+-- serve prefix ranges. Under the C collation, byte order is string order, so one
+-- btree serves "IDs starting with a prefix, after the last ID shown, in order".
+CREATE INDEX IF NOT EXISTS meters_meter_id_c_idx ON meters (meter_id COLLATE "C");
+
+ANALYZE meters;
+
+-- A page of meters whose ID starts with '12', after '1200000450'
+EXPLAIN ANALYZE
+SELECT meter_key, meter_id
+FROM meters
+WHERE meter_id COLLATE "C" > '1200000450'
+  AND meter_id COLLATE "C" >= '12'
+  AND meter_id COLLATE "C" < '12' || chr(1114111)
+  AND starts_with(meter_id, '12')
+ORDER BY meter_id COLLATE "C"
+LIMIT 50;
@@ -0,0 +1,126 @@
+import numpy as np
+
+# Interval in seconds between readings (5 minutes = 300 seconds)
+READING_INTERVAL = 300
+
+# Time-of-day pattern, as (first hour, end hour, factor); other hours are 1.0
+# - Morning peak: 6-9 AM
+# - Evening peak: 5-10 PM
+# - Night low: 10 PM - 5 AM
+TIME_FACTORS = ((6, 9, 1.5), (17, 22, 1.8), (22, 24, 0.6), (0, 5, 0.6))
+WEEKEND_FACTOR = 1.2
+
+# Hour of day -> time factor, so a whole array of hours maps in one lookup
+HOUR_FACTORS = np.ones(24)
+for first, end, factor in TIME_FACTORS:
+    HOUR_FACTORS[first:end] = factor
+
+# Columns of a generated reading, in the order the subscriber stores them
+VALUE_COLUMNS = ('power', 'voltage', 'current', 'frequency', 'energy')
+
+# Decimal places each value is rounded to in a published reading
+ROUNDING = {'power': 3, 'voltage': 1, 'current': 3, 'frequency': 2, 'energy': 4}
+
+class Fleet:
+    """Smart meter fleet whose per-meter parameters are held as arrays.
+
+    Produces the same readings as ``SmartMeter.generate_reading`` (time of
+    day, weekend and sine shaping, random variation) for every meter at
+    once, either for one time step or for a whole time range.
+    """
+
+    def __init__(self, meter_ids, base_power, base_voltage, power_factor, rng=None):
+        self.meter_ids = list(meter_ids)
+        self.base_power = np.asarray(base_power, dtype=np.float64)
+        self.base_voltage = np.asarray(base_voltage, dtype=np.float64)
+        self.power_factor = np.asarray(power_factor, dtype=np.float64)
+        self.rng = rng if rng is not None else np.random.default_rng()
+
+    @classmethod
+    def random(cls, meter_ids, rng=None):
+        """Fleet with parameters drawn from the same ranges as SmartMeter"""
+        rng = rng if rng is not None else np.random.default_rng()
+        count = len(meter_ids)
+        return cls(meter_ids,
+                   base_power=rng.uniform(0.8, 2.5, count),  # Base power consumption in kW
+                   base_voltage=rng.uniform(220, 240, count),  # Base voltage
+                   power_factor=rng.uniform(0.9, 0.98, count),  # Power factor for calculating current
+                   rng=rng)
+
+    @classmethod
+    def from_meters(cls, meters, rng=None):
+        """Fleet reusing the parameters of existing SmartMeter objects"""
+        meters = list(meters)
+        return cls([meter.meter_id for meter in meters],
+                   base_power=[meter.base_power for meter in meters],
+                   base_voltage=[meter.base_voltage for meter in meters],
+                   power_factor=[meter.power_factor for meter in meters],
+                   rng=rng)
+
+    def __len__(self):
+        return len(self.meter_ids)
+
+    def _generate(self, timestamps, interval):
+        """Values for every (timestamp, meter) pair as arrays of shape (T, N)"""
+        timestamps = np.asarray(timestamps, dtype='datetime64[s]')
+        seconds_of_day = (timestamps - timestamps.astype('datetime64[D]')).astype(np.int64)
+        hours = seconds_of_day // 3600
+        minute_of_day = seconds_of_day // 60
+        # 1970-01-01 was a Thursday (weekday 3)
+        weekdays = (timestamps.astype('datetime64[D]').astype(np.int64) + 3) % 7
+
+        # Everything that depends only on the time step, shape (T, 1)
+        step_factor = (HOUR_FACTORS[hours]
+                       * np.where(weekdays >= 5, WEEKEND_FACTOR, 1.0)
+                       * (1 + 0.1 * np.sin(minute_of_day * 2 * np.pi / (60 * 24))))[:, None]
+
+        shape = (len(timestamps), len(self.meter_ids))
+        rng = self.rng
+        power = self.base_power * step_factor * rng.uniform(0.9, 1.1, shape)
+        voltage = self.base_voltage * rng.uniform(0.98, 1.02, shape)
+        return {
+            'power': power,
+            'voltage': voltage,
+            # P = V * I * PF → I = P / (V * PF)
+            'current': power * 1000 / (voltage * self.power_factor),
+            'frequency': 50 + rng.uniform(-0.1, 0.1, shape),
+            'energy': power * (interval / 3600),
+        }
+
+    def generate_step(self, timestamp, interval=READING_INTERVAL):
+        """Readings of every meter at one timestamp as 1-D arrays of length N"""
+        values = self._generate([np.datetime64(timestamp, 's')], interval)
+        step = {column: array[0] for column, array in values.items()}
+        step['timestamp'] = timestamp
+        return step
+
+    def generate_range(self, start, end, interval=READING_INTERVAL):
+        """Readings of every meter for each interval in [start, end).
+
+        Returns ``timestamp`` as a datetime64 array of length T and every
+        value column as an array of shape (T, N), one row per time step.
+        """
+        timestamps = np.arange(np.datetime64(start, 's'), np.datetime64(end, 's'),
+                               np.timedelta64(interval, 's'))
+        values = self._generate(timestamps, interval)
+        values['timestamp'] = timestamps
+        return values
+
+def round_values(values):
+    """Round value columns to the precision used in published readings"""
+    return {column: np.round(values[column], ROUNDING[column]) for column in VALUE_COLUMNS}
+
+def step_readings(fleet, step):
+    """Yield (meter_id, reading) for one generated step, as SmartMeter would build them"""
+    timestamp = step['timestamp'].isoformat()
+    rounded = round_values(step)
+    columns = [rounded[column].tolist() for column in VALUE_COLUMNS]
+    for meter_id, power, voltage, current, frequency, energy in zip(fleet.meter_ids, *columns):
+        yield meter_id, {
+            "timestamp": timestamp,
+            "power": power,
+            "voltage": voltage,
+            "current": current,
+            "frequency": frequency,
+            "energy": energy
+        }
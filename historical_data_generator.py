@@ -1,10 +1,19 @@
 import paho.mqtt.client as mqtt
-import json
+import io
+import os
 import time
 import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import logging
-import math
+
+import numpy as np
+import psycopg2
+
+from data_generator import gateway_messages, meter_messages, generate_meter_ids
+from watermarks import refresh_watermarks, watermarks_available
+from fleet_generator import Fleet, step_readings, round_values, VALUE_COLUMNS
 
 # Configure logging
 logging.basicConfig(level=logging.INFO,
@@ -15,86 +24,232 @@ MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC_PREFIX = "energy/meters/"
 
+# Payload encoding: "json", "binary" (packed floats + epoch) or "msgpack"
+PAYLOAD_FORMAT = "json"
+
+# Database connection parameters (direct backfill mode)
+DB_PARAMS = {
+    'dbname': 'energy_monitoring',
+    'user': 'postgres',
+    'password': 'password',
+    'host': 'localhost',
+    'port': '5432'
+}
+
 # Number of smart meters to simulate
 NUM_METERS = 500
 
 # Interval in seconds between readings (5 minutes = 300 seconds)
 READING_INTERVAL = 300
 
-class SmartMeter:
-    def __init__(self, meter_id):
-        """Initialize a smart meter with a given ID"""
-        self.meter_id = meter_id
-        self.base_power = random.uniform(0.8, 2.5)  # Base power consumption in kW
-        self.base_voltage = random.uniform(220, 240)  # Base voltage
-        self.power_factor = random.uniform(0.9, 0.98)  # Power factor for calculating current
-        
-    def generate_reading(self, timestamp):
-        """Generate a realistic meter reading for a given timestamp"""
-        # Convert timestamp to hour (0-23)
-        hour = timestamp.hour
-        
-        # Apply time-of-day pattern:
-        # - Morning peak: 6-9 AM
-        # - Evening peak: 6-9 PM
-        # - Night low: 11 PM - 5 AM
-        time_factor = 1.0
-        if 6 <= hour < 9:
-            time_factor = 1.5  # Morning peak
-        elif 17 <= hour < 22:
-            time_factor = 1.8  # Evening peak
-        elif 22 <= hour or hour < 5:
-            time_factor = 0.6  # Night low
-            
-        # Add some random variation (±10%)
-        random_factor = random.uniform(0.9, 1.1)
-        
-        # Add weekday/weekend pattern
-        is_weekend = timestamp.weekday() >= 5  # 5=Saturday, 6=Sunday
-        day_factor = 1.2 if is_weekend else 1.0
-        
-        # Calculate power with all factors
-        power = self.base_power * time_factor * random_factor * day_factor
-        
-        # Add some sine wave variation for more realism
-        minute_of_day = hour * 60 + timestamp.minute
-        sine_factor = 0.1 * math.sin(minute_of_day * 2 * math.pi / (60 * 24))
-        power *= (1 + sine_factor)
-        
-        # Calculate voltage with minor fluctuations (±2%)
-        voltage = self.base_voltage * random.uniform(0.98, 1.02)
-        
-        # Calculate current: P = V * I * PF → I = P / (V * PF)
-        current = power * 1000 / (voltage * self.power_factor)
-        
-        # Calculate frequency with minor fluctuations around 50 Hz (±0.1 Hz)
-        frequency = 50 + random.uniform(-0.1, 0.1)
-        
-        # Calculate energy consumed in this interval (kWh)
-        # Power (kW) * time (h) = energy (kWh)
-        energy = power * (READING_INTERVAL / 3600)  # Convert seconds to hours
-        
-        return {
-            "timestamp": timestamp.isoformat(),
-            "power": round(power, 3),
-            "voltage": round(voltage, 1),
-            "current": round(current, 3),
-            "frequency": round(frequency, 2),
-            "energy": round(energy, 4)
-        }
-
-def generate_meter_ids(count):
-    """Generate unique 10-digit meter IDs"""
-    meter_ids = []
-    for i in range(count):
-        # Create a 10-digit number
-        meter_id = f"{random.randint(1000000000, 9999999999)}"
-        meter_ids.append(meter_id)
-    return meter_ids
-
-# Copy all code from data_generator.py but modify the main function:
+# Days of history to generate
+HISTORY_DAYS = 14
 
-def main():
+# Backfill targets and their chunk_time_interval; each worker task covers
+# whole chunks, aligned the way TimescaleDB aligns them (to the Unix epoch)
+CHUNK_INTERVALS = {
+    'energy_readings': timedelta(days=1),
+    'energy_readings_3h': timedelta(hours=3),
+    'energy_readings_week': timedelta(weeks=1),
+}
+BACKFILL_WORKERS = os.cpu_count() or 1
+
+# Readings are generated and COPYed an hour at a time. Each hour's random
+# draws are seeded from the run seed and the hour, so every target table
+# receives identical readings whatever its chunk size
+GENERATION_BLOCK = timedelta(hours=1)
+
+REGISTER_METERS_QUERY = """
+INSERT INTO meters (meter_id)
+SELECT unnest(%s::text[])
+ON CONFLICT (meter_id) DO NOTHING
+"""
+LOOKUP_METERS_QUERY = "SELECT meter_id, meter_key FROM meters WHERE meter_id = ANY(%s)"
+BACKFILL_COLUMNS = ('meter_key', 'timestamp') + VALUE_COLUMNS
+TRUNCATE_QUERY = "TRUNCATE {table}"
+
+# Unless the targets are truncated first, each chunk is COPYed into a per-worker
+# staging table and inserted with ON CONFLICT DO NOTHING, so readings already
+# stored are skipped instead of failing the chunk. That needs a unique
+# (meter_key, timestamp) index, which only energy_readings has
+# (meter_registry_setup.sql); other targets must be backfilled with --truncate
+BACKFILL_STAGING_QUERY = """
+CREATE TEMP TABLE backfill_staging (LIKE energy_readings INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+"""
+DEDUP_INDEX_QUERY = """
+SELECT EXISTS (
+    SELECT 1
+    FROM pg_index i
+    WHERE i.indrelid = %s::regclass AND i.indisunique
+      AND (SELECT array_agg(a.attname::text ORDER BY a.attname)
+           FROM pg_attribute a
+           WHERE a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)) = ARRAY['meter_key', 'timestamp']
+)
+"""
+BACKFILL_INSERT_QUERY = f"""
+INSERT INTO {{table}} ({', '.join(BACKFILL_COLUMNS)})
+SELECT {', '.join(BACKFILL_COLUMNS)} FROM backfill_staging
+ON CONFLICT DO NOTHING
+"""
+
+def tables_without_dedup_index(conn, tables):
+    """Tables lacking the unique (meter_key, timestamp) index ON CONFLICT relies on"""
+    missing = []
+    with conn.cursor() as cursor:
+        for table in tables:
+            cursor.execute(DEDUP_INDEX_QUERY, (table,))
+            if not cursor.fetchone()[0]:
+                missing.append(table)
+    conn.rollback()
+    return missing
+
+def register_meters(conn, meter_ids):
+    """Make sure every meter is in the meters table; return their meter_keys in order"""
+    with conn.cursor() as cursor:
+        cursor.execute(REGISTER_METERS_QUERY, (meter_ids,))
+        cursor.execute(LOOKUP_METERS_QUERY, (meter_ids,))
+        keys = dict(cursor.fetchall())
+    conn.commit()
+    return [keys[meter_id] for meter_id in meter_ids]
+
+def chunk_ranges(start, end, interval):
+    """Split [start, end) at the chunk boundaries of a hypertable"""
+    epoch = datetime(1970, 1, 1)
+    boundary = epoch + (start - epoch) // interval * interval
+    ranges = []
+    while boundary < end:
+        ranges.append((max(boundary, start), min(boundary + interval, end)))
+        boundary += interval
+    return ranges
+
+def block_copy_text(fleet, meter_keys, start, end, seed):
+    """COPY text for one generation block: every meter, every interval in [start, end)"""
+    fleet.rng = np.random.default_rng([seed, int(start.timestamp())])
+    values = fleet.generate_range(start, end)
+    steps = len(values['timestamp'])
+    if steps == 0:
+        return "", 0
+    rounded = round_values(values)
+    timestamps = np.repeat(np.datetime_as_string(values['timestamp'], unit='s'), len(meter_keys))
+    columns = [np.tile(meter_keys, steps).tolist(), timestamps.tolist()]
+    columns += [rounded[column].ravel().tolist() for column in VALUE_COLUMNS]
+    lines = [f"{key}\t{timestamp}\t{power}\t{voltage}\t{current}\t{frequency}\t{energy}"
+             for key, timestamp, power, voltage, current, frequency, energy in zip(*columns)]
+    return '\n'.join(lines) + '\n', len(lines)
+
+# Per-process state of a backfill worker
+_worker = {}
+
+def _init_backfill_worker(meter_ids, base_power, base_voltage, power_factor, meter_keys, seed,
+                          staged):
+    _worker['fleet'] = Fleet(meter_ids, base_power, base_voltage, power_factor)
+    _worker['meter_keys'] = np.asarray(meter_keys)
+    _worker['seed'] = seed
+    _worker['staged'] = staged
+    _worker['conn'] = psycopg2.connect(**DB_PARAMS)
+    if staged:
+        with _worker['conn'].cursor() as cursor:
+            cursor.execute(BACKFILL_STAGING_QUERY)
+        _worker['conn'].commit()
+
+def backfill_chunk(table, start, end):
+    """Generate and COPY every reading of one chunk, committed as one transaction"""
+    conn = _worker['conn']
+    staged = _worker['staged']
+    copy_table = 'backfill_staging' if staged else table
+    copy_query = f"COPY {copy_table} ({', '.join(BACKFILL_COLUMNS)}) FROM STDIN"
+    rows = 0
+    started = time.perf_counter()
+    try:
+        with conn.cursor() as cursor:
+            for block_start, block_end in chunk_ranges(start, end, GENERATION_BLOCK):
+                copy_text, count = block_copy_text(_worker['fleet'], _worker['meter_keys'],
+                                                   block_start, block_end, _worker['seed'])
+                if count:
+                    cursor.copy_expert(copy_query, io.StringIO(copy_text))
+                rows += count
+            if staged and rows:
+                cursor.execute(BACKFILL_INSERT_QUERY.format(table=table))
+                rows = cursor.rowcount
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    return table, start, rows, time.perf_counter() - started
+
+def backfill(args):
+    """Write generated history straight into the hypertables with COPY, one chunk per task"""
+    end_time = datetime.now().replace(second=0, microsecond=0)
+    end_time -= timedelta(minutes=end_time.minute % (READING_INTERVAL // 60))
+    start_time = end_time - timedelta(days=args.days)
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+
+    meter_ids = generate_meter_ids(args.meters, seed)
+    fleet = Fleet.random(meter_ids, np.random.default_rng(seed))
+    conn = psycopg2.connect(**DB_PARAMS)
+    try:
+        unindexed = [] if args.truncate else tables_without_dedup_index(conn, args.tables)
+        if unindexed:
+            logging.error(f"{', '.join(unindexed)} has no unique (meter_key, timestamp) index, so "
+                          f"readings already stored would be duplicated; use --truncate")
+            return
+        if args.truncate:
+            with conn.cursor() as cursor:
+                for table in args.tables:
+                    cursor.execute(TRUNCATE_QUERY.format(table=table))
+            conn.commit()
+            if 'energy_readings' in args.tables and watermarks_available(conn):
+                # Watermarks only move forward, so clear them along with the readings
+                with conn.cursor() as cursor:
+                    cursor.execute(TRUNCATE_QUERY.format(table='ingest_watermarks'))
+                conn.commit()
+        meter_keys = register_meters(conn, meter_ids)
+    finally:
+        conn.close()
+
+    # Chunks in time order, so every table fills oldest-first and each
+    # task writes whole chunks
+    tasks = [(table, chunk_start, chunk_end)
+             for table in args.tables
+             for chunk_start, chunk_end in chunk_ranges(start_time, end_time, CHUNK_INTERVALS[table])]
+    tasks.sort(key=lambda task: task[1])
+    if not tasks:
+        logging.info(f"Nothing to backfill between {start_time} and {end_time}")
+        return
+
+    logging.info(f"Backfilling {args.meters} meters from {start_time} to {end_time} into "
+                 f"{', '.join(args.tables)}: {len(tasks)} chunks on {args.workers} workers (seed {seed})")
+    totals = {table: 0 for table in args.tables}
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_backfill_worker,
+                             initargs=(fleet.meter_ids, fleet.base_power, fleet.base_voltage,
+                                       fleet.power_factor, meter_keys, seed,
+                                       not args.truncate)) as executor:
+        results = executor.map(backfill_chunk, [task[0] for task in tasks],
+                               [task[1] for task in tasks], [task[2] for task in tasks])
+        for table, chunk_start, rows, seconds in results:
+            totals[table] += rows
+            logging.info(f"{table}: chunk {chunk_start} written, {rows} rows in {seconds:.1f}s "
+                         f"({rows / seconds:,.0f} rows/s)")
+    elapsed = time.perf_counter() - started
+
+    total_rows = sum(totals.values())
+    for table, rows in totals.items():
+        logging.info(f"{table}: {rows} rows")
+    logging.info(f"Backfill complete: {total_rows} rows in {elapsed:.1f}s "
+                 f"({total_rows / elapsed:,.0f} rows/s)")
+
+    # COPY bypasses the subscriber, so bring the watermarks up to date here
+    if 'energy_readings' in args.tables:
+        conn = psycopg2.connect(**DB_PARAMS)
+        try:
+            if not refresh_watermarks(conn, start_time):
+                logging.info("No ingest_watermarks table; watermarks not updated")
+        finally:
+            conn.close()
+
+def publish(args):
+    """Publish the history through MQTT, one message per reading or per gateway batch"""
     # Create MQTT client
     client = mqtt.Client()
     
@@ -104,30 +259,31 @@ def main():
         client.loop_start()
         
         # Generate meter IDs
-        meter_ids = generate_meter_ids(NUM_METERS)
-        smart_meters = {meter_id: SmartMeter(meter_id) for meter_id in meter_ids}
+        meter_ids = generate_meter_ids(args.meters)
+        fleet = Fleet.random(meter_ids)
         
-        # Set time range for 2 weeks of historical data
+        # Set time range for the historical data (2 weeks by default)
         end_time = datetime.now()
-        start_time = end_time - timedelta(days=14)
+        start_time = end_time - timedelta(days=args.days)
         
         logging.info(f"Starting historical data generation from {start_time} to {end_time}")
-        logging.info(f"Simulating {NUM_METERS} smart meters")
+        logging.info(f"Simulating {args.meters} smart meters")
         
         # Main loop for data generation
         current_time = start_time
         readings_count = 0
         
         while current_time < end_time:
-            for meter_id, meter in smart_meters.items():
-                # Generate reading
-                reading = meter.generate_reading(current_time)
-                
+            # Generate this step's readings for the whole fleet at once
+            readings = step_readings(fleet, fleet.generate_step(current_time))
+            if args.gateway_size:
+                messages = gateway_messages(readings, args.gateway_size, PAYLOAD_FORMAT)
+            else:
+                messages = meter_messages(readings, PAYLOAD_FORMAT)
+            for topic, payload, count in messages:
                 # Publish to MQTT
-                topic = f"{MQTT_TOPIC_PREFIX}{meter_id}"
-                payload = json.dumps(reading)
                 client.publish(topic, payload)
-                readings_count += 1
+                readings_count += count
                 
             # Log progress every 10,000 readings
             if readings_count % 10000 == 0:
@@ -147,5 +303,35 @@ def main():
         client.loop_stop()
         client.disconnect()
 
+def main():
+    parser = argparse.ArgumentParser(description="Generate historical meter readings, either "
+                                                 "published through MQTT or backfilled with COPY")
+    parser.add_argument('--backfill', action='store_true',
+                        help="write straight into the database instead of publishing to MQTT")
+    parser.add_argument('--days', type=float, default=HISTORY_DAYS,
+                        help=f"days of history ending now (default: {HISTORY_DAYS})")
+    parser.add_argument('--meters', type=int, default=NUM_METERS,
+                        help=f"number of meters (default: {NUM_METERS})")
+    parser.add_argument('--tables', nargs='+', choices=list(CHUNK_INTERVALS),
+                        default=['energy_readings'],
+                        help="hypertables to backfill (default: energy_readings)")
+    parser.add_argument('--truncate', action='store_true',
+                        help="empty the target tables first and COPY straight into them; "
+                             "required for tables without a unique (meter_key, timestamp) index. "
+                             "Otherwise readings already stored are skipped")
+    parser.add_argument('--workers', type=int, default=BACKFILL_WORKERS,
+                        help=f"backfill processes (default: {BACKFILL_WORKERS})")
+    parser.add_argument('--seed', type=int,
+                        help="seed for the backfilled fleet and readings (default: random)")
+    parser.add_argument('--gateway-size', type=int, default=0,
+                        help="publish batches of this many meters on energy/gateways/{gateway_id} "
+                             "instead of one message per meter (default: 0, per meter)")
+    args = parser.parse_args()
+
+    if args.backfill:
+        backfill(args)
+    else:
+        publish(args)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,163 @@
+import csv
+import logging
+import argparse
+import threading
+from collections import defaultdict
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Example, against a local broker and database:
+#   python mqtt_subscriber.py --trace-file trace.csv
+#   python load_generator.py --trace --rate 5000 --duration 60
+#   python ingest_trace.py trace.csv
+
+# One line per traced reading; times are epoch seconds. received_at is
+# stamped in the MQTT callback, as the message is put on the work queue, and
+# dequeued_at when a writer thread takes it off (the same time when there is
+# no queue). committed_at is empty for readings that went to the spool
+# instead of the database
+TRACE_COLUMNS = ('meter_id', 'seq', 'published_at', 'received_at', 'dequeued_at',
+                 'decoded_at', 'batched_at', 'committed_at')
+TIME_COLUMNS = TRACE_COLUMNS[2:]
+
+# Stages reported, as (name, from column, to column)
+STAGES = (
+    ('broker', 'published_at', 'received_at'),  # Publish to subscriber callback
+    ('queue', 'received_at', 'dequeued_at'),  # Work queue wait, including backpressure
+    ('decode', 'dequeued_at', 'decoded_at'),  # Payload decode and validation
+    ('batch', 'decoded_at', 'batched_at'),  # Duplicate filter and batch append
+    ('commit', 'batched_at', 'committed_at'),  # Batching, COPY and COMMIT
+    ('end-to-end', 'published_at', 'committed_at'),  # Publish to queryable row
+)
+
+PERCENTILES = (50, 90, 95, 99, 99.9)
+REPORT_WINDOW = 10.0  # Seconds per row of the end-to-end timeline
+
+class Tracer:
+    """Append per-reading stage timestamps to a trace file.
+
+    Writers hand over a whole batch at once after it is committed (or
+    spooled), so the file sees one buffered write per batch.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        header = ','.join(TRACE_COLUMNS) + '\n'
+        self._file = open(path, 'a+', buffering=1024 * 1024)
+        if self._file.tell() == 0:
+            self._file.write(header)
+        else:
+            self._file.seek(0)
+            if self._file.readline() != header:
+                self._file.close()
+                raise ValueError(f"{path} has different trace columns; use a new trace file")
+            self._file.seek(0, 2)
+
+    def record(self, traces, committed_at):
+        """Write traces holding every column but committed_at"""
+        committed = '' if committed_at is None else repr(committed_at)
+        lines = [','.join('' if value is None else str(value) for value in trace) + f",{committed}\n"
+                 for trace in traces]
+        with self._lock:
+            self._file.writelines(lines)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def load_traces(paths):
+    """Read trace files into per-column arrays (NaN where a time is missing)"""
+    meter_ids, seqs, times = [], [], []
+    for path in paths:
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                meter_ids.append(row['meter_id'])
+                seqs.append(int(row['seq']))
+                times.append([float(row[column]) if row[column] else np.nan
+                              for column in TIME_COLUMNS])
+    columns = dict(zip(TIME_COLUMNS,
+                       np.array(times, dtype=np.float64).reshape(-1, len(TIME_COLUMNS)).T))
+    columns['meter_id'] = np.array(meter_ids)
+    columns['seq'] = np.array(seqs, dtype=np.int64)
+    return columns
+
+def stage_percentiles(columns):
+    """Latency percentiles in milliseconds for every stage with data"""
+    results = []
+    for name, start, end in STAGES:
+        latency = (columns[end] - columns[start]) * 1000
+        latency = latency[~np.isnan(latency)]
+        if len(latency):
+            results.append((name, len(latency), np.percentile(latency, PERCENTILES), latency.max()))
+    return results
+
+def sequence_gaps(columns):
+    """Per-meter (missing, duplicated) counts from the sequence numbers seen"""
+    seqs_by_meter = defaultdict(list)
+    for meter_id, seq in zip(columns['meter_id'].tolist(), columns['seq'].tolist()):
+        seqs_by_meter[meter_id].append(seq)
+    gaps = {}
+    for meter_id, seqs in seqs_by_meter.items():
+        unique = len(set(seqs))
+        missing = max(seqs) - min(seqs) + 1 - unique
+        duplicated = len(seqs) - unique
+        if missing or duplicated:
+            gaps[meter_id] = (missing, duplicated)
+    return len(seqs_by_meter), gaps
+
+def timeline(columns, window):
+    """End-to-end latency and commit rate per window of publish time"""
+    published = columns['published_at']
+    latency = (columns['committed_at'] - published) * 1000
+    start = np.nanmin(published)
+    windows = ((published - start) // window).astype(np.int64)
+    rows = []
+    for index in np.unique(windows):
+        selected = latency[(windows == index) & ~np.isnan(latency)]
+        if len(selected):
+            p50, p95, p99 = np.percentile(selected, (50, 95, 99))
+            rows.append((index * window, len(selected) / window, p50, p95, p99))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest latency and loss report from subscriber "
+                                                 "trace files")
+    parser.add_argument('paths', nargs='+', help="trace files written with --trace-file")
+    parser.add_argument('--window', type=float, default=REPORT_WINDOW,
+                        help=f"seconds per timeline row (default: {REPORT_WINDOW:.0f})")
+    parser.add_argument('--show-meters', type=int, default=10,
+                        help="meters with sequence gaps to list (default: 10)")
+    args = parser.parse_args()
+
+    columns = load_traces(args.paths)
+    if not len(columns['seq']):
+        logging.warning("No traced readings found")
+        return
+
+    print(f"{'Stage':<11} {'Readings':>9} " + ' '.join(f"{f'p{p:g} ms':>10}" for p in PERCENTILES)
+          + f" {'max ms':>10}")
+    for name, count, values, maximum in stage_percentiles(columns):
+        print(f"{name:<11} {count:>9} " + ' '.join(f"{value:>10.1f}" for value in values)
+              + f" {maximum:>10.1f}")
+
+    spooled = int(np.isnan(columns['committed_at']).sum())
+    meters, gaps = sequence_gaps(columns)
+    missing = sum(gap[0] for gap in gaps.values())
+    duplicated = sum(gap[1] for gap in gaps.values())
+    print(f"\n{len(columns['seq'])} readings from {meters} meters: {missing} missing by sequence, "
+          f"{duplicated} duplicated, {spooled} spooled (no commit time)")
+    for meter_id, (meter_missing, meter_duplicated) in sorted(
+            gaps.items(), key=lambda item: -item[1][0])[:args.show_meters]:
+        print(f"  meter {meter_id}: {meter_missing} missing, {meter_duplicated} duplicated")
+
+    print(f"\n{'Publish s':>9} {'Rows/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for offset, rate, p50, p95, p99 in timeline(columns, args.window):
+        print(f"{offset:>9.0f} {rate:>9.0f} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+-- Latest ingested reading per meter, so "how recent is the data" is a lookup
+-- in a table with one row per meter instead of MAX(timestamp) over every chunk.
+-- Run after meter_registry_setup.sql. mqtt_subscriber.py and async_subscriber.py
+-- upsert it in the same transaction as every batch they write.
+
+CREATE TABLE IF NOT EXISTS ingest_watermarks (
+    meter_key INTEGER PRIMARY KEY,
+    latest TIMESTAMP NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Seed from the readings already stored
+INSERT INTO ingest_watermarks (meter_key, latest)
+SELECT meter_key, MAX(timestamp)
+FROM energy_readings
+GROUP BY meter_key
+ON CONFLICT (meter_key) DO UPDATE
+SET latest = EXCLUDED.latest, updated_at = NOW()
+WHERE EXCLUDED.latest > ingest_watermarks.latest;
+
+-- Compare: hypertable-wide MAX vs. the watermark table
+EXPLAIN ANALYZE
+SELECT MAX(timestamp) FROM energy_readings;
+
+EXPLAIN ANALYZE
+SELECT MAX(latest) FROM ingest_watermarks;
@@ -0,0 +1,406 @@
+import paho.mqtt.client as mqtt
+import time
+import queue
+import signal
+import logging
+import argparse
+import multiprocessing
+import urllib.request
+from datetime import datetime, timedelta
+
+from payload_codec import add_trace, PAYLOAD_FORMATS
+from fleet_generator import Fleet, step_readings, READING_INTERVAL
+from data_generator import (generate_meter_ids, gateway_messages, meter_messages, MQTT_BROKER,
+                            MQTT_PORT)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s')
+
+# Example: ramp a 10k-meter fleet from 1k to 50k msg/s over two minutes
+# with 4 publisher processes, watching a subscriber's metrics endpoint:
+#   python load_generator.py --meters 10000 --profile 0:1000 120:50000 --duration 180 \
+#       --processes 4 --metrics-url http://localhost:9100/metrics
+
+# Load parameters
+NUM_METERS = 500
+TARGET_RATE = 1000.0  # Readings per second across all publishers
+DURATION = 60.0  # Seconds of load
+PUBLISHER_PROCESSES = 1
+CONNECTIONS_PER_PROCESS = 1
+QOS = 0
+BURST_SECONDS = 0.05  # Token bucket capacity, in seconds of the current rate
+RATE_UPDATE_INTERVAL = 0.1  # Seconds between profile lookups in a publisher
+PROGRESS_INTERVAL = 0.5  # Seconds between publisher progress updates to the parent
+REPORT_INTERVAL = 5.0  # Seconds between report lines
+
+# Broker statistics (mosquitto $SYS topics) shown in the report
+BROKER_STATS = {
+    '$SYS/broker/store/messages/count': 'stored',
+    '$SYS/broker/load/messages/received/1min': 'received_1min',
+    '$SYS/broker/load/messages/sent/1min': 'sent_1min',
+    '$SYS/broker/clients/connected': 'clients',
+}
+
+# Subscriber metrics summed across --metrics-url endpoints
+SUBSCRIBER_METRICS = ('ingest_messages_received_total', 'ingest_rows_written_total',
+                      'ingest_queue_depth')
+
+class RateProfile:
+    """Target rate over time, linear between (seconds, rate) points.
+
+    The rate holds at the first point before it and at the last point
+    after it. Two points at the same time make a step.
+    """
+
+    def __init__(self, points):
+        self.points = sorted(points, key=lambda point: point[0])
+
+    @classmethod
+    def parse(cls, specs):
+        """Build a profile from ``seconds:rate`` strings"""
+        points = []
+        for spec in specs:
+            seconds, _, rate = spec.partition(':')
+            points.append((float(seconds), float(rate)))
+        return cls(points)
+
+    def rate_at(self, elapsed):
+        points = self.points
+        if elapsed <= points[0][0]:
+            return points[0][1]
+        for (t0, r0), (t1, r1) in zip(points, points[1:]):
+            if elapsed < t1:
+                return r0 + (r1 - r0) * (elapsed - t0) / (t1 - t0)
+        return points[-1][1]
+
+class TokenBucket:
+    """Token bucket pacing: tokens accrue at ``rate`` up to a small burst.
+
+    ``min_capacity`` must cover the largest single take (a whole gateway
+    batch), or that take could never be satisfied at low rates.
+    """
+
+    def __init__(self, rate, burst_seconds=BURST_SECONDS, min_capacity=1.0):
+        self.burst_seconds = burst_seconds
+        self.min_capacity = min_capacity
+        self.rate = 0.0
+        self.capacity = 1.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate)
+
+    def _refill(self, now):
+        self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.capacity)
+        self.updated = now
+
+    def set_rate(self, rate):
+        self._refill(time.monotonic())
+        self.rate = rate
+        self.capacity = max(rate * self.burst_seconds, self.min_capacity)
+
+    def consume(self, tokens=1.0):
+        """Take tokens; return 0, or the seconds to wait until they are available"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        if self.rate <= 0:
+            return RATE_UPDATE_INTERVAL
+        return (tokens - self.tokens) / self.rate
+
+def message_stream(meter_ids, payload_format, trace=False, gateway_size=0):
+    """Endless (topic, payload, reading count) stream: every meter once per simulated interval.
+
+    With ``trace``, readings carry their publish time and a per-meter
+    sequence number (the step count) for ingest_trace.py. With
+    ``gateway_size``, meters are batched onto gateway topics.
+    """
+    fleet = Fleet.random(meter_ids)
+    timestamp = datetime.now().replace(microsecond=0)
+    seq = 0
+    while True:
+        readings = step_readings(fleet, fleet.generate_step(timestamp))
+        if trace:
+            readings = ((meter_id, add_trace(reading, seq)) for meter_id, reading in readings)
+        if gateway_size:
+            yield from gateway_messages(readings, gateway_size, payload_format)
+        else:
+            yield from meter_messages(readings, payload_format)
+        timestamp += timedelta(seconds=READING_INTERVAL)
+        seq += 1
+
+class PublisherStats:
+    """Counters of one publisher process, updated from paho's network threads"""
+
+    def __init__(self):
+        self.published = 0
+        self.readings = 0  # Differs from published only with gateway batches
+        self.errors = 0
+        self.sent = 0  # Publishes handed to the network (QoS 0) or acknowledged (QoS 1+)
+        self.disconnects = 0
+
+    def on_publish(self, client, userdata, mid):
+        self.sent += 1
+
+    def on_disconnect(self, client, userdata, rc):
+        if rc != 0:
+            self.disconnects += 1
+
+def publisher_main(index, meter_ids, share, args, report_queue, stop_event):
+    """Publish this process's meters at ``share`` of the profile rate"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stats = PublisherStats()
+    clients = []
+    for connection in range(args.connections):
+        client = mqtt.Client(client_id=f"load-{index}-{connection}-{time.time_ns()}")
+        client.on_publish = stats.on_publish
+        client.on_disconnect = stats.on_disconnect
+        client.connect(args.broker, args.port, 60)
+        client.loop_start()
+        clients.append(client)
+
+    profile = RateProfile(args.profile)
+    # Tokens are readings, so --rate means the same load with or without gateways
+    bucket = TokenBucket(profile.rate_at(0) * share, min_capacity=max(args.gateway_size, 1))
+    messages = message_stream(meter_ids, args.format, args.trace, args.gateway_size)
+    started = time.monotonic()
+    next_rate_update = started + RATE_UPDATE_INTERVAL
+    next_progress = started + PROGRESS_INTERVAL
+    count = 0
+    pending = next(messages)
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            elapsed = now - started
+            if elapsed >= args.duration:
+                break
+            if now >= next_rate_update:
+                bucket.set_rate(profile.rate_at(elapsed) * share)
+                next_rate_update = now + RATE_UPDATE_INTERVAL
+            if now >= next_progress:
+                report_queue.put((index, stats.published, stats.readings, stats.errors, stats.sent,
+                                  stats.disconnects, elapsed))
+                next_progress = now + PROGRESS_INTERVAL
+
+            wait = bucket.consume(pending[2])
+            if wait > 0:
+                time.sleep(min(wait, RATE_UPDATE_INTERVAL))
+                continue
+
+            topic, payload, readings = pending
+            pending = next(messages)
+            try:
+                info = clients[count % len(clients)].publish(topic, payload, qos=args.qos)
+            except (ValueError, OSError):
+                stats.errors += 1
+                continue
+            count += 1
+            if info.rc == mqtt.MQTT_ERR_SUCCESS:
+                stats.published += 1
+                stats.readings += readings
+            else:
+                stats.errors += 1
+    finally:
+        elapsed = time.monotonic() - started
+        for client in clients:
+            client.loop_stop()
+            client.disconnect()
+        report_queue.put((index, stats.published, stats.readings, stats.errors, stats.sent,
+                          stats.disconnects, elapsed))
+
+class BrokerMonitor:
+    """Latest values of the broker's $SYS statistics"""
+
+    def __init__(self, broker, port):
+        self.values = {}
+        self.client = mqtt.Client(client_id=f"load-monitor-{time.time_ns()}")
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.connect(broker, port, 60)
+        self.client.loop_start()
+
+    def on_connect(self, client, userdata, flags, rc):
+        for topic in BROKER_STATS:
+            client.subscribe(topic)
+
+    def on_message(self, client, userdata, msg):
+        try:
+            self.values[BROKER_STATS[msg.topic]] = float(msg.payload)
+        except (KeyError, ValueError):
+            pass
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+def scrape_metrics(urls):
+    """Sum SUBSCRIBER_METRICS over Prometheus text endpoints; None if none answered"""
+    totals = dict.fromkeys(SUBSCRIBER_METRICS, 0.0)
+    answered = False
+    for url in urls:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                body = response.read().decode('utf-8')
+        except OSError as e:
+            logging.warning(f"Could not scrape {url}: {e}")
+            continue
+        answered = True
+        for line in body.splitlines():
+            name, _, value = line.partition(' ')
+            if name in totals:
+                totals[name] += float(value)
+    return totals if answered else None
+
+class LoadGenerator:
+    """Run the publisher processes and report achieved rate, errors and backlog"""
+
+    def __init__(self, args):
+        self.args = args
+        self.report_queue = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.progress = {}
+        self.processes = []
+
+    def _drain_reports(self):
+        while True:
+            try:
+                index, *counters = self.report_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.progress[index] = counters
+
+    def totals(self):
+        published = sum(counters[0] for counters in self.progress.values())
+        readings = sum(counters[1] for counters in self.progress.values())
+        errors = sum(counters[2] for counters in self.progress.values())
+        sent = sum(counters[3] for counters in self.progress.values())
+        disconnects = sum(counters[4] for counters in self.progress.values())
+        return published, readings, errors, sent, disconnects
+
+    def publishing_seconds(self):
+        """How long the longest-running publisher has been publishing"""
+        return max((counters[5] for counters in self.progress.values()), default=0.0)
+
+    def stop(self, signum=None, frame=None):
+        self.stop_event.set()
+
+    def run(self):
+        args = self.args
+        meter_ids = generate_meter_ids(args.meters)
+        slices = [meter_ids[i::args.processes] for i in range(args.processes)]
+        for index, meters in enumerate(slices):
+            process = multiprocessing.Process(
+                target=publisher_main,
+                args=(index, meters, len(meters) / len(meter_ids), args,
+                      self.report_queue, self.stop_event),
+                name=f"publisher-{index}")
+            process.start()
+            self.processes.append(process)
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        monitor = BrokerMonitor(args.broker, args.port)
+        profile = RateProfile(args.profile)
+        logging.info(f"Publishing for {len(meter_ids)} meters from {args.processes} processes x "
+                     f"{args.connections} connections for {args.duration:.0f}s")
+
+        started = last_report = time.monotonic()
+        last_readings = 0
+        last_metrics = scrape_metrics(args.metrics_url) if args.metrics_url else None
+        samples = []
+        while any(process.is_alive() for process in self.processes):
+            time.sleep(0.2)
+            self._drain_reports()
+            now = time.monotonic()
+            if now - last_report < args.report_interval:
+                continue
+
+            published, readings, errors, sent, disconnects = self.totals()
+            achieved = (readings - last_readings) / (now - last_report)
+            target = profile.rate_at(now - started)
+            samples.append((target, achieved))
+            line = f"target {target:,.0f}/s, achieved {achieved:,.0f}/s, {published} published, "
+            if args.gateway_size:
+                line += f"{readings} readings, "
+            line += (f"{errors} errors, {disconnects} disconnects, "
+                     f"client backlog {published - sent}")
+            broker = monitor.values
+            if broker:
+                line += (f", broker stored {broker.get('stored', 0):.0f}, "
+                         f"in/out 1min {broker.get('received_1min', 0):,.0f}/"
+                         f"{broker.get('sent_1min', 0):,.0f}")
+            metrics = scrape_metrics(args.metrics_url) if args.metrics_url else None
+            if metrics and last_metrics:
+                received = metrics['ingest_messages_received_total']
+                line += (f", subscriber {(received - last_metrics['ingest_messages_received_total']) / (now - last_report):,.0f}/s "
+                         f"received, {(metrics['ingest_rows_written_total'] - last_metrics['ingest_rows_written_total']) / (now - last_report):,.0f}/s "
+                         f"written, queue depth {metrics['ingest_queue_depth']:.0f}, "
+                         f"end-to-end backlog {published - received:.0f}")
+            if metrics:
+                last_metrics = metrics
+            logging.info(line)
+            last_report, last_readings = now, readings
+
+        for process in self.processes:
+            process.join()
+        self._drain_reports()
+        monitor.close()
+
+        elapsed = self.publishing_seconds() or time.monotonic() - started
+        published, readings, errors, sent, disconnects = self.totals()
+        logging.info(f"Done: {published} published ({readings} readings) in {elapsed:.1f}s "
+                     f"({readings / elapsed:,.0f} readings/s average), {errors} errors, "
+                     f"{disconnects} disconnects")
+        if samples:
+            shortfall = max(samples, key=lambda sample: sample[0] - sample[1])
+            logging.info(f"Largest shortfall: achieved {shortfall[1]:,.0f}/s against a "
+                         f"target of {shortfall[0]:,.0f}/s")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Rate-controlled MQTT load generator for "
+                                                 "finding the ingest saturation point")
+    parser.add_argument('--broker', default=MQTT_BROKER,
+                        help=f"MQTT broker host (default: {MQTT_BROKER})")
+    parser.add_argument('--port', type=int, default=MQTT_PORT,
+                        help=f"MQTT broker port (default: {MQTT_PORT})")
+    parser.add_argument('--meters', type=int, default=NUM_METERS,
+                        help=f"number of simulated meters (default: {NUM_METERS})")
+    parser.add_argument('--rate', type=float, default=TARGET_RATE,
+                        help=f"constant target readings per second (default: {TARGET_RATE:.0f})")
+    parser.add_argument('--profile', nargs='+', metavar='SECONDS:RATE',
+                        help="rate profile, linear between points, e.g. 0:1000 60:20000; "
+                             "overrides --rate")
+    parser.add_argument('--duration', type=float, default=DURATION,
+                        help=f"seconds of load (default: {DURATION:.0f})")
+    parser.add_argument('--processes', type=int, default=PUBLISHER_PROCESSES,
+                        help=f"publisher processes (default: {PUBLISHER_PROCESSES})")
+    parser.add_argument('--connections', type=int, default=CONNECTIONS_PER_PROCESS,
+                        help=f"MQTT connections per process (default: {CONNECTIONS_PER_PROCESS})")
+    parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=QOS,
+                        help=f"publish QoS (default: {QOS})")
+    parser.add_argument('--format', choices=PAYLOAD_FORMATS, default='json',
+                        help="payload encoding (default: json)")
+    parser.add_argument('--gateway-size', type=int, default=0,
+                        help="batch this many meters per message on energy/gateways/{gateway_id}; "
+                             "--rate still counts readings (default: 0, one message per meter)")
+    parser.add_argument('--trace', action='store_true',
+                        help="add publish time and sequence numbers for latency tracing")
+    parser.add_argument('--metrics-url', nargs='+', default=[],
+                        help="subscriber /metrics endpoints to include in the report")
+    parser.add_argument('--report-interval', type=float, default=REPORT_INTERVAL,
+                        help=f"seconds between report lines (default: {REPORT_INTERVAL:.0f})")
+    args = parser.parse_args(argv)
+    try:
+        # Kept as plain points so the args pickle cleanly into the publishers
+        args.profile = RateProfile.parse(args.profile or [f"0:{args.rate}"]).points
+    except ValueError:
+        parser.error(f"--profile points must be SECONDS:RATE, got {' '.join(args.profile)}")
+    return args
+
+def main():
+    LoadGenerator(parse_args()).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+-- Replace the text meter_id in every reading with an integer meter_key from a meters table
+-- Run after dedup_setup.sql; the subscriber registers new meters itself from then on
+
+-- Record disk space and a per-meter query before the migration
+SELECT hypertable_name,
+       pg_size_pretty(hypertable_size(format('%I', hypertable_name)::regclass)) AS size_before_registry
+FROM timescaledb_information.hypertables
+WHERE hypertable_name IN ('energy_readings', 'energy_readings_3h', 'energy_readings_week');
+
+EXPLAIN ANALYZE
+SELECT meter_id,
+       DATE_TRUNC('month', timestamp) as month,
+       SUM(energy) as total_energy
+FROM energy_readings
+GROUP BY meter_id, month
+ORDER BY month, total_energy DESC;
+
+-- Meter registry: one row per external meter ID
+CREATE TABLE IF NOT EXISTS meters (
+    meter_key SERIAL PRIMARY KEY,
+    meter_id TEXT NOT NULL UNIQUE,
+    registered_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO meters (meter_id)
+SELECT meter_id FROM energy_readings
+UNION
+SELECT meter_id FROM energy_readings_3h
+UNION
+SELECT meter_id FROM energy_readings_week
+ORDER BY meter_id
+ON CONFLICT (meter_id) DO NOTHING;
+
+-- Rebuild each hypertable with meter_key in place of meter_id
+-- (dropping the old tables also drops the continuous aggregates, recreated below)
+
+-- 1-day chunks
+CREATE TABLE energy_readings_keyed (LIKE energy_readings INCLUDING DEFAULTS);
+ALTER TABLE energy_readings_keyed DROP COLUMN meter_id, ADD COLUMN meter_key INTEGER NOT NULL;
+SELECT create_hypertable('energy_readings_keyed', 'timestamp', chunk_time_interval => INTERVAL '1 day');
+INSERT INTO energy_readings_keyed (meter_key, timestamp, power, voltage, current, frequency, energy)
+SELECT DISTINCT ON (m.meter_key, r.timestamp)
+       m.meter_key, r.timestamp, r.power, r.voltage, r.current, r.frequency, r.energy
+FROM energy_readings r
+JOIN meters m ON m.meter_id = r.meter_id;
+DROP TABLE energy_readings CASCADE;
+ALTER TABLE energy_readings_keyed RENAME TO energy_readings;
+
+-- 3-hour chunks
+CREATE TABLE energy_readings_3h_keyed (LIKE energy_readings_3h INCLUDING DEFAULTS);
+ALTER TABLE energy_readings_3h_keyed DROP COLUMN meter_id, ADD COLUMN meter_key INTEGER NOT NULL;
+SELECT create_hypertable('energy_readings_3h_keyed', 'timestamp', chunk_time_interval => INTERVAL '3 hours');
+INSERT INTO energy_readings_3h_keyed (meter_key, timestamp, power, voltage, current, frequency, energy)
+SELECT m.meter_key, r.timestamp, r.power, r.voltage, r.current, r.frequency, r.energy
+FROM energy_readings_3h r
+JOIN meters m ON m.meter_id = r.meter_id;
+DROP TABLE energy_readings_3h CASCADE;
+ALTER TABLE energy_readings_3h_keyed RENAME TO energy_readings_3h;
+
+-- 1-week chunks
+CREATE TABLE energy_readings_week_keyed (LIKE energy_readings_week INCLUDING DEFAULTS);
+ALTER TABLE energy_readings_week_keyed DROP COLUMN meter_id, ADD COLUMN meter_key INTEGER NOT NULL;
+SELECT create_hypertable('energy_readings_week_keyed', 'timestamp', chunk_time_interval => INTERVAL '1 week');
+INSERT INTO energy_readings_week_keyed (meter_key, timestamp, power, voltage, current, frequency, energy)
+SELECT m.meter_key, r.timestamp, r.power, r.voltage, r.current, r.frequency, r.energy
+FROM energy_readings_week r
+JOIN meters m ON m.meter_id = r.meter_id;
+DROP TABLE energy_readings_week CASCADE;
+ALTER TABLE energy_readings_week_keyed RENAME TO energy_readings_week;
+
+-- Unique index used by the subscriber's INSERT ... ON CONFLICT DO NOTHING
+CREATE UNIQUE INDEX IF NOT EXISTS energy_readings_meter_key_timestamp_key
+ON energy_readings (meter_key, timestamp);
+
+-- Compression, segmented by meter so per-meter queries decompress only their own rows
+ALTER TABLE energy_readings SET (timescaledb.compress,
+                               timescaledb.compress_segmentby = 'meter_key',
+                               timescaledb.compress_orderby = 'timestamp DESC');
+SELECT add_compression_policy('energy_readings', INTERVAL '1 day');
+
+ALTER TABLE energy_readings_3h SET (timescaledb.compress,
+                                  timescaledb.compress_segmentby = 'meter_key',
+                                  timescaledb.compress_orderby = 'timestamp DESC');
+SELECT add_compression_policy('energy_readings_3h', INTERVAL '1 day');
+
+ALTER TABLE energy_readings_week SET (timescaledb.compress,
+                                    timescaledb.compress_segmentby = 'meter_key',
+                                    timescaledb.compress_orderby = 'timestamp DESC');
+SELECT add_compression_policy('energy_readings_week', INTERVAL '1 day');
+
+SELECT compress_chunk(chunk) FROM show_chunks('energy_readings', older_than => INTERVAL '1 day') AS chunk;
+SELECT compress_chunk(chunk) FROM show_chunks('energy_readings_3h', older_than => INTERVAL '1 day') AS chunk;
+SELECT compress_chunk(chunk) FROM show_chunks('energy_readings_week', older_than => INTERVAL '1 day') AS chunk;
+
+-- Recreate the continuous aggregates, now grouped by meter_key
+\i continuous_aggregation_setup.sql
+\i optimize_aggregations.sql
+
+-- Record disk space and the same per-meter query after the migration
+SELECT hypertable_name,
+       pg_size_pretty(hypertable_size(format('%I', hypertable_name)::regclass)) AS size_after_registry
+FROM timescaledb_information.hypertables
+WHERE hypertable_name IN ('energy_readings', 'energy_readings_3h', 'energy_readings_week');
+
+EXPLAIN ANALYZE
+SELECT meter_key,
+       DATE_TRUNC('month', timestamp) as month,
+       SUM(energy) as total_energy
+FROM energy_readings
+GROUP BY meter_key, month
+ORDER BY month, total_energy DESC;
+
+-- Meter IDs are resolved only for display
+EXPLAIN ANALYZE
+SELECT m.meter_id,
+       DATE_TRUNC('month', r.timestamp) as month,
+       SUM(r.energy) as total_energy
+FROM energy_readings r
+JOIN meters m ON m.meter_key = r.meter_key
+GROUP BY m.meter_id, month
+ORDER BY month, total_energy DESC;
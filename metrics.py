@@ -0,0 +1,200 @@
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default histogram buckets (seconds) for flush and commit latency
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Default buckets for rows per batch
+BATCH_SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonically increasing count"""
+    type = 'counter'
+
+    def __init__(self, name, help, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self._value = 0
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self):
+        return [f"{self.name} {_format_value(self._value)}"]
+
+class Gauge:
+    """Point-in-time value, either set directly or read from a callback at scrape time"""
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self._value = 0
+        self._function = function
+        registry.register(self)
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            try:
+                return self._function()
+            except Exception:
+                return float('nan')
+        return self._value
+
+    def samples(self):
+        return [f"{self.name} {_format_value(self.value)}"]
+
+class Histogram:
+    """Distribution of observations over fixed cumulative buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self):
+        """Context manager observing the duration of a with-block"""
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not worth a log line each
+        pass
+
+def start_metrics_server(port, host='', registry=REGISTRY):
+    """Serve /metrics on a daemon thread and return the server"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host or '0.0.0.0'}:{port}/metrics")
+    return server
+
+class RateLimitedLogger:
+    """Emit at most one log line per interval, counting the ones suppressed.
+
+    Keeps hot paths (a line per batch or per bad message) from turning
+    logging into the bottleneck while still showing that events happen.
+    """
+
+    def __init__(self, interval=10.0, logger=None):
+        self.interval = interval
+        self.logger = logger or logging.getLogger()
+        self._next = 0.0
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def log(self, level, message):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next:
+                self._suppressed += 1
+                return
+            suppressed, self._suppressed = self._suppressed, 0
+            self._next = now + self.interval
+        if suppressed:
+            message = f"{message} ({suppressed} similar messages suppressed)"
+        self.logger.log(level, message)
+
+    def info(self, message):
+        self.log(logging.INFO, message)
+
+    def warning(self, message):
+        self.log(logging.WARNING, message)
+
+    def error(self, message):
+        self.log(logging.ERROR, message)
@@ -0,0 +1,323 @@
+import gzip
+import time
+import struct
+import signal
+import cProfile
+import pstats
+import logging
+import argparse
+import threading
+
+import paho.mqtt.client as mqtt
+
+import mqtt_subscriber
+from mqtt_subscriber import (MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, GATEWAY_TOPIC, ConnectionPool,
+                             MeterRegistry, DuplicateFilter, BatchWriter, create_staging_table,
+                             handle_message)
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Example: capture ten minutes of live traffic, then replay it 20x faster
+# through the broker, or as fast as possible straight into the write path:
+#   python mqtt_replay.py record traffic.log.gz --duration 600
+#   python mqtt_replay.py replay traffic.log.gz --speed 20
+#   python mqtt_replay.py replay traffic.log.gz --in-process --speed 0 --batch-size 5000
+
+# Log format: a magic line, then one record per message; a .gz path is gzip-compressed
+LOG_MAGIC = b'MQTTLOG1\n'
+RECORD_HEADER = struct.Struct('>dHI')  # arrival time (epoch s), topic length, payload length
+
+RECORD_FLUSH_INTERVAL = 1.0  # Seconds between flushes of the log while recording
+PROGRESS_INTERVAL = 5.0  # Seconds between progress lines
+REPLAY_SPEED = 1.0  # 1 = recorded timing, N = N times faster, 0 = as fast as possible
+PROFILE_LINES = 25  # Functions listed by --profile
+
+def open_log(path, mode):
+    """Open a traffic log, gzip-compressed when the path ends in .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=6)
+    return open(path, mode, buffering=1024 * 1024)
+
+class TrafficRecorder:
+    """Append every message received on the subscribed topics to a traffic log"""
+
+    def __init__(self, path, topics):
+        self.topics = topics
+        self.messages = 0
+        self.bytes = 0
+        self._file = open_log(path, 'wb')
+        self._file.write(LOG_MAGIC)
+        self._last_flush = time.monotonic()
+
+    def on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            logging.info(f"Connected to MQTT broker, recording {', '.join(self.topics)}")
+            client.subscribe([(topic, 0) for topic in self.topics])
+        else:
+            logging.error(f"Failed to connect to MQTT broker with code {rc}")
+
+    def on_message(self, client, userdata, msg):
+        # paho calls this from its single network thread, so no locking is needed
+        topic = msg.topic.encode('utf-8')
+        self._file.write(RECORD_HEADER.pack(time.time(), len(topic), len(msg.payload)))
+        self._file.write(topic)
+        self._file.write(msg.payload)
+        self.messages += 1
+        self.bytes += len(msg.payload)
+        now = time.monotonic()
+        if now - self._last_flush >= RECORD_FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self):
+        self._file.close()
+
+def read_log(path):
+    """Yield (arrival time, topic, payload) for every record in a traffic log"""
+    with open_log(path, 'rb') as f:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError(f"{path} is not a traffic log")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # A recording cut short may end mid-record; keep what is complete
+                return
+            arrival, topic_len, payload_len = RECORD_HEADER.unpack(header)
+            topic = f.read(topic_len)
+            payload = f.read(payload_len)
+            if len(payload) < payload_len:
+                return
+            yield arrival, topic.decode('utf-8'), payload
+
+def schedule(records, speed=REPLAY_SPEED, max_gap=None):
+    """Yield (seconds from start, topic, payload) for replaying records.
+
+    Inter-arrival gaps are capped at ``max_gap`` seconds (so idle periods
+    can be cut out) and then divided by ``speed``; speed 0 sends every
+    message at offset 0, as fast as the consumer takes them.
+    """
+    offset = 0.0
+    previous = None
+    for arrival, topic, payload in records:
+        if previous is not None and speed > 0:
+            gap = max(arrival - previous, 0.0)
+            if max_gap is not None:
+                gap = min(gap, max_gap)
+            offset += gap / speed
+        previous = arrival
+        yield offset, topic, payload
+
+def paced(scheduled):
+    """Yield (lag, topic, payload), sleeping until each message is due.
+
+    ``lag`` is how many seconds behind schedule the message is released,
+    which shows when the consumer cannot keep up with the requested speed.
+    """
+    started = time.monotonic()
+    for offset, topic, payload in scheduled:
+        wait = started + offset - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        yield max(-wait, 0.0), topic, payload
+
+class ReplayStats:
+    """Messages and bytes replayed, with periodic progress lines"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.max_lag = 0.0
+        self.started = time.monotonic()
+        self._last_report = self.started
+        self._last_messages = 0
+
+    def add(self, payload, lag=0.0):
+        self.messages += 1
+        self.bytes += len(payload)
+        self.max_lag = max(self.max_lag, lag)
+        now = time.monotonic()
+        if now - self._last_report >= PROGRESS_INTERVAL:
+            rate = (self.messages - self._last_messages) / (now - self._last_report)
+            logging.info(f"Replayed {self.messages} messages ({rate:,.0f}/s), "
+                         f"max lag {self.max_lag:.3f}s")
+            self._last_report, self._last_messages = now, self.messages
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return (f"{self.messages} messages ({self.bytes / 1e6:.1f} MB) in {elapsed:.1f}s, "
+                f"{self.messages / elapsed:,.0f} messages/s, max lag {self.max_lag:.3f}s")
+
+def record(args):
+    """Record live traffic until interrupted, --duration passes or --count messages arrive"""
+    recorder = TrafficRecorder(args.path, args.topics)
+    client = mqtt.Client()
+    client.on_connect = recorder.on_connect
+    client.on_message = recorder.on_message
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+    started = time.monotonic()
+    try:
+        while not stop_event.wait(0.1):
+            if args.duration and time.monotonic() - started >= args.duration:
+                break
+            if args.count and recorder.messages >= args.count:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        recorder.close()
+    logging.info(f"Recorded {recorder.messages} messages ({recorder.bytes / 1e6:.1f} MB of "
+                 f"payload) in {time.monotonic() - started:.1f}s to {args.path}")
+
+def replay_to_broker(args):
+    """Publish a traffic log back to the broker on its original topics"""
+    client = mqtt.Client()
+    client.connect(args.broker, args.port, 60)
+    client.loop_start()
+    stats = ReplayStats()
+    try:
+        for _ in range(args.repeat):
+            for lag, topic, payload in paced(schedule(read_log(args.path), args.speed, args.max_gap)):
+                client.publish(topic, payload, qos=args.qos)
+                stats.add(payload, lag)
+    except KeyboardInterrupt:
+        logging.info("Replay interrupted")
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    logging.info(f"Published {stats.summary()}")
+
+class CountingWriter:
+    """Stand-in for BatchWriter that only counts rows, to time decoding alone"""
+
+    tracer = None
+
+    def __init__(self):
+        self.rows = 0
+
+    def add(self, row, trace=None):
+        self.rows += 1
+
+    def close(self):
+        pass
+
+def replay_in_process(args, subscriber_args):
+    """Feed a traffic log to the subscriber's message handler, bypassing the broker.
+
+    The whole log is read into memory first, so file reads and
+    decompression are not part of the measured time.
+    """
+    records = list(read_log(args.path))
+    logging.info(f"Loaded {len(records)} messages from {args.path}")
+
+    pool = None
+    if args.no_write:
+        writer = CountingWriter()
+    else:
+        pool = ConnectionPool(size=subscriber_args.pool_size,
+                              connect_timeout=subscriber_args.connect_timeout,
+                              statement_timeout=subscriber_args.statement_timeout,
+                              setup=create_staging_table)
+        meter_registry = MeterRegistry()
+        with pool.connection() as conn:
+            meter_registry.load(conn)
+        writer = BatchWriter(pool, batch_size=subscriber_args.batch_size,
+                             flush_interval=subscriber_args.flush_interval,
+                             deduplicate=subscriber_args.deduplicate,
+                             duplicate_filter=DuplicateFilter() if subscriber_args.deduplicate else None,
+                             meter_registry=meter_registry)
+
+    profiler = cProfile.Profile() if args.profile else None
+    stats = ReplayStats()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        for _ in range(args.repeat):
+            for lag, topic, payload in paced(schedule(records, args.speed, args.max_gap)):
+                handle_message(writer, topic, payload, time.time())
+                stats.add(payload, lag)
+        # The final flush is part of the write path being measured
+        writer.close()
+    except KeyboardInterrupt:
+        logging.info("Replay interrupted")
+        writer.close()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if pool is not None:
+            pool.closeall()
+
+    elapsed = time.monotonic() - stats.started
+    if args.no_write:
+        logging.info(f"Decoded {stats.summary()}, {writer.rows / elapsed:,.0f} readings/s")
+    else:
+        logging.info(f"Handled {stats.summary()}, {writer.rows_written} readings written "
+                     f"({writer.rows_written / elapsed:,.0f}/s), {writer.duplicates_dropped} "
+                     f"duplicates, {writer.rows_spooled + writer.rows_failed} not written")
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        logging.info(f"Profile written to {args.profile}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Record MQTT meter traffic to a log and replay it for subscriber benchmarks. "
+                    "In --in-process replay, arguments not listed here are passed to "
+                    "mqtt_subscriber (batch size, pool size, --no-dedup, ...).")
+    parser.add_argument('--broker', default=MQTT_BROKER,
+                        help=f"MQTT broker host (default: {MQTT_BROKER})")
+    parser.add_argument('--port', type=int, default=MQTT_PORT,
+                        help=f"MQTT broker port (default: {MQTT_PORT})")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = commands.add_parser('record', help="capture live traffic to a log")
+    record_parser.add_argument('path', help="traffic log to write (.gz to compress)")
+    record_parser.add_argument('--topics', nargs='+', default=[MQTT_TOPIC, GATEWAY_TOPIC],
+                               help=f"topic filters to record (default: {MQTT_TOPIC} {GATEWAY_TOPIC})")
+    record_parser.add_argument('--duration', type=float,
+                               help="stop after this many seconds (default: until interrupted)")
+    record_parser.add_argument('--count', type=int,
+                               help="stop after this many messages (default: no limit)")
+
+    replay_parser = commands.add_parser('replay', help="replay a log to the broker or in-process")
+    replay_parser.add_argument('path', help="traffic log to replay")
+    replay_parser.add_argument('--speed', type=float, default=REPLAY_SPEED,
+                               help=f"timing multiplier: 1 = as recorded, N = N times faster, "
+                                    f"0 = as fast as possible (default: {REPLAY_SPEED:g})")
+    replay_parser.add_argument('--max-gap', type=float,
+                               help="cap recorded gaps at this many seconds before scaling "
+                                    "(default: keep them)")
+    replay_parser.add_argument('--repeat', type=int, default=1,
+                               help="times to replay the log (default: 1)")
+    replay_parser.add_argument('--qos', type=int, choices=(0, 1, 2), default=0,
+                               help="publish QoS when replaying to the broker (default: 0)")
+    replay_parser.add_argument('--in-process', action='store_true',
+                               help="call mqtt_subscriber's message handler directly instead "
+                                    "of publishing")
+    replay_parser.add_argument('--no-write', action='store_true',
+                               help="with --in-process, decode only and count rows")
+    replay_parser.add_argument('--profile', metavar='FILE',
+                               help="with --in-process, write cProfile stats to FILE and "
+                                    "print the top functions")
+    args, subscriber_argv = parser.parse_known_args()
+
+    if args.command == 'record':
+        if subscriber_argv:
+            parser.error(f"unrecognized arguments: {' '.join(subscriber_argv)}")
+        record(args)
+    elif args.in_process:
+        replay_in_process(args, mqtt_subscriber.parse_args(subscriber_argv))
+    else:
+        if subscriber_argv:
+            parser.error(f"unrecognized arguments: {' '.join(subscriber_argv)}")
+        replay_to_broker(args)
+
+if __name__ == "__main__":
+    main()
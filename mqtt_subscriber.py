@@ -1,9 +1,28 @@
 import paho.mqtt.client as mqtt
 import psycopg2
-import json
-from datetime import datetime
+import io
+import os
+import math
+import time
+import struct
+import queue
+import random
+import signal
+import argparse
+import functools
+import threading
+import collections
+from contextlib import contextmanager
+from datetime import datetime, timezone
 import logging
 
+from metrics import (Counter, Gauge, Histogram, RateLimitedLogger, start_metrics_server,
+                     BATCH_SIZE_BUCKETS)
+from payload_codec import decode_reading, decode_batch, PayloadDecodeError
+from spool import Spool, DURABILITY_LEVELS, DURABILITY, SPOOL_DIR, SEGMENT_MAX_BYTES
+from ingest_trace import Tracer
+from watermarks import watermarks_available
+
 # Configure logging
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
@@ -22,82 +41,1106 @@ MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
 MQTT_TOPIC = "energy/meters/#"
 
-def connect_to_db():
-    """Connect to the PostgreSQL database and return connection"""
+# Gateway topics carry a batch of readings for many meters per message
+GATEWAY_TOPIC = "energy/gateways/#"
+GATEWAY_TOPIC_PREFIX = "energy/gateways/"
+
+# Connection pool parameters
+POOL_SIZE = 4  # Maximum number of open database connections
+CONNECT_TIMEOUT = 5  # Seconds to wait for a new connection
+STATEMENT_TIMEOUT = 30000  # Milliseconds before the server cancels a statement
+HEALTH_CHECK_INTERVAL = 30.0  # Ping connections idle for longer than this (seconds)
+RECONNECT_INITIAL_DELAY = 0.5  # First backoff delay after a failed connect (seconds)
+RECONNECT_MAX_DELAY = 30.0  # Upper bound for the exponential backoff (seconds)
+RECONNECT_MAX_ATTEMPTS = 6  # Attempts per request before giving up (0 = retry forever)
+
+# Batched writer parameters
+BATCH_SIZE = 1000  # Flush as soon as this many readings are buffered
+FLUSH_INTERVAL = 1.0  # Maximum time (seconds) a reading may wait in the buffer
+
+# Work queue parameters (used when --writer-threads > 0)
+WRITER_THREADS = 0  # 0 = write from the MQTT network thread as before
+QUEUE_SIZE = 10000  # Maximum messages waiting for a writer thread
+BACKPRESSURE_POLICIES = ('block', 'drop-oldest', 'spill')
+BACKPRESSURE_POLICY = 'block'
+SPILL_PATH = 'subscriber_spill.bin'  # Overflow file for the spill policy
+
+# Spool replay parameters (readings that could not be written while the database was down)
+REPLAY_BATCH_SIZE = 50000  # Rows per replay COPY
+REPLAY_MAX_ROWS_PER_SEC = 100000  # Rate limit so catch-up leaves room for live traffic
+REPLAY_RETRY_INTERVAL = 5.0  # Seconds between replay attempts while the database is down
+
+# Duplicate handling: readings are staged and inserted with ON CONFLICT DO NOTHING
+# against the unique (meter_key, timestamp) index (dedup_setup.sql, meter_registry_setup.sql)
+DEDUPLICATE = True
+RECENT_TIMESTAMPS_PER_METER = 8  # In-memory filter catches repeats of these before the write
+
+# Keep ingest_watermarks (ingest_watermarks_setup.sql) current with every batch,
+# so readers find the newest reading time without scanning the hypertable
+UPDATE_WATERMARKS = True
+
+# Interval (seconds) between status log lines
+STATS_INTERVAL = 60.0
+
+# Port for the Prometheus metrics endpoint (0 = disabled)
+METRICS_PORT = 0
+
+# Ingestion metrics
+MESSAGES_RECEIVED = Counter('ingest_messages_received_total', 'MQTT messages received')
+MESSAGES_DECODED = Counter('ingest_messages_decoded_total', 'Messages decoded into readings')
+MESSAGES_FAILED = Counter('ingest_messages_failed_total', 'Messages that could not be decoded')
+READINGS_REJECTED = Counter('ingest_readings_rejected_total',
+                            'Invalid readings skipped from otherwise valid gateway batches')
+ROWS_WRITTEN = Counter('ingest_rows_written_total', 'Readings committed to the database')
+ROWS_SPOOLED = Counter('ingest_rows_spooled_total', 'Readings written to the local spool')
+ROWS_REPLAYED = Counter('ingest_rows_replayed_total', 'Spooled readings replayed into the database')
+ROWS_FAILED = Counter('ingest_rows_failed_total', 'Readings dropped after a write error')
+DUPLICATES_FILTERED = Counter('ingest_duplicates_filtered_total',
+                              'Repeated readings dropped by the in-memory filter')
+DUPLICATES_CONFLICTED = Counter('ingest_duplicates_conflicted_total',
+                                'Readings skipped by ON CONFLICT DO NOTHING')
+METERS_REGISTERED = Counter('ingest_meters_registered_total',
+                            'New meters added to the meters table by this process')
+BATCH_ROWS = Histogram('ingest_batch_rows', 'Readings per flushed batch', buckets=BATCH_SIZE_BUCKETS)
+FLUSH_SECONDS = Histogram('ingest_flush_seconds', 'Time to serialize and write one batch')
+COMMIT_SECONDS = Histogram('ingest_commit_seconds', 'Time spent in COMMIT')
+QUEUE_DEPTH = Gauge('ingest_queue_depth', 'Messages waiting in the work queue')
+POOL_OPEN_CONNECTIONS = Gauge('ingest_db_open_connections', 'Open database connections')
+POOL_RECONNECTS = Gauge('ingest_db_reconnects', 'Database reconnects since start')
+SPOOL_BACKLOG_BYTES = Gauge('ingest_spool_backlog_bytes', 'Spooled bytes awaiting replay')
+METERS_CACHED = Gauge('ingest_meters_cached', 'Meter IDs in the in-process registry cache')
+
+# Hot-path log lines are rate limited so logging does not cap throughput
+BATCH_LOG = RateLimitedLogger(interval=10.0)
+MESSAGE_ERROR_LOG = RateLimitedLogger(interval=5.0)
+
+# Columns of a parsed reading, in COPY order. Readings arrive keyed by the
+# external meter_id; energy_readings stores the integer meter_key from the
+# meters table instead (see meter_registry_setup.sql)
+READING_COLUMNS = ('meter_id', 'timestamp', 'power', 'voltage', 'current', 'frequency', 'energy')
+MEASUREMENT_COLUMNS = READING_COLUMNS[1:]
+
+# Bulk write: COPY into a per-connection temp table, register any new meters,
+# then move the rows across in one statement that swaps meter_id for meter_key
+# and (when deduplicating) skips (meter_key, timestamp) conflicts
+STAGING_TABLE_QUERY = """
+CREATE TEMP TABLE energy_readings_staging
+(LIKE energy_readings INCLUDING DEFAULTS) ON COMMIT DELETE ROWS;
+ALTER TABLE energy_readings_staging DROP COLUMN meter_key, ADD COLUMN meter_id TEXT NOT NULL;
+"""
+STAGING_COPY_QUERY = f"COPY energy_readings_staging ({', '.join(READING_COLUMNS)}) FROM STDIN"
+REGISTER_METERS_QUERY = """
+INSERT INTO meters (meter_id)
+SELECT DISTINCT meter_id FROM energy_readings_staging
+ON CONFLICT (meter_id) DO NOTHING
+"""
+STAGING_INSERT_QUERY = f"""
+INSERT INTO energy_readings (meter_key, {', '.join(MEASUREMENT_COLUMNS)})
+SELECT DISTINCT ON (m.meter_key, s.timestamp)
+       m.meter_key, {', '.join('s.' + column for column in MEASUREMENT_COLUMNS)}
+FROM energy_readings_staging s
+JOIN meters m ON m.meter_id = s.meter_id
+ON CONFLICT DO NOTHING
+"""
+STAGING_APPEND_QUERY = f"""
+INSERT INTO energy_readings (meter_key, {', '.join(MEASUREMENT_COLUMNS)})
+SELECT m.meter_key, {', '.join('s.' + column for column in MEASUREMENT_COLUMNS)}
+FROM energy_readings_staging s
+JOIN meters m ON m.meter_id = s.meter_id
+"""
+UPDATE_WATERMARKS_QUERY = """
+INSERT INTO ingest_watermarks (meter_key, latest)
+SELECT m.meter_key, MAX(s.timestamp)
+FROM energy_readings_staging s
+JOIN meters m ON m.meter_id = s.meter_id
+GROUP BY m.meter_key
+ORDER BY m.meter_key
+ON CONFLICT (meter_key) DO UPDATE
+SET latest = EXCLUDED.latest, updated_at = NOW()
+WHERE EXCLUDED.latest > ingest_watermarks.latest
+"""
+LOAD_METERS_QUERY = "SELECT meter_id, meter_key FROM meters"
+LOOKUP_METERS_QUERY = "SELECT meter_id, meter_key FROM meters WHERE meter_id = ANY(%s)"
+
+class ConnectionPool:
+    """Long-lived pool of database connections with health checks.
+
+    Connections are reused across batches instead of being opened per
+    message. Broken connections are discarded and replaced, retrying with
+    exponential backoff while the database is unavailable.
+    """
+
+    def __init__(self, size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT,
+                 statement_timeout=STATEMENT_TIMEOUT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL,
+                 reconnect_initial_delay=RECONNECT_INITIAL_DELAY,
+                 reconnect_max_delay=RECONNECT_MAX_DELAY,
+                 reconnect_max_attempts=RECONNECT_MAX_ATTEMPTS,
+                 setup=None, db_params=None):
+        self.size = size
+        self.db_params = db_params if db_params is not None else DB_PARAMS
+        self.connect_timeout = connect_timeout
+        self.statement_timeout = statement_timeout
+        self.health_check_interval = health_check_interval
+        self.reconnect_initial_delay = reconnect_initial_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.reconnect_max_attempts = reconnect_max_attempts
+        self.setup = setup  # called with every new connection before first use
+
+        self._idle = queue.LifoQueue()  # (connection, last used) pairs
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._delay = reconnect_initial_delay
+        self._lost = 0  # connections discarded and not yet replaced
+
+        self.open_connections = 0
+        self.reconnects = 0
+        self.connect_failures = 0
+        self.available = True  # False after connecting gave up, until a connect succeeds
+
+    def _connect(self):
+        """Open a new connection, backing off exponentially on failure"""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                conn = psycopg2.connect(
+                    **self.db_params,
+                    connect_timeout=self.connect_timeout,
+                    options=f"-c statement_timeout={self.statement_timeout}"
+                )
+                if self.setup is not None:
+                    try:
+                        self.setup(conn)
+                        conn.commit()
+                    except Exception:
+                        conn.close()
+                        raise
+            except psycopg2.OperationalError as e:
+                with self._lock:
+                    self.connect_failures += 1
+                    delay = self._delay
+                    self._delay = min(self._delay * 2, self.reconnect_max_delay)
+                if self.reconnect_max_attempts and attempt >= self.reconnect_max_attempts:
+                    self.available = False
+                    logging.error(f"Database connection error: {e}")
+                    raise
+                # Full jitter keeps several writers from reconnecting in lockstep
+                delay = random.uniform(delay / 2, delay)
+                logging.warning(f"Database connection error (attempt {attempt}), "
+                                f"retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                continue
+
+            with self._lock:
+                self.available = True
+                self._delay = self.reconnect_initial_delay
+                self.open_connections += 1
+                if self._lost:
+                    self._lost -= 1
+                    self.reconnects += 1
+                    logging.info(f"Reconnected to database (reconnect #{self.reconnects})")
+            return conn
+
+    def _is_healthy(self, conn, last_used):
+        """Check an idle connection before handing it out"""
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Borrow a connection, opening a new one if none is idle"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._is_healthy(conn, last_used):
+                    return conn
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        """Return a borrowed connection, closing it if it is broken"""
+        try:
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.put((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    def _discard(self, conn):
+        """Close a broken connection so the next request replaces it"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self.open_connections -= 1
+            self._lost += 1
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with-block"""
+        conn = self.getconn()
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.putconn(conn, discard=True)
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self.putconn(conn, discard=True)
+                raise
+            self.putconn(conn)
+            raise
+        else:
+            self.putconn(conn)
+
+    def stats(self):
+        """Snapshot of pool counters"""
+        with self._lock:
+            return {
+                'open_connections': self.open_connections,
+                'idle_connections': self._idle.qsize(),
+                'reconnects': self.reconnects,
+                'connect_failures': self.connect_failures,
+            }
+
+    def closeall(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self.open_connections -= 1
+
+def _copy_field(value):
+    """Format a single value for the COPY text format"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\')
+                      .replace('\t', '\\t')
+                      .replace('\n', '\\n')
+                      .replace('\r', '\\r'))
+
+def rows_to_copy_text(rows):
+    """Serialize reading tuples into COPY text format lines"""
+    return ''.join('\t'.join(_copy_field(value) for value in row) + '\n' for row in rows)
+
+def create_staging_table(conn):
+    """Connection setup hook creating the per-session staging table"""
+    with conn.cursor() as cursor:
+        cursor.execute(STAGING_TABLE_QUERY)
+
+class MeterRegistry:
+    """In-process cache of external meter IDs and their integer meter_key.
+
+    Batches whose meters are all cached go straight to the insert; a batch
+    that contains new meters registers all of them in one statement and
+    caches the keys they were given.
+    """
+
+    def __init__(self):
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def load(self, conn):
+        """Warm the cache with every registered meter"""
+        with conn.cursor() as cursor:
+            cursor.execute(LOAD_METERS_QUERY)
+            self.update(cursor.fetchall())
+        conn.rollback()
+
+    def update(self, pairs):
+        with self._lock:
+            self._keys.update(pairs)
+
+    def unknown(self, meter_ids):
+        """Meter IDs from a batch that are not registered yet"""
+        keys = self._keys
+        return {meter_id for meter_id in meter_ids if meter_id not in keys}
+
+    def key(self, meter_id):
+        return self._keys.get(meter_id)
+
+    def __len__(self):
+        return len(self._keys)
+
+def copy_rows(conn, copy_text, row_count, deduplicate=DEDUPLICATE, registry=None, meter_ids=None,
+              watermarks=False):
+    """COPY pre-formatted lines into energy_readings and commit.
+
+    Returns the number of rows actually inserted; with ``deduplicate`` the
+    readings already stored for the same meter and timestamp are skipped.
+    Registration of new meters is skipped when ``registry`` already knows
+    every ID in ``meter_ids``; without them (spool replay) it always runs.
+    With ``watermarks``, ingest_watermarks is raised in the same transaction.
+    """
+    new_meters = None
+    if registry is not None and meter_ids is not None:
+        new_meters = registry.unknown(meter_ids)
+    with conn.cursor() as cursor:
+        cursor.copy_expert(STAGING_COPY_QUERY, io.StringIO(copy_text))
+        if new_meters is None or new_meters:
+            cursor.execute(REGISTER_METERS_QUERY)
+        cursor.execute(STAGING_INSERT_QUERY if deduplicate else STAGING_APPEND_QUERY)
+        inserted = cursor.rowcount
+        if watermarks:
+            # Rows are locked in meter_key order, so concurrent writers cannot deadlock
+            cursor.execute(UPDATE_WATERMARKS_QUERY)
+        if new_meters:
+            cursor.execute(LOOKUP_METERS_QUERY, (list(new_meters),))
+            registered = cursor.fetchall()
+    with COMMIT_SECONDS.time():
+        conn.commit()
+    if new_meters:
+        registry.update(registered)
+        METERS_REGISTERED.inc(len(new_meters))
+    if inserted < row_count:
+        DUPLICATES_CONFLICTED.inc(row_count - inserted)
+    return inserted
+
+class DuplicateFilter:
+    """Remembers the last few timestamps seen per meter.
+
+    Catches QoS 1 redeliveries and other obvious repeats before they reach
+    the database. It is only a fast path: the ON CONFLICT insert is what
+    guarantees one row per meter and timestamp.
+    """
+
+    def __init__(self, per_meter=RECENT_TIMESTAMPS_PER_METER):
+        self.per_meter = per_meter
+        self._recent = {}
+        self._lock = threading.Lock()
+
+    def seen(self, meter_id, timestamp):
+        """Record a reading; return True if it repeats a recent one"""
+        with self._lock:
+            recent = self._recent.get(meter_id)
+            if recent is None:
+                recent = self._recent[meter_id] = collections.deque(maxlen=self.per_meter)
+            elif timestamp in recent:
+                return True
+            recent.append(timestamp)
+            return False
+
+    def forget(self, rows):
+        """Drop the readings of rows that were never stored, so redeliveries get written"""
+        with self._lock:
+            for row in rows:
+                recent = self._recent.get(row[0])
+                if recent is not None and row[1] in recent:
+                    recent.remove(row[1])
+
+def parse_reading(topic, payload):
+    """Turn an MQTT topic and raw payload into a row for energy_readings"""
+    # The payload format (JSON, packed binary, msgpack) is detected per message
+    # Topic format: energy/meters/{meter_id}
+    return reading_to_row(topic.split('/')[-1], decode_reading(payload))
+
+def parse_readings(topic, payload):
+    """Decode every reading in a message as (row, reading dict) pairs.
+
+    Meter topics carry one reading; gateway topics
+    (energy/gateways/{gateway_id}) carry a batch, each with its meter_id.
+    Invalid readings in a gateway batch are counted and skipped so they
+    cannot fail the COPY of everything batched with them.
+    """
+    if topic.startswith(GATEWAY_TOPIC_PREFIX):
+        readings = []
+        for data in decode_batch(payload):
+            try:
+                meter_id = data.get('meter_id') if isinstance(data, dict) else None
+                readings.append((reading_to_row(meter_id, data), data))
+            except PayloadDecodeError as e:
+                READINGS_REJECTED.inc()
+                MESSAGE_ERROR_LOG.error(f"Rejected gateway reading: {e}")
+        return readings
+    data = decode_reading(payload)
+    return [(reading_to_row(topic.split('/')[-1], data), data)]
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_timestamp(timestamp):
+    """Check an ISO timestamp; readings with a UTC offset are stored as UTC"""
     try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        return conn
-    except Exception as e:
-        logging.error(f"Database connection error: {e}")
-        return None
+        parsed = datetime.fromisoformat(timestamp)
+    except ValueError:
+        raise PayloadDecodeError(f"invalid timestamp {timestamp!r}") from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+def _measurement(data, field):
+    """A reading's value for ``field`` as a finite float (0.0 when absent)"""
+    value = data.get(field, 0.0)
+    if isinstance(value, bool):
+        raise PayloadDecodeError(f"{field} must be a number, got {value!r}")
+    try:
+        value = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise PayloadDecodeError(f"{field} must be a number, got {value!r}") from None
+    if not math.isfinite(value):
+        raise PayloadDecodeError(f"{field} must be finite, got {value}")
+    return value
+
+def reading_to_row(meter_id, data):
+    """Turn a meter ID and decoded reading into a row for energy_readings.
+
+    Raises PayloadDecodeError for anything the COPY would reject, since one
+    bad value there fails the whole batch.
+    """
+    if not isinstance(data, dict):
+        raise PayloadDecodeError(f"reading must be an object, got {type(data).__name__}")
+    if not isinstance(meter_id, str) or not meter_id or '\x00' in meter_id:
+        raise PayloadDecodeError(f"invalid meter ID {meter_id!r}")
+    timestamp = data.get('timestamp')
+    if timestamp is None:
+        timestamp = datetime.now().isoformat()
+    elif isinstance(timestamp, str):
+        timestamp = _normalize_timestamp(timestamp)
+    else:
+        raise PayloadDecodeError(f"timestamp must be an ISO string, got {timestamp!r}")
+    return (
+        meter_id,
+        timestamp,
+        _measurement(data, 'power'),
+        _measurement(data, 'voltage'),
+        _measurement(data, 'current'),
+        _measurement(data, 'frequency'),
+        _measurement(data, 'energy')
+    )
+
+class BatchWriter:
+    """Buffer readings in memory and write them to TimescaleDB with COPY.
+
+    A batch is flushed when it reaches ``batch_size`` rows or when its oldest
+    reading has waited ``flush_interval`` seconds, whichever comes first.
+    Batches that cannot be written because the database is unreachable go
+    to the spool, if one is given, instead of being dropped. Readings the
+    shared ``duplicate_filter`` has already seen are dropped on arrival;
+    the readings of a batch that fails are forgotten again, so that their
+    redelivery is not mistaken for a duplicate. With a ``tracer``, the stage
+    timestamps of traced readings are recorded once their batch is committed
+    or spooled.
+    """
 
-def on_connect(client, userdata, flags, rc):
+    def __init__(self, pool, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, spool=None,
+                 deduplicate=DEDUPLICATE, duplicate_filter=None, meter_registry=None,
+                 tracer=None, watermarks=False):
+        self.pool = pool
+        self.watermarks = watermarks
+        self.meter_registry = meter_registry
+        self.tracer = tracer
+        self.spool = spool
+        self.deduplicate = deduplicate
+        self.duplicate_filter = duplicate_filter
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._buffer = []
+        self._traces = []
+        self._oldest = None  # monotonic time the first buffered row arrived
+        self._buffer_lock = threading.Lock()
+        self._write_lock = threading.Lock()  # keeps batches in arrival order
+
+        self.rows_written = 0
+        self.batches_written = 0
+        self.rows_failed = 0
+        self.rows_spooled = 0
+        self.duplicates_dropped = 0
+
+        self._stop = threading.Event()
+        self._timer = threading.Thread(target=self._flush_on_timer,
+                                       name="batch-writer-timer", daemon=True)
+        self._timer.start()
+
+    def add(self, row, trace=None):
+        """Queue a single reading, flushing if the batch is full"""
+        if self.duplicate_filter is not None and self.duplicate_filter.seen(row[0], row[1]):
+            self.duplicates_dropped += 1
+            DUPLICATES_FILTERED.inc()
+            return
+        with self._buffer_lock:
+            if not self._buffer:
+                self._oldest = time.monotonic()
+            self._buffer.append(row)
+            if trace is not None:
+                self._traces.append(trace + (time.time(),))
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write everything currently buffered"""
+        with self._write_lock:
+            with self._buffer_lock:
+                rows, self._buffer = self._buffer, []
+                traces, self._traces = self._traces, []
+                self._oldest = None
+            if rows:
+                self._write(rows, traces)
+
+    def close(self):
+        """Stop the flush timer and write any remaining readings"""
+        self._stop.set()
+        self._timer.join()
+        self.flush()
+        logging.info(f"Batch writer closed: {self.rows_written} readings in "
+                     f"{self.batches_written} batches, {self.rows_spooled} spooled, "
+                     f"{self.duplicates_dropped} duplicates, {self.rows_failed} failed")
+
+    def _flush_on_timer(self):
+        """Background loop enforcing the maximum buffering latency"""
+        while not self._stop.is_set():
+            with self._buffer_lock:
+                oldest = self._oldest
+            if oldest is None:
+                wait = self.flush_interval
+            else:
+                wait = oldest + self.flush_interval - time.monotonic()
+            if wait > 0:
+                self._stop.wait(wait)
+                continue
+            self.flush()
+
+    def _write(self, rows, traces=()):
+        """COPY a batch of rows in a single transaction"""
+        BATCH_ROWS.observe(len(rows))
+        with FLUSH_SECONDS.time():
+            outcome = self._write_batch(rows)
+        if outcome == 'failed' and self.duplicate_filter is not None:
+            self.duplicate_filter.forget(rows)
+        if traces:
+            self.tracer.record(traces, time.time() if outcome == 'committed' else None)
+
+    def _write_batch(self, rows):
+        """Write or spool a batch; return 'committed', 'spooled' or 'failed'"""
+        copy_text = rows_to_copy_text(rows)
+
+        # While the database is known to be down, go straight to the spool
+        # instead of waiting out the reconnect backoff on every batch
+        if self.spool is not None and not self.pool.available:
+            return self._spool(copy_text, len(rows))
+
+        # One retry on a fresh connection covers connections that died while idle
+        for attempt in (1, 2):
+            try:
+                with self.pool.connection() as conn:
+                    inserted = copy_rows(conn, copy_text, len(rows), self.deduplicate,
+                                         self.meter_registry, (row[0] for row in rows),
+                                         self.watermarks)
+                self.rows_written += inserted
+                self.duplicates_dropped += len(rows) - inserted
+                self.batches_written += 1
+                ROWS_WRITTEN.inc(inserted)
+                BATCH_LOG.info(f"Stored batch of {len(rows)} readings")
+                return 'committed'
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if attempt == 1:
+                    logging.warning(f"Database connection lost, retrying batch: {e}")
+                    continue
+                if self.spool is not None:
+                    return self._spool(copy_text, len(rows))
+                error = e
+            except Exception as e:
+                error = e
+            break
+        self.rows_failed += len(rows)
+        ROWS_FAILED.inc(len(rows))
+        logging.error(f"Error writing batch of {len(rows)} readings: {error}")
+        return 'failed'
+
+    def _spool(self, copy_text, row_count):
+        """Keep a batch on disk until the database is back"""
+        try:
+            self.spool.append(copy_text, row_count)
+            self.rows_spooled += row_count
+            ROWS_SPOOLED.inc(row_count)
+            return 'spooled'
+        except OSError as e:
+            self.rows_failed += row_count
+            ROWS_FAILED.inc(row_count)
+            logging.error(f"Could not spool batch of {row_count} readings: {e}")
+            return 'failed'
+
+def replay_spool(spool, pool, stop_event, batch_size=REPLAY_BATCH_SIZE,
+                 max_rows_per_sec=REPLAY_MAX_ROWS_PER_SEC, retry_interval=REPLAY_RETRY_INTERVAL,
+                 deduplicate=DEDUPLICATE, watermarks=False):
+    """Replay spooled readings into the database in order, rate limited.
+
+    Runs until ``stop_event`` is set. Segments are committed batch by batch
+    and deleted once fully replayed; anything left over stays on disk for
+    the next run.
+    """
+    while not stop_event.is_set():
+        segments = spool.segments()
+        if not segments:
+            if not spool.has_active():
+                stop_event.wait(retry_interval)
+                continue
+            # Writers stop trying the database during an outage, so probe it
+            # here; a successful connect marks the pool available again
+            try:
+                with pool.connection():
+                    pass
+            except psycopg2.Error as e:
+                logging.warning(f"Spool replay waiting for database: {e}")
+                stop_event.wait(retry_interval)
+                continue
+            spool.seal()
+            continue
+
+        path = segments[0]
+        try:
+            with pool.connection() as conn:
+                for copy_text, row_count, offset in spool.read_batches(path, batch_size):
+                    started = time.monotonic()
+                    ROWS_REPLAYED.inc(copy_rows(conn, copy_text, row_count, deduplicate,
+                                                watermarks=watermarks))
+                    spool.commit(path, offset)
+                    # Sleep off whatever is left of this batch's share of the rate limit
+                    remaining = row_count / max_rows_per_sec - (time.monotonic() - started)
+                    if stop_event.wait(max(remaining, 0)):
+                        return
+            spool.remove(path)
+            logging.info(f"Replayed spool segment {path}")
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            logging.warning(f"Spool replay waiting for database: {e}")
+            stop_event.wait(retry_interval)
+        except psycopg2.Error as e:
+            logging.error(f"Database rejected spool segment {path}: {e}")
+            spool.quarantine(path)
+
+class SpillFile:
+    """Append-only overflow file for messages that did not fit in the queue.
+
+    Records are stored as length-prefixed (topic, payload) pairs and read
+    back in order once the writers catch up. The file is truncated when
+    everything in it has been read.
+    """
+
+    HEADER = struct.Struct('>HI')  # topic length, payload length
+
+    def __init__(self, path=SPILL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+b')  # keeps anything left from a previous run
+        self._read_offset = 0
+        self._size = self._file.seek(0, os.SEEK_END)
+
+    def append(self, topic, payload):
+        """Spill one message to the end of the file"""
+        topic = topic.encode('utf-8')
+        record = self.HEADER.pack(len(topic), len(payload)) + topic + payload
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(record)
+            self._file.flush()
+            self._size += len(record)
+
+    def read(self):
+        """Return the oldest spilled message, or None when the file is drained"""
+        with self._lock:
+            if self._read_offset >= self._size:
+                return None
+            self._file.seek(self._read_offset)
+            topic_len, payload_len = self.HEADER.unpack(self._file.read(self.HEADER.size))
+            topic = self._file.read(topic_len).decode('utf-8')
+            payload = self._file.read(payload_len)
+            self._read_offset = self._file.tell()
+            if self._read_offset >= self._size:
+                self._file.truncate(0)
+                self._read_offset = self._size = 0
+            return topic, payload
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class WorkQueue:
+    """Bounded queue between the MQTT network thread and the writer threads.
+
+    ``put`` never touches the database. When the queue is full the
+    backpressure policy decides what happens: ``block`` waits for room,
+    ``drop-oldest`` discards the oldest queued message and ``spill`` writes
+    the new message to a SpillFile that is drained once the queue empties.
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, policy=BACKPRESSURE_POLICY, spill_path=SPILL_PATH):
+        if policy not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._queue = queue.Queue(maxsize)
+        self._spill = SpillFile(spill_path) if policy == 'spill' else None
+
+        self.dropped = 0
+        self.spilled = 0
+
+    def put(self, item):
+        """Enqueue a (topic, payload, received_at) item, applying the backpressure policy"""
+        if self.policy == 'block':
+            self._queue.put(item)
+            return
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            if self.policy == 'spill':
+                self._spill.append(item[0], item[1])  # receive time is not kept
+                self.spilled += 1
+                return
+            try:
+                self._queue.get_nowait()
+                self.dropped += 1
+            except queue.Empty:
+                pass
+
+    def get(self, timeout):
+        """Return the next message, falling back to spilled ones when idle"""
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        if self._spill is not None:
+            item = self._spill.read()
+            if item is not None:
+                return item
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def depth(self):
+        """Number of messages currently waiting in memory"""
+        return self._queue.qsize()
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+
+def writer_loop(work_queue, writer, stop_event):
+    """Drain the work queue into a batch writer until stopped and empty"""
+    while True:
+        item = work_queue.get(timeout=0.5)
+        if item is None:
+            if stop_event.is_set() and work_queue.depth() == 0:
+                break
+            continue
+        # Spilled messages come back without their receive time
+        topic, payload, received_at = item if len(item) == 3 else (*item, None)
+        handle_message(writer, topic, payload, received_at, time.time())
+    writer.close()
+
+def collect_stats(pool, writers, work_queue, spool):
+    """Snapshot of writer, connection pool, queue and spool counters"""
+    stats = pool.stats()
+    stats['rows_written'] = sum(writer.rows_written for writer in writers)
+    stats['batches_written'] = sum(writer.batches_written for writer in writers)
+    stats['rows_spooled'] = sum(writer.rows_spooled for writer in writers)
+    stats['rows_failed'] = sum(writer.rows_failed for writer in writers)
+    stats['duplicates_dropped'] = sum(writer.duplicates_dropped for writer in writers)
+    if work_queue is not None:
+        stats['queue_depth'] = work_queue.depth()
+        stats['queue_dropped'] = work_queue.dropped
+        stats['queue_spilled'] = work_queue.spilled
+    if spool is not None:
+        stats['spool_backlog_bytes'] = spool.pending_bytes()
+    return stats
+
+def format_stats(stats):
+    """One status log line from a collect_stats snapshot"""
+    message = (f"{stats['rows_written']} rows written, {stats['rows_spooled']} spooled, "
+               f"{stats['duplicates_dropped']} duplicates, {stats['rows_failed']} failed; "
+               f"connection pool: "
+               f"{stats['open_connections']} open, {stats['idle_connections']} idle, "
+               f"{stats['reconnects']} reconnects, {stats['connect_failures']} failed connects")
+    if 'queue_depth' in stats:
+        message += (f"; queue depth {stats['queue_depth']}, {stats['queue_dropped']} dropped, "
+                    f"{stats['queue_spilled']} spilled")
+    if 'spool_backlog_bytes' in stats:
+        message += f"; spool backlog {stats['spool_backlog_bytes']} bytes"
+    return message
+
+def report_stats(pool, writers, work_queue, spool, interval, stop_event,
+                 stats_queue=None, worker_id=None):
+    """Periodically log status, or send it to a launcher when run as a worker"""
+    while not stop_event.wait(interval):
+        stats = collect_stats(pool, writers, work_queue, spool)
+        if stats_queue is not None:
+            stats_queue.put((worker_id, stats))
+        else:
+            logging.info(format_stats(stats))
+
+def on_connect(client, userdata, flags, rc, topics=(MQTT_TOPIC,)):
     """Callback when client connects to the broker"""
     if rc == 0:
-        logging.info("Connected to MQTT broker")
-        client.subscribe(MQTT_TOPIC)
+        logging.info(f"Connected to MQTT broker, subscribing to {', '.join(topics)}")
+        client.subscribe([(topic, 0) for topic in topics])
     else:
         logging.error(f"Failed to connect to MQTT broker with code: {rc}")
 
+def handle_message(writer, topic, payload, received_at=None, dequeued_at=None):
+    """Decode one message and hand its reading(s) to a batch writer.
+
+    ``dequeued_at`` is when a writer thread took the message off the work
+    queue; without a queue, decoding starts at ``received_at``.
+    """
+    try:
+        readings = parse_readings(topic, payload)
+    except PayloadDecodeError as e:
+        MESSAGES_FAILED.inc()
+        MESSAGE_ERROR_LOG.error(f"Payload decode error: {e}")
+        return
+    except Exception as e:
+        MESSAGES_FAILED.inc()
+        MESSAGE_ERROR_LOG.error(f"Error processing message: {e}")
+        return
+    MESSAGES_DECODED.inc()
+    if writer.tracer is None:
+        for row, _ in readings:
+            writer.add(row)
+        return
+    decoded_at = time.time()
+    if dequeued_at is None:
+        dequeued_at = received_at
+    for row, data in readings:
+        if 'seq' in data:
+            writer.add(row, (row[0], data['seq'], data.get('published_at'), received_at,
+                             dequeued_at, decoded_at))
+        else:
+            writer.add(row)
+
 def on_message(client, userdata, msg):
     """Callback when a message is received"""
+    MESSAGES_RECEIVED.inc()
+    # Hand the message to the batch writer (client userdata)
     try:
-        # Decode the message
-        payload = json.loads(msg.payload.decode('utf-8'))
-        
-        # Extract meter_id from the topic
-        # Topic format: energy/meters/{meter_id}
-        meter_id = msg.topic.split('/')[-1]
-        
-        # Insert data into database
-        conn = connect_to_db()
-        if conn:
-            cursor = conn.cursor()
-            
-            # Insert query
-            insert_query = """
-            INSERT INTO energy_readings 
-            (meter_id, timestamp, power, voltage, current, frequency, energy)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """
-            
-            # Data to insert
-            data = (
-                meter_id,
-                payload.get('timestamp', datetime.now().isoformat()),
-                payload.get('power', 0.0),
-                payload.get('voltage', 0.0),
-                payload.get('current', 0.0),
-                payload.get('frequency', 0.0),
-                payload.get('energy', 0.0)
-            )
-            
-            cursor.execute(insert_query, data)
-            conn.commit()
-            cursor.close()
-            conn.close()
-            
-            logging.info(f"Data from meter {meter_id} stored successfully")
-        
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON decode error: {e}")
+        handle_message(userdata, msg.topic, msg.payload, time.time())
     except Exception as e:
         logging.error(f"Error processing message: {e}")
 
-def main():
-    # Connect to MQTT broker
-    client = mqtt.Client()
-    client.on_connect = on_connect
-    client.on_message = on_message
-    
+def on_message_queued(client, userdata, msg):
+    """Callback when a message is received in queued mode.
+
+    Only hands the raw payload to the work queue (client userdata) so the
+    network thread never waits on the database.
+    """
+    MESSAGES_RECEIVED.inc()
+    userdata.put((msg.topic, msg.payload, time.time()))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Store MQTT smart meter readings in TimescaleDB")
+    parser.add_argument('--broker', default=MQTT_BROKER,
+                        help=f"MQTT broker host (default: {MQTT_BROKER})")
+    parser.add_argument('--port', type=int, default=MQTT_PORT,
+                        help=f"MQTT broker port (default: {MQTT_PORT})")
+    parser.add_argument('--topic', default=MQTT_TOPIC,
+                        help=f"topic filter to subscribe to (default: {MQTT_TOPIC})")
+    parser.add_argument('--gateway-topic', default=GATEWAY_TOPIC,
+                        help=f"topic filter for batched gateway messages; empty disables "
+                             f"(default: {GATEWAY_TOPIC})")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f"readings per COPY batch (default: {BATCH_SIZE})")
+    parser.add_argument('--flush-interval', type=float, default=FLUSH_INTERVAL,
+                        help=f"maximum seconds a reading is buffered (default: {FLUSH_INTERVAL})")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE,
+                        help=f"maximum open database connections (default: {POOL_SIZE})")
+    parser.add_argument('--connect-timeout', type=int, default=CONNECT_TIMEOUT,
+                        help=f"seconds to wait when connecting (default: {CONNECT_TIMEOUT})")
+    parser.add_argument('--statement-timeout', type=int, default=STATEMENT_TIMEOUT,
+                        help=f"server-side statement timeout in ms (default: {STATEMENT_TIMEOUT})")
+    parser.add_argument('--reconnect-delay', type=float, default=RECONNECT_INITIAL_DELAY,
+                        help=f"initial reconnect backoff in seconds (default: {RECONNECT_INITIAL_DELAY})")
+    parser.add_argument('--reconnect-max-delay', type=float, default=RECONNECT_MAX_DELAY,
+                        help=f"maximum reconnect backoff in seconds (default: {RECONNECT_MAX_DELAY})")
+    parser.add_argument('--reconnect-attempts', type=int, default=RECONNECT_MAX_ATTEMPTS,
+                        help=f"connect attempts before a batch fails, 0 = forever "
+                             f"(default: {RECONNECT_MAX_ATTEMPTS})")
+    parser.add_argument('--writer-threads', type=int, default=WRITER_THREADS,
+                        help="decode and write on this many threads behind a bounded queue; "
+                             "0 writes from the MQTT network thread (default: 0)")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help=f"maximum queued messages in threaded mode (default: {QUEUE_SIZE})")
+    parser.add_argument('--backpressure', choices=BACKPRESSURE_POLICIES, default=BACKPRESSURE_POLICY,
+                        help=f"what to do when the queue is full (default: {BACKPRESSURE_POLICY})")
+    parser.add_argument('--spill-path', default=SPILL_PATH,
+                        help=f"overflow file for the spill policy (default: {SPILL_PATH})")
+    parser.add_argument('--spool-dir', default=SPOOL_DIR,
+                        help=f"directory for readings awaiting the database; empty disables "
+                             f"spooling (default: {SPOOL_DIR})")
+    parser.add_argument('--spool-durability', choices=DURABILITY_LEVELS, default=DURABILITY,
+                        help=f"when spooled data is fsync'd (default: {DURABILITY})")
+    parser.add_argument('--spool-segment-size', type=int, default=SEGMENT_MAX_BYTES,
+                        help=f"bytes per spool segment (default: {SEGMENT_MAX_BYTES})")
+    parser.add_argument('--replay-batch-size', type=int, default=REPLAY_BATCH_SIZE,
+                        help=f"rows per spool replay COPY (default: {REPLAY_BATCH_SIZE})")
+    parser.add_argument('--replay-rate', type=float, default=REPLAY_MAX_ROWS_PER_SEC,
+                        help=f"maximum spool replay rows per second (default: {REPLAY_MAX_ROWS_PER_SEC})")
+    parser.add_argument('--no-dedup', dest='deduplicate', action='store_false',
+                        help="insert without the ON CONFLICT duplicate checks")
+    parser.add_argument('--no-watermarks', dest='watermarks', action='store_false',
+                        default=UPDATE_WATERMARKS,
+                        help="do not update ingest_watermarks on each batch")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="serve Prometheus metrics on this port, 0 disables (default: 0)")
+    parser.add_argument('--stats-interval', type=float, default=STATS_INTERVAL,
+                        help=f"seconds between status log lines (default: {STATS_INTERVAL})")
+    parser.add_argument('--trace-file',
+                        help="append stage timestamps of traced readings to this file "
+                             "(see ingest_trace.py)")
+    return parser.parse_args(argv)
+
+def run(args, stats_queue=None, worker_id=None):
+    """Run the subscriber until disconnected, interrupted or sent SIGTERM.
+
+    When ``stats_queue`` is given (multi-process launcher), periodic stats are
+    sent there as ``(worker_id, stats)`` instead of being logged.
+    """
+    meter_registry = MeterRegistry()
+    pool = ConnectionPool(size=args.pool_size,
+                          connect_timeout=args.connect_timeout,
+                          statement_timeout=args.statement_timeout,
+                          reconnect_initial_delay=args.reconnect_delay,
+                          reconnect_max_delay=args.reconnect_max_delay,
+                          reconnect_max_attempts=args.reconnect_attempts,
+                          setup=create_staging_table)
+    duplicate_filter = DuplicateFilter() if args.deduplicate else None
     try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        logging.info(f"Connecting to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
-        
+        with pool.connection() as conn:
+            meter_registry.load(conn)
+        logging.info(f"Loaded {len(meter_registry)} registered meters")
+    except psycopg2.Error as e:
+        logging.warning(f"Could not preload the meter registry: {e}")
+
+    watermarks = args.watermarks
+    if watermarks:
+        try:
+            with pool.connection() as conn:
+                watermarks = watermarks_available(conn)
+        except psycopg2.Error as e:
+            logging.warning(f"Could not check for ingest_watermarks: {e}")
+            watermarks = False
+        if not watermarks:
+            logging.warning("Not updating ingest_watermarks (run ingest_watermarks_setup.sql)")
+
+    spool = None
+    if args.spool_dir:
+        spool = Spool(args.spool_dir, args.spool_durability, args.spool_segment_size)
+
+    tracer = Tracer(args.trace_file) if args.trace_file else None
+
+    stop_event = threading.Event()
+    replay_stop = threading.Event()
+    replayer = None
+    if spool is not None:
+        replayer = threading.Thread(target=replay_spool,
+                                    args=(spool, pool, replay_stop, args.replay_batch_size,
+                                          args.replay_rate, REPLAY_RETRY_INTERVAL,
+                                          args.deduplicate, watermarks),
+                                    name="spool-replay", daemon=True)
+        replayer.start()
+
+    if args.writer_threads > 0:
+        # Queued mode: the network thread only enqueues, writer threads do the rest
+        work_queue = WorkQueue(args.queue_size, args.backpressure, args.spill_path)
+        writers = [BatchWriter(pool, batch_size=args.batch_size, flush_interval=args.flush_interval,
+                               spool=spool, deduplicate=args.deduplicate,
+                               duplicate_filter=duplicate_filter, meter_registry=meter_registry,
+                               tracer=tracer, watermarks=watermarks)
+                   for _ in range(args.writer_threads)]
+        writer_threads = [threading.Thread(target=writer_loop, args=(work_queue, writer, stop_event),
+                                           name=f"writer-{i}")
+                          for i, writer in enumerate(writers)]
+        for thread in writer_threads:
+            thread.start()
+        client = mqtt.Client(userdata=work_queue)
+        client.on_message = on_message_queued
+    else:
+        work_queue = None
+        writer = BatchWriter(pool, batch_size=args.batch_size, flush_interval=args.flush_interval,
+                             spool=spool, deduplicate=args.deduplicate,
+                             duplicate_filter=duplicate_filter, meter_registry=meter_registry,
+                             tracer=tracer, watermarks=watermarks)
+        writers = [writer]
+        client = mqtt.Client(userdata=writer)
+        client.on_message = on_message
+    topics = [args.topic] + ([args.gateway_topic] if args.gateway_topic else [])
+    client.on_connect = functools.partial(on_connect, topics=topics)
+
+    if args.metrics_port:
+        POOL_OPEN_CONNECTIONS.set_function(lambda: pool.open_connections)
+        POOL_RECONNECTS.set_function(lambda: pool.reconnects)
+        METERS_CACHED.set_function(lambda: len(meter_registry))
+        if work_queue is not None:
+            QUEUE_DEPTH.set_function(work_queue.depth)
+        if spool is not None:
+            SPOOL_BACKLOG_BYTES.set_function(spool.pending_bytes)
+        start_metrics_server(args.metrics_port)
+
+    threading.Thread(target=report_stats,
+                     args=(pool, writers, work_queue, spool, args.stats_interval, stop_event,
+                           stats_queue, worker_id),
+                     name="stats", daemon=True).start()
+
+    # Stop the network loop cleanly on SIGTERM so the buffer gets flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: client.disconnect())
+
+    try:
+        client.connect(args.broker, args.port, 60)
+        logging.info(f"Connecting to MQTT broker at {args.broker}:{args.port}")
+
         # Start the loop
         client.loop_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down subscriber")
+        client.disconnect()
     except Exception as e:
         logging.error(f"MQTT connection error: {e}")
+    finally:
+        stop_event.set()
+        if work_queue is not None:
+            # Writers drain what is still queued, then flush and close
+            for thread in writer_threads:
+                thread.join()
+            work_queue.close()
+        else:
+            writer.close()
+        if spool is not None:
+            replay_stop.set()
+            replayer.join()
+            spool.close()
+        if tracer is not None:
+            tracer.close()
+        stats = collect_stats(pool, writers, work_queue, spool)
+        if stats_queue is not None:
+            stats_queue.put((worker_id, stats))
+        logging.info(format_stats(stats))
+        pool.closeall()
+
+def main():
+    run(parse_args())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
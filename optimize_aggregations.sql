@@ -8,7 +8,7 @@ DROP MATERIALIZED VIEW IF EXISTS energy_readings_daily_optimized;
 -- 15-minute aggregation (combines 3 readings at 5-minute intervals)
 CREATE MATERIALIZED VIEW energy_readings_15min_optimized
 WITH (timescaledb.continuous) AS
-SELECT meter_id,
+SELECT meter_key,
        time_bucket('15 minutes', timestamp) AS bucket,
        COUNT(*) as num_readings,  -- Track number of readings to verify we're getting 3 per bucket
        AVG(power) as avg_power,
@@ -16,12 +16,12 @@ SELECT meter_id,
        MIN(power) as min_power,
        SUM(energy) as total_energy
 FROM energy_readings
-GROUP BY meter_id, bucket;
+GROUP BY meter_key, bucket;
 
 -- Hourly aggregation (combines 12 readings at 5-minute intervals)
 CREATE MATERIALIZED VIEW energy_readings_hourly_optimized
 WITH (timescaledb.continuous) AS
-SELECT meter_id,
+SELECT meter_key,
        time_bucket('1 hour', timestamp) AS bucket,
        COUNT(*) as num_readings,  -- Track number of readings to verify we're getting 12 per bucket
        AVG(power) as avg_power,
@@ -29,12 +29,12 @@ SELECT meter_id,
        MIN(power) as min_power,
        SUM(energy) as total_energy
 FROM energy_readings
-GROUP BY meter_id, bucket;
+GROUP BY meter_key, bucket;
 
 -- Daily aggregation (combines 288 readings at 5-minute intervals)
 CREATE MATERIALIZED VIEW energy_readings_daily_optimized
 WITH (timescaledb.continuous) AS
-SELECT meter_id,
+SELECT meter_key,
        time_bucket('1 day', timestamp) AS bucket,
        COUNT(*) as num_readings,  -- Track number of readings to verify we're getting 288 per bucket
        AVG(power) as avg_power,
@@ -42,7 +42,7 @@ SELECT meter_id,
        MIN(power) as min_power,
        SUM(energy) as total_energy
 FROM energy_readings
-GROUP BY meter_id, bucket;
+GROUP BY meter_key, bucket;
 
 -- Add refresh policies aligned with reporting intervals
 SELECT add_continuous_aggregate_policy('energy_readings_15min_optimized',
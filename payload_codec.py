@@ -0,0 +1,239 @@
+import json
+import time
+import struct
+from functools import lru_cache
+from datetime import datetime, timezone
+
+# orjson and msgpack are optional; fall back to the standard library JSON
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Fields carried by every reading besides the timestamp, in packed order
+READING_FIELDS = ('power', 'voltage', 'current', 'frequency', 'energy')
+
+# Packed binary layout: magic byte, epoch seconds, five measurements (all float64)
+BINARY_MAGIC = 0xB1
+BINARY_READING = struct.Struct('<Bd5d')
+
+# Optional trace metadata for latency measurement: publish wall-clock time
+# (epoch seconds) and a per-meter sequence number
+TRACE_FIELDS = ('published_at', 'seq')
+
+# Traced binary layout: the plain layout followed by published_at and seq
+BINARY_TRACED_MAGIC = 0xB2
+BINARY_TRACED_READING = struct.Struct('<Bd5ddQ')
+
+# Gateway batches carry many meters' readings in one message. Binary layout:
+# magic byte and reading count, then per reading a length-prefixed meter ID
+# followed by the single-reading fields (and trace fields when traced)
+BINARY_BATCH_MAGIC = 0xB3
+BINARY_TRACED_BATCH_MAGIC = 0xB4
+BINARY_BATCH_HEADER = struct.Struct('<BH')
+BINARY_BATCH_READING = struct.Struct('<d5d')
+BINARY_TRACED_BATCH_READING = struct.Struct('<d5ddQ')
+MAX_BATCH_READINGS = 0xFFFF
+
+BINARY_MAGICS = (BINARY_MAGIC, BINARY_TRACED_MAGIC, BINARY_BATCH_MAGIC, BINARY_TRACED_BATCH_MAGIC)
+
+PAYLOAD_FORMATS = ('json', 'binary', 'msgpack')
+
+class PayloadDecodeError(ValueError):
+    """Raised when a message payload cannot be decoded"""
+
+# Timestamps travel as naive ISO strings. Packed binary carries them as epoch
+# seconds, converted as UTC so a naive timestamp round-trips unchanged whatever
+# the local time zone and DST; one with a UTC offset arrives as naive UTC, as
+# mqtt_subscriber.reading_to_row stores offsets on the JSON path
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+def _datetime_to_epoch(timestamp):
+    if timestamp.tzinfo is not None:
+        return timestamp.timestamp()
+    return (timestamp - UNIX_EPOCH).total_seconds()
+
+# Every meter in a simulation step shares a timestamp, so a small cache
+# turns most timestamp conversions into dictionary lookups
+@lru_cache(maxsize=4096)
+def _iso_to_epoch(timestamp):
+    return _datetime_to_epoch(datetime.fromisoformat(timestamp))
+
+@lru_cache(maxsize=4096)
+def _epoch_to_iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None).isoformat()
+
+def _timestamp_to_epoch(timestamp):
+    """Accept a datetime or ISO string and return epoch seconds"""
+    if isinstance(timestamp, str):
+        return _iso_to_epoch(timestamp)
+    return _datetime_to_epoch(timestamp)
+
+def encode_json(reading):
+    if orjson is not None:
+        return orjson.dumps(reading)
+    return json.dumps(reading).encode('utf-8')
+
+def encode_binary(reading):
+    if 'seq' in reading:
+        return BINARY_TRACED_READING.pack(BINARY_TRACED_MAGIC,
+                                          _timestamp_to_epoch(reading['timestamp']),
+                                          *(reading[field] for field in READING_FIELDS),
+                                          reading['published_at'], reading['seq'])
+    return BINARY_READING.pack(BINARY_MAGIC,
+                               _timestamp_to_epoch(reading['timestamp']),
+                               *(reading[field] for field in READING_FIELDS))
+
+def encode_msgpack(reading):
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb(reading)
+
+ENCODERS = {
+    'json': encode_json,
+    'binary': encode_binary,
+    'msgpack': encode_msgpack,
+}
+
+def encode_reading(reading, payload_format='json'):
+    """Encode a reading dict (as returned by SmartMeter.generate_reading)"""
+    return ENCODERS[payload_format](reading)
+
+def encode_binary_batch(readings):
+    if len(readings) > MAX_BATCH_READINGS:
+        raise ValueError(f"a binary batch holds at most {MAX_BATCH_READINGS} readings")
+    traced = bool(readings) and 'seq' in readings[0]
+    layout = BINARY_TRACED_BATCH_READING if traced else BINARY_BATCH_READING
+    magic = BINARY_TRACED_BATCH_MAGIC if traced else BINARY_BATCH_MAGIC
+    parts = [BINARY_BATCH_HEADER.pack(magic, len(readings))]
+    for reading in readings:
+        meter_id = reading['meter_id'].encode('utf-8')
+        values = [_timestamp_to_epoch(reading['timestamp'])]
+        values += [reading[field] for field in READING_FIELDS]
+        if traced:
+            values += [reading['published_at'], reading['seq']]
+        parts.append(bytes((len(meter_id),)) + meter_id + layout.pack(*values))
+    return b''.join(parts)
+
+BATCH_ENCODERS = {
+    'json': lambda readings: encode_json({'readings': readings}),
+    'binary': encode_binary_batch,
+    'msgpack': lambda readings: encode_msgpack({'readings': readings}),
+}
+
+def encode_batch(readings, payload_format='json'):
+    """Encode a gateway batch: reading dicts that each also carry their meter_id"""
+    return BATCH_ENCODERS[payload_format](readings)
+
+def add_trace(reading, seq):
+    """Stamp a reading with trace metadata just before it is published"""
+    reading['published_at'] = time.time()
+    reading['seq'] = seq
+    return reading
+
+def decode_json(payload):
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+def decode_binary(payload):
+    layout = BINARY_TRACED_READING if payload[0] == BINARY_TRACED_MAGIC else BINARY_READING
+    if len(payload) != layout.size:
+        raise PayloadDecodeError(f"binary reading must be {layout.size} bytes, "
+                                 f"got {len(payload)}")
+    _, epoch, power, voltage, current, frequency, energy, *trace = layout.unpack(payload)
+    # Naive UTC wall time, the same representation the JSON path carries
+    reading = {
+        'timestamp': _epoch_to_iso(epoch),
+        'power': power,
+        'voltage': voltage,
+        'current': current,
+        'frequency': frequency,
+        'energy': energy,
+    }
+    if trace:
+        reading['published_at'], reading['seq'] = trace
+    return reading
+
+def decode_msgpack(payload):
+    if msgpack is None:
+        raise PayloadDecodeError("msgpack payload received but msgpack is not installed")
+    return msgpack.unpackb(payload)
+
+def detect_format(payload):
+    """Identify a payload's format from its first byte"""
+    if not payload:
+        raise PayloadDecodeError("empty payload")
+    first = payload[0]
+    if first in BINARY_MAGICS:
+        return 'binary'
+    if first in b'{[ \t\r\n':
+        return 'json'
+    if 0x80 <= first <= 0x8f or first in (0xde, 0xdf):  # msgpack map headers
+        return 'msgpack'
+    raise PayloadDecodeError(f"unrecognised payload format (first byte 0x{first:02x})")
+
+DECODERS = {
+    'json': decode_json,
+    'binary': decode_binary,
+    'msgpack': decode_msgpack,
+}
+
+def decode_reading(payload):
+    """Decode a payload of any supported format into a reading dict"""
+    try:
+        return DECODERS[detect_format(payload)](payload)
+    except PayloadDecodeError:
+        raise
+    except Exception as e:
+        # json, orjson, struct and msgpack each raise their own error types
+        raise PayloadDecodeError(str(e)) from e
+
+def decode_binary_batch(payload):
+    magic, count = BINARY_BATCH_HEADER.unpack_from(payload)
+    if magic not in (BINARY_BATCH_MAGIC, BINARY_TRACED_BATCH_MAGIC):
+        raise PayloadDecodeError(f"not a binary batch (magic 0x{magic:02x})")
+    layout = BINARY_TRACED_BATCH_READING if magic == BINARY_TRACED_BATCH_MAGIC else BINARY_BATCH_READING
+    readings = []
+    offset = BINARY_BATCH_HEADER.size
+    for _ in range(count):
+        id_length = payload[offset]
+        meter_id = payload[offset + 1:offset + 1 + id_length].decode('utf-8')
+        offset += 1 + id_length
+        epoch, power, voltage, current, frequency, energy, *trace = layout.unpack_from(payload, offset)
+        offset += layout.size
+        reading = {
+            'meter_id': meter_id,
+            'timestamp': _epoch_to_iso(epoch),
+            'power': power,
+            'voltage': voltage,
+            'current': current,
+            'frequency': frequency,
+            'energy': energy,
+        }
+        if trace:
+            reading['published_at'], reading['seq'] = trace
+        readings.append(reading)
+    if offset != len(payload):
+        raise PayloadDecodeError(f"binary batch has {len(payload) - offset} trailing bytes")
+    return readings
+
+def decode_batch(payload):
+    """Decode a gateway batch payload of any supported format into reading dicts"""
+    try:
+        payload_format = detect_format(payload)
+        if payload_format == 'binary':
+            return decode_binary_batch(payload)
+        readings = DECODERS[payload_format](payload)['readings']
+        if not isinstance(readings, list):
+            raise PayloadDecodeError("gateway batch 'readings' must be a list")
+        return readings
+    except PayloadDecodeError:
+        raise
+    except Exception as e:
+        raise PayloadDecodeError(str(e)) from e
@@ -0,0 +1,213 @@
+import time
+import logging
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import psycopg2
+
+# Continuous aggregates the router can read, as (view, bucket width, has num_readings).
+# The _optimized views (optimize_aggregations.sql) keep a reading count, so averages
+# over several buckets are weighted exactly; the plain views
+# (continuous_aggregation_setup.sql) are averaged bucket by bucket.
+AGGREGATES = (
+    ('energy_readings_daily_optimized', timedelta(days=1), True),
+    ('energy_readings_daily', timedelta(days=1), False),
+    ('energy_readings_hourly_optimized', timedelta(hours=1), True),
+    ('energy_readings_hourly', timedelta(hours=1), False),
+    ('energy_readings_15min_optimized', timedelta(minutes=15), True),
+    ('energy_readings_15min', timedelta(minutes=15), False),
+)
+
+RAW_TABLE = "energy_readings"
+
+# Seconds a view's materialization watermark is reused before it is read again
+WATERMARK_TTL = 60.0
+# Seconds the list of available views is reused, so aggregates created (or
+# dropped) while a long-lived router is in use are picked up
+VIEWS_TTL = 300.0
+
+# TimescaleDB 2.12 moved its internal functions to a new schema
+WATERMARK_SCHEMAS = ('_timescaledb_functions', '_timescaledb_internal')
+
+AVAILABLE_VIEWS_QUERY = """
+SELECT view_name
+FROM timescaledb_information.continuous_aggregates
+WHERE view_name = ANY(%s)
+"""
+
+# Internal time of a timestamp hypertable: microseconds since the Unix epoch.
+# Everything before the watermark has been materialized into the view.
+WATERMARK_QUERY = """
+SELECT {schema}.cagg_watermark(ca.mat_hypertable_id)
+FROM _timescaledb_catalog.continuous_agg ca
+WHERE ca.user_view_name = %s
+"""
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+RoutedQuery = namedtuple('RoutedQuery', 'source width query params')
+
+class QueryRouter:
+    """Serve bucketed power/energy queries from the coarsest usable aggregate.
+
+    A view can answer a request when its bucket width divides the requested
+    resolution and the range starts (and ends, if bounded) on its bucket
+    boundaries. Buckets before the view's materialization watermark come
+    from the view; the rest is aggregated from raw readings the same way
+    the view would, so results include readings not yet materialized.
+    Requests no view can answer go to the raw table. Catalog reads borrow
+    a connection from ``pool`` (a mqtt_subscriber.ConnectionPool), so one
+    router can be shared by concurrent sessions.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.views = []
+        self._views_read = None  # monotonic time views was last read
+        self._watermarks = {}  # view -> (watermark, monotonic time read)
+        self.refresh_views()
+
+    def refresh_views(self):
+        """Find which of AGGREGATES exist in this database"""
+        names = [view for view, _, _ in AGGREGATES]
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(AVAILABLE_VIEWS_QUERY, (names,))
+                    existing = {row[0] for row in cursor.fetchall()}
+                conn.rollback()
+        except psycopg2.Error as e:
+            logging.warning(f"Could not list continuous aggregates, using raw data only: {e}")
+            existing = set()
+        self.views = [aggregate for aggregate in AGGREGATES if aggregate[0] in existing]
+        self._views_read = time.monotonic()
+        self._watermarks.clear()
+
+    def watermark(self, view):
+        """End of the materialized part of a view (naive, like the hypertables); None if empty"""
+        cached = self._watermarks.get(view)
+        if cached is not None and time.monotonic() - cached[1] < WATERMARK_TTL:
+            return cached[0]
+        value = None
+        for schema in WATERMARK_SCHEMAS:
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cursor:
+                        cursor.execute(WATERMARK_QUERY.format(schema=schema), (view,))
+                        row = cursor.fetchone()
+                    conn.rollback()  # Read-only; don't leave a transaction open
+            except psycopg2.ProgrammingError:
+                # Schema or function missing in this TimescaleDB version
+                continue
+            # Nothing materialized yet reads as the minimum internal time
+            if row is not None and row[0] is not None and row[0] > 0:
+                value = UNIX_EPOCH + timedelta(microseconds=row[0])
+            break
+        self._watermarks[view] = (value, time.monotonic())
+        return value
+
+    def choose(self, start, end=None, resolution=None):
+        """Coarsest usable (view, width, has_count, watermark) for the request, or None.
+
+        Views materialized no further than ``start`` are skipped, so a
+        request for the current day falls through from the daily view to
+        the hourly or 15-minute one and only the real tail is read raw.
+        """
+        if time.monotonic() - self._views_read >= VIEWS_TTL:
+            self.refresh_views()
+        for view, width, has_count in self.views:
+            if resolution is not None and resolution % width:
+                continue
+            if not _aligned(start, width) or (end is not None and not _aligned(end, width)):
+                continue
+            watermark = self.watermark(view)
+            if watermark is None or watermark <= start:
+                continue
+            return view, width, has_count, watermark
+        return None
+
+    def route(self, start, end=None, resolution=None, by_meter=False, meter_keys=None):
+        """Build the query for readings in [start, end) (end None = up to now).
+
+        Rows hold ``period`` (bucket start; omitted when resolution is None,
+        which aggregates the whole range), ``meter_key`` when ``by_meter``,
+        and ``avg_power``, ``max_power`` and ``total_energy``. ``meter_keys``
+        limits the query to those meters.
+        """
+        params = {'start': start, 'end': end, 'resolution': resolution}
+        if meter_keys is not None:
+            params['meter_keys'] = list(meter_keys)
+        chosen = self.choose(start, end, resolution)
+        if chosen is None:
+            return RoutedQuery(RAW_TABLE, None,
+                               _raw_query(end, resolution, by_meter, meter_keys is not None), params)
+
+        view, width, has_count, watermark = chosen
+        params['watermark'] = watermark
+        params['width'] = width
+        return RoutedQuery(view, width,
+                           _aggregate_query(view, has_count, end, resolution, by_meter,
+                                            meter_keys is not None), params)
+
+def _aligned(moment, width):
+    """Whether a naive timestamp falls on a bucket boundary of ``width``"""
+    return (moment - UNIX_EPOCH) % width == timedelta(0)
+
+def _grouping(time_column, resolution, by_meter):
+    """SELECT and GROUP BY lists for the requested output dimensions"""
+    columns = []
+    if resolution is not None:
+        columns.append((f"time_bucket(%(resolution)s, {time_column})", 'period'))
+    if by_meter:
+        columns.append(('meter_key', 'meter_key'))
+    select = ''.join(f"{expression} AS {name}, " if expression != name else f"{name}, "
+                     for expression, name in columns)
+    group_by = ', '.join(name for _, name in columns)
+    return select, group_by
+
+def _grouped(query, group_by):
+    if group_by:
+        query += f"\n    GROUP BY {group_by}\n    ORDER BY {group_by}"
+    return query
+
+def _meter_filter(by_keys):
+    return " AND meter_key = ANY(%(meter_keys)s)" if by_keys else ""
+
+def _raw_query(end, resolution, by_meter, by_keys=False):
+    select, group_by = _grouping('timestamp', resolution, by_meter)
+    query = f"""
+    SELECT {select}AVG(power) AS avg_power,
+           MAX(power) AS max_power,
+           SUM(energy) AS total_energy
+    FROM {RAW_TABLE}
+    WHERE timestamp >= %(start)s"""
+    if end is not None:
+        query += " AND timestamp < %(end)s"
+    query += _meter_filter(by_keys)
+    return _grouped(query, group_by)
+
+def _aggregate_query(view, has_count, end, resolution, by_meter, by_keys=False):
+    count = 'num_readings' if has_count else '1'
+    tail_count = 'COUNT(*)' if has_count else '1'
+    end_filter = "" if end is None else " AND bucket < %(end)s"
+    tail_end_filter = "" if end is None else " AND timestamp < %(end)s"
+    meter_filter = _meter_filter(by_keys)
+    select, group_by = _grouping('bucket', resolution, by_meter)
+    # The raw tail mirrors the view's definition: one row per meter and bucket
+    query = f"""
+    WITH buckets AS (
+        SELECT meter_key, bucket, avg_power, max_power, total_energy, {count} AS num_readings
+        FROM {view}
+        WHERE bucket >= %(start)s AND bucket < %(watermark)s{end_filter}{meter_filter}
+        UNION ALL
+        SELECT meter_key, time_bucket(%(width)s, timestamp) AS bucket,
+               AVG(power), MAX(power), SUM(energy), {tail_count}
+        FROM {RAW_TABLE}
+        WHERE timestamp >= GREATEST(%(start)s, %(watermark)s){tail_end_filter}{meter_filter}
+        GROUP BY meter_key, 2
+    )
+    SELECT {select}SUM(avg_power * num_readings) / SUM(num_readings) AS avg_power,
+           MAX(max_power) AS max_power,
+           SUM(total_energy) AS total_energy
+    FROM buckets"""
+    return _grouped(query, group_by)
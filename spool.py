@@ -0,0 +1,199 @@
+import os
+import glob
+import logging
+import threading
+
+# Spool parameters
+SPOOL_DIR = "spool"
+SEGMENT_MAX_BYTES = 16 * 1024 * 1024  # Seal the active segment once it grows past this
+
+# How hard the spool tries to get appended data onto disk:
+# - none:    leave it to the OS page cache (fastest, lost on power failure)
+# - segment: fsync each segment when it is sealed
+# - batch:   fsync after every appended batch (no acknowledged batch is lost)
+DURABILITY_LEVELS = ('none', 'segment', 'batch')
+DURABILITY = 'batch'
+
+SEGMENT_PATTERN = "segment-{:010d}.log"
+
+class Spool:
+    """Append-only, segmented on-disk log of readings awaiting the database.
+
+    Each record is one newline-terminated line in the COPY text format, so
+    a segment can be replayed with COPY FROM STDIN without re-encoding.
+    Appends go to the active segment; sealed segments are replayed in order
+    and deleted once committed. Replay progress within a segment is kept in
+    a small ``.offset`` file next to it so a restart resumes where it left off.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, durability=DURABILITY,
+                 segment_max_bytes=SEGMENT_MAX_BYTES):
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown spool durability level: {durability}")
+        self.directory = directory
+        self.durability = durability
+        self.segment_max_bytes = segment_max_bytes
+
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        existing = self._segment_paths()
+        for path in existing:
+            self._truncate_partial_record(path)
+        self._sealed = existing
+        self._next_sequence = self._sequence(existing[-1]) + 1 if existing else 1
+        self._active = None
+        self._active_path = None
+        self._active_bytes = 0
+
+        self.rows_appended = 0
+        if existing:
+            logging.info(f"Spool has {len(existing)} segment(s) left from a previous run")
+
+    def _segment_paths(self):
+        pattern = os.path.join(self.directory, SEGMENT_PATTERN.replace('{:010d}', '*'))
+        return sorted(glob.glob(pattern))
+
+    @staticmethod
+    def _sequence(path):
+        return int(os.path.basename(path).split('-')[1].split('.')[0])
+
+    @staticmethod
+    def _truncate_partial_record(path):
+        """Drop a torn last line left behind by a crash mid-append"""
+        with open(path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(max(size - 65536, 0))
+            tail = f.read()
+            if tail.endswith(b'\n'):
+                return
+            cut = tail.rfind(b'\n')
+            new_size = size - len(tail) + cut + 1 if cut >= 0 else 0
+            f.truncate(new_size)
+            logging.warning(f"Truncated partial record at end of {path}")
+
+    def _fsync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def append(self, copy_text, row_count):
+        """Append a batch of COPY-formatted lines to the active segment"""
+        data = copy_text.encode('utf-8')
+        with self._lock:
+            if self._active is None:
+                self._active_path = os.path.join(self.directory,
+                                                 SEGMENT_PATTERN.format(self._next_sequence))
+                self._next_sequence += 1
+                self._active = open(self._active_path, 'ab')
+                self._active_bytes = 0
+                if self.durability != 'none':
+                    self._fsync_directory()
+            self._active.write(data)
+            self._active.flush()
+            if self.durability == 'batch':
+                os.fsync(self._active.fileno())
+            self._active_bytes += len(data)
+            self.rows_appended += row_count
+            if self._active_bytes >= self.segment_max_bytes:
+                self._seal_active()
+
+    def _seal_active(self):
+        """Close the active segment and make it available for replay"""
+        if self._active is None:
+            return
+        if self.durability != 'none':
+            os.fsync(self._active.fileno())
+        self._active.close()
+        self._sealed.append(self._active_path)
+        self._active = None
+        self._active_path = None
+        self._active_bytes = 0
+
+    def seal(self):
+        """Seal the active segment so it can be replayed"""
+        with self._lock:
+            self._seal_active()
+
+    def segments(self):
+        """Sealed segments awaiting replay, oldest first"""
+        with self._lock:
+            return list(self._sealed)
+
+    def has_active(self):
+        with self._lock:
+            return self._active is not None
+
+    def pending_bytes(self):
+        """Bytes still waiting to be replayed, including the active segment"""
+        with self._lock:
+            total = self._active_bytes
+            for path in self._sealed:
+                try:
+                    total += os.path.getsize(path) - self._read_offset(path)
+                except OSError:
+                    pass
+            return total
+
+    @staticmethod
+    def _read_offset(path):
+        try:
+            with open(path + '.offset') as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def read_batches(self, path, batch_rows):
+        """Yield (copy_text, row_count, end_offset) from the last committed offset"""
+        with open(path, 'rb') as f:
+            f.seek(self._read_offset(path))
+            while True:
+                lines = []
+                for _ in range(batch_rows):
+                    line = f.readline()
+                    if not line:
+                        break
+                    lines.append(line)
+                if not lines:
+                    return
+                yield b''.join(lines).decode('utf-8'), len(lines), f.tell()
+
+    def commit(self, path, offset):
+        """Record that everything before ``offset`` in a segment is in the database"""
+        tmp_path = path + '.offset.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+            if self.durability != 'none':
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path + '.offset')
+
+    def remove(self, path):
+        """Delete a fully replayed segment"""
+        with self._lock:
+            self._sealed.remove(path)
+        for name in (path, path + '.offset'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def quarantine(self, path):
+        """Set aside a segment the database keeps rejecting"""
+        with self._lock:
+            self._sealed.remove(path)
+        os.replace(path, path + '.bad')
+        try:
+            os.remove(path + '.offset')
+        except FileNotFoundError:
+            pass
+        logging.error(f"Moved unreplayable spool segment to {path}.bad")
+
+    def close(self):
+        """Make the active segment durable; it is replayed on the next start"""
+        with self._lock:
+            self._seal_active()
@@ -0,0 +1,222 @@
+import os
+import time
+import queue
+import signal
+import logging
+import argparse
+import multiprocessing
+
+import mqtt_subscriber
+
+# Configure logging (replacing mqtt_subscriber's format so worker lines are labelled)
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s',
+                    force=True)
+
+# Example against a local mosquitto broker (which supports $share subscriptions):
+#   python subscriber_launcher.py --workers 4 --writer-threads 2
+#   python data_generator.py
+
+# Launcher parameters
+NUM_WORKERS = os.cpu_count() or 1
+SHARE_GROUP = "energy-ingest"
+RESTART_DELAY = 1.0  # Seconds before restarting a crashed worker (doubles per crash, capped)
+RESTART_MAX_DELAY = 60.0
+HEALTHY_UPTIME = 60.0  # A worker that stayed up this long has its restart delay reset
+REPORT_INTERVAL = 10.0  # Seconds between aggregated stats log lines
+SHUTDOWN_TIMEOUT = 30.0  # Seconds to wait for workers to flush on shutdown
+
+# Counters summed across workers; everything else in a stats snapshot is per worker state
+SUMMED_STATS = ('rows_written', 'batches_written', 'rows_spooled', 'rows_failed',
+                'duplicates_dropped', 'open_connections', 'reconnects', 'connect_failures',
+                'queue_depth', 'queue_dropped', 'queue_spilled', 'spool_backlog_bytes')
+# The summed stats that count up from zero in every worker process; a restarted
+# worker starts them again, so the launcher carries its predecessors' totals
+CUMULATIVE_STATS = ('rows_written', 'batches_written', 'rows_spooled', 'rows_failed',
+                    'duplicates_dropped', 'reconnects', 'connect_failures',
+                    'queue_dropped', 'queue_spilled')
+
+def shared_topic(group, topic):
+    """MQTT shared subscription filter so the broker load-balances across workers"""
+    return f"$share/{group}/{topic}"
+
+def worker_main(worker_id, subscriber_argv, stats_queue):
+    """Entry point of a worker process: one subscriber with its own DB writer"""
+    # Workers shut down on SIGTERM from the launcher; ignore the terminal's
+    # Ctrl-C so the launcher controls the shutdown order
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    args = mqtt_subscriber.parse_args(subscriber_argv)
+    mqtt_subscriber.run(args, stats_queue=stats_queue, worker_id=worker_id)
+
+class Worker:
+    """Bookkeeping for one supervised subscriber process"""
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.restart_delay = RESTART_DELAY
+        self.restart_at = 0.0
+        self.previous_totals = {name: 0 for name in CUMULATIVE_STATS}  # From exited processes
+
+class Launcher:
+    """Start N subscriber processes in a shared subscription and keep them running"""
+
+    def __init__(self, num_workers, subscriber_argv, stats_interval):
+        self.num_workers = num_workers
+        self.subscriber_argv = subscriber_argv
+        self.stats_interval = stats_interval
+        self.stats_queue = multiprocessing.Queue()
+        self.workers = [Worker(i) for i in range(num_workers)]
+        self.latest_stats = {}
+        self._stopping = False
+
+    def _worker_argv(self, worker):
+        # Every worker gets its own spool directory, spill file, trace file and
+        # metrics port; none of them can be shared between processes
+        argv = list(self.subscriber_argv)
+        args = mqtt_subscriber.parse_args(argv)
+        if args.spool_dir:
+            argv += ['--spool-dir', os.path.join(args.spool_dir, f"worker-{worker.worker_id}")]
+        root, ext = os.path.splitext(args.spill_path)
+        argv += ['--spill-path', f"{root}-worker-{worker.worker_id}{ext}",
+                 '--stats-interval', str(self.stats_interval)]
+        if args.trace_file:
+            root, ext = os.path.splitext(args.trace_file)
+            argv += ['--trace-file', f"{root}-worker-{worker.worker_id}{ext}"]
+        if args.metrics_port:
+            # Consecutive ports, one metrics endpoint per worker
+            argv += ['--metrics-port', str(args.metrics_port + worker.worker_id)]
+        return argv
+
+    def _start(self, worker):
+        worker.process = multiprocessing.Process(
+            target=worker_main,
+            args=(worker.worker_id, self._worker_argv(worker), self.stats_queue),
+            name=f"subscriber-{worker.worker_id}")
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        logging.info(f"Started worker {worker.worker_id} (pid {worker.process.pid})")
+
+    def _supervise(self):
+        """Restart workers that exited, with per-worker exponential backoff"""
+        now = time.monotonic()
+        for worker in self.workers:
+            if worker.process.is_alive():
+                if now - worker.started_at >= HEALTHY_UPTIME:
+                    worker.restart_delay = RESTART_DELAY
+                continue
+            if worker.restart_at == 0.0:
+                logging.error(f"Worker {worker.worker_id} exited with code "
+                              f"{worker.process.exitcode}, restarting in {worker.restart_delay:.0f}s")
+                worker.restart_at = now + worker.restart_delay
+                worker.restart_delay = min(worker.restart_delay * 2, RESTART_MAX_DELAY)
+            elif now >= worker.restart_at:
+                worker.restart_at = 0.0
+                worker.restarts += 1
+                self._retire_stats(worker)
+                self._start(worker)
+
+    def _retire_stats(self, worker):
+        """Fold an exited process's last snapshot into its worker's running totals"""
+        self._drain_stats()
+        stats = self.latest_stats.pop(worker.worker_id, {})
+        for name in CUMULATIVE_STATS:
+            worker.previous_totals[name] += stats.get(name, 0)
+
+    def _drain_stats(self):
+        while True:
+            try:
+                worker_id, stats = self.stats_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.latest_stats[worker_id] = stats
+
+    def aggregate_stats(self):
+        """Sum the latest snapshot of every worker, plus the totals of restarted ones"""
+        totals = {name: 0 for name in SUMMED_STATS}
+        for worker in self.workers:
+            for name in CUMULATIVE_STATS:
+                totals[name] += worker.previous_totals[name]
+        for stats in self.latest_stats.values():
+            for name in SUMMED_STATS:
+                totals[name] += stats.get(name, 0)
+        totals['workers_alive'] = sum(1 for w in self.workers if w.process.is_alive())
+        totals['worker_restarts'] = sum(w.restarts for w in self.workers)
+        return totals
+
+    def stop(self, signum=None, frame=None):
+        self._stopping = True
+
+    def run(self, report_interval=REPORT_INTERVAL):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for worker in self.workers:
+            self._start(worker)
+
+        last_report = time.monotonic()
+        last_rows = 0
+        while not self._stopping:
+            time.sleep(0.5)
+            self._drain_stats()
+            self._supervise()
+
+            now = time.monotonic()
+            if now - last_report >= report_interval:
+                totals = self.aggregate_stats()
+                rate = (totals['rows_written'] - last_rows) / (now - last_report)
+                logging.info(f"{totals['workers_alive']}/{self.num_workers} workers, "
+                             f"{rate:.0f} rows/s, {totals['rows_written']} rows written, "
+                             f"{totals['rows_spooled']} spooled, {totals['duplicates_dropped']} duplicates, "
+                             f"{totals['rows_failed']} failed, "
+                             f"queue depth {totals['queue_depth']}, "
+                             f"{totals['reconnects']} reconnects, "
+                             f"{totals['worker_restarts']} worker restarts")
+                last_report, last_rows = now, totals['rows_written']
+
+        self.shutdown()
+
+    def shutdown(self):
+        """Ask every worker to flush and exit, then wait for them"""
+        logging.info("Stopping workers")
+        for worker in self.workers:
+            if worker.process.is_alive():
+                worker.process.terminate()  # SIGTERM: disconnect, flush, exit
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for worker in self.workers:
+            worker.process.join(max(deadline - time.monotonic(), 0))
+            if worker.process.is_alive():
+                logging.error(f"Worker {worker.worker_id} did not exit in time, killing it")
+                worker.process.kill()
+                worker.process.join()
+        self._drain_stats()
+        logging.info(f"Final totals: {self.aggregate_stats()}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run several mqtt_subscriber workers in an MQTT shared subscription. "
+                    "Arguments not listed here are passed through to every worker.")
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS,
+                        help=f"number of subscriber processes (default: {NUM_WORKERS})")
+    parser.add_argument('--group', default=SHARE_GROUP,
+                        help=f"shared subscription group name (default: {SHARE_GROUP})")
+    parser.add_argument('--report-interval', type=float, default=REPORT_INTERVAL,
+                        help=f"seconds between aggregated stats lines (default: {REPORT_INTERVAL})")
+    args, subscriber_argv = parser.parse_known_args()
+
+    # Validate the pass-through arguments once, up front
+    subscriber_args = mqtt_subscriber.parse_args(subscriber_argv)
+    subscriber_argv += ['--topic', shared_topic(args.group, subscriber_args.topic)]
+    if subscriber_args.gateway_topic:
+        subscriber_argv += ['--gateway-topic', shared_topic(args.group, subscriber_args.gateway_topic)]
+
+    logging.info(f"Launching {args.workers} subscriber workers on "
+                 f"{shared_topic(args.group, subscriber_args.topic)}")
+    launcher = Launcher(args.workers, subscriber_argv,
+                        stats_interval=min(args.report_interval, subscriber_args.stats_interval))
+    launcher.run(args.report_interval)
+
+if __name__ == "__main__":
+    main()
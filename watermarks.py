@@ -0,0 +1,154 @@
+import time
+import logging
+
+import psycopg2
+
+# Seconds a watermark read is reused before the table is read again
+CACHE_TTL = 10.0
+# Seconds before checking again whether ingest_watermarks exists, so a table
+# created (or dropped) while a long-lived cache is in use is picked up
+TABLE_CHECK_TTL = 60.0
+
+# The subscribers upsert ingest_watermarks on every flush (ingest_watermarks_setup.sql);
+# without the table, watermarks fall back to MAX(timestamp) over the hypertable
+WATERMARKS_TABLE_QUERY = "SELECT to_regclass('ingest_watermarks') IS NOT NULL"
+LATEST_QUERY = "SELECT MAX(latest) FROM ingest_watermarks"
+LATEST_FOR_METER_QUERY = "SELECT latest FROM ingest_watermarks WHERE meter_key = %s"
+RAW_LATEST_QUERY = "SELECT MAX(timestamp) FROM energy_readings"
+RAW_LATEST_FOR_METER_QUERY = "SELECT MAX(timestamp) FROM energy_readings WHERE meter_key = %s"
+LATEST_FOR_METERS_QUERY = "SELECT meter_key, latest FROM ingest_watermarks WHERE meter_key = ANY(%s)"
+RAW_LATEST_FOR_METERS_QUERY = """
+SELECT meter_key, MAX(timestamp)
+FROM energy_readings
+WHERE meter_key = ANY(%s)
+GROUP BY meter_key
+"""
+
+# Rebuild watermarks from stored readings, for writers that bypass the
+# subscriber (backfills, bulk loads); ``since`` limits the scan to new chunks
+REFRESH_QUERY = """
+INSERT INTO ingest_watermarks (meter_key, latest)
+SELECT meter_key, MAX(timestamp)
+FROM energy_readings
+WHERE timestamp >= %s
+GROUP BY meter_key
+ORDER BY meter_key
+ON CONFLICT (meter_key) DO UPDATE
+SET latest = EXCLUDED.latest, updated_at = NOW()
+WHERE EXCLUDED.latest > ingest_watermarks.latest
+"""
+
+def watermarks_available(conn):
+    """Whether ingest_watermarks exists in this database"""
+    with conn.cursor() as cursor:
+        cursor.execute(WATERMARKS_TABLE_QUERY)
+        available = cursor.fetchone()[0]
+    conn.rollback()
+    return available
+
+def refresh_watermarks(conn, since):
+    """Raise watermarks to the newest readings stored since ``since``; False without the table"""
+    if not watermarks_available(conn):
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute(REFRESH_QUERY, (since,))
+    conn.commit()
+    return True
+
+class WatermarkCache:
+    """Latest ingested reading time, overall and per meter, cached for ``ttl`` seconds.
+
+    Reads the small ingest_watermarks table rather than the head of every
+    hypertable chunk; when the table is missing (or still empty) it falls
+    back to MAX(timestamp), which is cached all the same. Reads borrow a
+    connection from ``pool`` (a mqtt_subscriber.ConnectionPool), so one
+    cache can be shared by concurrent sessions.
+    """
+
+    def __init__(self, pool, ttl=CACHE_TTL):
+        self.pool = pool
+        self.ttl = ttl
+        self._cache = {}  # meter_key (None = overall) -> (value, monotonic time read)
+        self.from_table = None
+        self._table_checked = None  # monotonic time of the last check
+        self._check_table()
+
+    def _check_table(self):
+        """Check for ingest_watermarks, at most once per TABLE_CHECK_TTL"""
+        if self._table_checked is not None and time.monotonic() - self._table_checked < TABLE_CHECK_TTL:
+            return
+        try:
+            with self.pool.connection() as conn:
+                available = watermarks_available(conn)
+        except psycopg2.Error as e:
+            logging.warning(f"Could not check for ingest_watermarks: {e}")
+            available = False
+        self._table_checked = time.monotonic()
+        if not available and self.from_table is not False:
+            logging.warning("ingest_watermarks not found; using MAX(timestamp) on energy_readings")
+        elif available and self.from_table is False:
+            logging.info("ingest_watermarks found; reading watermarks from it")
+        self.from_table = available
+
+    def _read(self, query, fallback_query, params=()):
+        self._check_table()
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                value = None
+                if self.from_table:
+                    cursor.execute(query, params)
+                    row = cursor.fetchone()
+                    if row is not None:
+                        value = row[0]
+                if value is None:
+                    cursor.execute(fallback_query, params)
+                    value = cursor.fetchone()[0]
+            conn.rollback()
+        return value
+
+    def _get(self, meter_key, query, fallback_query, params=()):
+        cached = self._cache.get(meter_key)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        value = self._read(query, fallback_query, params)
+        self._cache[meter_key] = (value, time.monotonic())
+        return value
+
+    def latest(self):
+        """Newest reading time across all meters, or None when there is no data"""
+        return self._get(None, LATEST_QUERY, RAW_LATEST_QUERY)
+
+    def latest_for(self, meter_key):
+        """Newest reading time of one meter, or None when it has no data"""
+        return self._get(meter_key, LATEST_FOR_METER_QUERY, RAW_LATEST_FOR_METER_QUERY, (meter_key,))
+
+    def latest_for_meters(self, meter_keys):
+        """Newest reading time of each meter (None when it has no data), in one query"""
+        now = time.monotonic()
+        result, missing = {}, []
+        for meter_key in meter_keys:
+            cached = self._cache.get(meter_key)
+            if cached is not None and now - cached[1] < self.ttl:
+                result[meter_key] = cached[0]
+            else:
+                missing.append(meter_key)
+        if missing:
+            self._check_table()
+            found = {}
+            with self.pool.connection() as conn:
+                with conn.cursor() as cursor:
+                    if self.from_table:
+                        cursor.execute(LATEST_FOR_METERS_QUERY, (missing,))
+                        found = dict(cursor.fetchall())
+                    remaining = [meter_key for meter_key in missing if found.get(meter_key) is None]
+                    if remaining:
+                        cursor.execute(RAW_LATEST_FOR_METERS_QUERY, (remaining,))
+                        found.update(cursor.fetchall())
+                conn.rollback()
+            for meter_key in missing:
+                result[meter_key] = found.get(meter_key)
+                self._cache[meter_key] = (result[meter_key], now)
+        return result
+
+    def invalidate(self):
+        self._cache.clear()